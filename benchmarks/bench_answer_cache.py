@@ -0,0 +1,123 @@
+"""
+Caché de respuestas: coste de consulta, aciertos y falsos positivos.
+
+Indexa `--entries` preguntas sintéticas (plantillas x temas x edades) y
+consulta una mezcla de preguntas repetidas con otra redacción (mayúsculas,
+tildes, signos, palabras vacías), preguntas iguales salvo un dato (otra edad,
+que deben fallar), las mismas preguntas en negativo o con el opuesto ("no
+llore", "sin lactosa" frente a "con lactosa", que también deben fallar) y
+seguimientos que dependen del contexto (que deben saltarse la caché). Las
+respuestas de una parte de las entradas llevan el nombre del usuario que
+preguntó: esas no deben guardarse ni servirse a nadie más. Imprime el coste
+por consulta, la tasa de aciertos y los falsos positivos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_answer_cache --entries 2000 --queries 20000
+"""
+import argparse
+import itertools
+import random
+import time
+
+from telegram_openai_assistant.answer_cache import AnswerCache
+
+TEMPLATES = [
+    "¿Cuántas horas debe dormir {topic} de {age}?",
+    "¿Qué cantidad de leche necesita {topic} de {age}?",
+    "¿Es normal que {topic} de {age} llore por la noche?",
+    "¿Cuándo le salen los dientes a {topic} de {age}?",
+    "¿Qué vacunas le tocan a {topic} de {age}?",
+    "¿Cuánto debe pesar {topic} de {age}?",
+    "¿Es normal que {topic} de {age} duerma boca abajo durante la siesta?",
+    "¿Puede tomar leche con lactosa {topic} de {age}?",
+]
+TOPICS = ["un bebé", "una niña", "un niño", "mi hija", "mi hijo", "un recién nacido", "un prematuro", "unos gemelos"]
+AGES = [f"{n} {unit}" for unit in ("semanas", "meses", "años") for n in range(1, 25)]
+# La primera que encaja le da la vuelta a la pregunta
+FLIPS = [(" con ", " sin "), (" sin ", " con "), ("que ", "que no "), (" debe ", " no debe "),
+         (" necesita ", " no necesita "), (" le ", " no le ")]
+FOLLOW_UPS = ["¿Y eso es normal?", "gracias", "Vale, ¿y por la noche?", "¿Lo que me dijiste antes vale para ella?"]
+
+
+def rephrase(question, rng):
+    """La misma pregunta escrita de otra manera: sin signos, sin tildes, en mayúsculas o con muletillas."""
+    variants = [
+        question.lower().strip("¿?"),
+        question.replace("á", "a").replace("é", "e").replace("í", "i").replace("ó", "o").replace("ú", "u"),
+        question.upper(),
+        "Hola, " + question,
+        question.replace("¿", "").replace("?", " por favor?"),
+    ]
+    return rng.choice(variants)
+
+
+def flip(question):
+    """La misma pregunta en negativo o con el opuesto."""
+    for old, new in FLIPS:
+        if old in question:
+            return question.replace(old, new, 1)
+    raise ValueError(question)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    combinations = list(itertools.product(TEMPLATES, TOPICS, AGES))
+    rng.shuffle(combinations)
+    indexed = combinations[:args.entries]
+    answers = {template.format(topic=topic, age=age): f"respuesta {number}"
+               for number, (template, topic, age) in enumerate(indexed)}
+    # Una de cada diez respuestas saluda por su nombre a quien preguntó
+    personal = {question for number, question in enumerate(answers) if number % 10 == 0}
+    cache = AnswerCache(max_entries=args.entries)
+    start = time.perf_counter()
+    for question, answer in answers.items():
+        if question in personal:
+            cache.add(f"[INFORMACIÓN DEL USUARIO: Nombre=Marta]\n\n{question}", f"Marta, {answer}", user_name="Marta")
+        else:
+            cache.add(question, answer, user_name="Marta")
+    build = time.perf_counter() - start
+    print(f"índice: {len(cache)} preguntas en {build * 1e3:.0f} ms ({build / len(indexed) * 1e6:.1f} µs por pregunta)")
+
+    outcomes = {"repeated": [0, 0], "changed_fact": [0, 0], "flipped": [0, 0], "follow_up": [0, 0]}
+    wrong = 0
+    start = time.perf_counter()
+    for _ in range(args.queries):
+        kind = rng.choices(("repeated", "changed_fact", "flipped", "follow_up"), weights=(6, 3, 2, 1))[0]
+        template, topic, age = rng.choice(indexed)
+        original = template.format(topic=topic, age=age)
+        if kind == "repeated":
+            query = rephrase(original, rng)
+        elif kind == "changed_fact":
+            query = template.format(topic=topic, age=rng.choice([other for other in AGES if other != age]))
+        elif kind == "flipped":
+            query = rephrase(flip(original), rng)
+        else:
+            query = rng.choice(FOLLOW_UPS)
+        hit = cache.lookup(query)
+        outcomes[kind][0] += 1
+        if hit is not None:
+            outcomes[kind][1] += 1
+            # Una edad distinta que sí está indexada tiene su propia respuesta: servirla es correcto
+            expected = answers[original] if kind == "repeated" else answers.get(query)
+            if kind == "flipped" or (kind == "repeated" and original in personal):
+                expected = None
+            if hit[0] != expected:
+                wrong += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"consulta: {elapsed / args.queries * 1e6:.1f} µs de media")
+    for kind, (total, hits) in outcomes.items():
+        print(f"  {kind:13} {hits:6}/{total:<6} servidas desde la caché ({hits / total:.0%})")
+    print(f"respuestas equivocadas: {wrong}")
+    print(f"estadísticas: {cache.stats}, tasa de aciertos {cache.hit_rate:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Comprueba que N chats simultáneos terminan en el tiempo del run más lento y no
+en la suma de todos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_concurrency --chats 20
+"""
+import argparse
+import asyncio
+import time
+
+from telegram_openai_assistant.assistant_handler import AssistantHandler
+from telegram_openai_assistant.thread_registry import ThreadRegistry
+
+from .fakes import FakeAsyncOpenAI
+
+
+async def run(chats: int, latencies):
+    client = FakeAsyncOpenAI(delta_latencies=latencies)
+    handler = AssistantHandler(client, "asst_bench", ThreadRegistry(":memory:"))
+    sent = {}
+
+    def sender(group_id):
+        async def send_to_telegram(chunk):
+            sent.setdefault(group_id, []).append(chunk)
+        return send_to_telegram
+
+    # Coste de referencia de un run aislado, para calcular la suma secuencial
+    per_run = []
+    for latency in latencies:
+        solo = AssistantHandler(FakeAsyncOpenAI(delta_latencies=(latency,)), "asst_solo", ThreadRegistry(":memory:"))
+        start = time.perf_counter()
+        await solo.stream_response(0, "hola", sender(0))
+        per_run.append(time.perf_counter() - start)
+    sequential = sum(per_run[i % len(per_run)] for i in range(chats))
+    slowest = max(per_run)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        handler.stream_response(group_id, f"pregunta {group_id}", sender(group_id))
+        for group_id in range(1, chats + 1)
+    ))
+    concurrent = time.perf_counter() - start
+
+    answered = sum(1 for group_id in range(1, chats + 1) if sent.get(group_id))
+    print(f"chats={chats} respondidos={answered}")
+    print(f"suma secuencial estimada: {sequential:.3f}s")
+    print(f"run más lento:            {slowest:.3f}s")
+    print(f"concurrente (medido):     {concurrent:.3f}s")
+    print(f"ratio concurrente/lento:  {concurrent / slowest:.2f}")
+    return concurrent, slowest, answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--latencies", type=float, nargs="+", default=[0.02, 0.05, 0.1])
+    args = parser.parse_args()
+    concurrent, slowest, answered = asyncio.run(run(args.chats, args.latencies))
+    # Margen para el overhead del loop: los runs deben solaparse, no encadenarse
+    assert answered == args.chats, "algún chat no recibió respuesta"
+    assert concurrent < slowest * 1.5, "los runs se están ejecutando en serie"
+
+
+if __name__ == "__main__":
+    main()
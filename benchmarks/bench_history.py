@@ -0,0 +1,68 @@
+"""
+Historial por chat: memoria con muchos chats y turnos frente a la lista global.
+
+Simula `--chats` usuarios distintos (cada día escribe una parte de ellos) que
+hacen `--turns` turnos cada uno, y guarda pregunta y respuesta en un
+`ChatHistory` y en una lista global como la que usaba antes `AssistantHandler`.
+Imprime, cada cierto número de turnos, los chats y mensajes retenidos y la
+memoria estimada de ambos, y el coste por `add`.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_history --chats 50000 --turns 10 --max-mb 8
+"""
+import argparse
+import random
+import sys
+import time
+
+from telegram_openai_assistant.history import ChatHistory
+
+ANSWER = "Es normal que un bebé de esa edad se despierte varias veces por la noche. " * 8
+
+
+def list_bytes(history) -> int:
+    """Memoria aproximada de la lista global de dicts."""
+    if not history:
+        return 0
+    sample = history[-1]
+    per_item = sys.getsizeof(sample) + 8
+    return sys.getsizeof(history) + sum(per_item + sys.getsizeof(item["content"]) for item in history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50000)
+    parser.add_argument("--turns", type=int, default=10, help="turnos por chat")
+    parser.add_argument("--per-chat", type=int, default=20)
+    parser.add_argument("--max-mb", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    history = ChatHistory(per_chat=args.per_chat, max_bytes=int(args.max_mb * 1024 * 1024))
+    legacy = []
+    total = args.chats * args.turns
+    # Los chats se van incorporando poco a poco y los más recientes escriben más
+    report_every = max(1, total // 5)
+    elapsed = 0.0
+    for turn in range(1, total + 1):
+        active = max(1, args.chats * turn // total)
+        group_id = active - 1 - min(active - 1, int(rng.expovariate(1 / 200)))
+        question = f"¿Cuántas horas debe dormir un bebé de {rng.randint(1, 24)} meses?"
+        start = time.perf_counter()
+        history.add(group_id, "user", question)
+        history.add(group_id, "assistant", ANSWER)
+        elapsed += time.perf_counter() - start
+        legacy.append({"role": "user", "content": question})
+        legacy.append({"role": "assistant", "content": ANSWER})
+        if turn % report_every == 0:
+            print(f"{turn:8} turnos: ChatHistory {len(history):6} chats, {history.records:7} mensajes, "
+                  f"{history.bytes / 1e6:6.1f} MB | lista global {len(legacy):8} mensajes, "
+                  f"{list_bytes(legacy) / 1e6:7.1f} MB")
+    print(f"add: {elapsed / (2 * total) * 1e6:.2f} µs de media")
+    print(f"estadísticas: {history.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Prueba de carga del bot completo sin red.
+
+Arranca la API de Assistants y la Bot API falsas de `fake_apis`, apunta a ellas
+el bot real (`OPENAI_BASE_URL`, `TELEGRAM_API_URL`) y lanza `--chats` usuarios
+simultáneos que mandan `--turns` mensajes cada uno, esperando la respuesta
+antes del siguiente. Cada mensaje entra como una actualización de Telegram por
+`Bot.deliver_update`, así que recorre handlers, `ConversationManager`, cola por
+chat, `AssistantHandler`, streaming y planificador de salida.
+
+Informa del throughput, de los percentiles del tiempo hasta el primer mensaje
+de la respuesta y del turno completo, y de las tasas de error. Con
+`--max-error-rate` y `--max-p95-ms` termina con código 1 si se superan, para
+usarlo en CI. El resto de la configuración del bot (STREAM_MODE,
+MAX_CONCURRENT_RUNS, ...) se toma del entorno como siempre.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_load --chats 50 --turns 5
+    python -m benchmarks.bench_load --chats 200 --rate-limit-ratio 0.05 --json resultados.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from .fake_apis import FakeAssistantsAPI, FakeBotAPI
+
+QUESTIONS = [
+    "¿Cuántas horas debe dormir un bebé de 4 meses?",
+    "¿Es normal tener náuseas en la semana 10 de embarazo?",
+    "¿Cuándo empiezo a darle fruta a mi hijo?",
+    "Mi bebé tiene 38 de fiebre, ¿qué hago?",
+]
+
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def configure_environment(workdir, assistants, bot_api):
+    """Apunta el bot a los servidores falsos y deja sus archivos en `workdir`."""
+    os.environ.update({
+        "CLIENT_API_KEY": "sk-load-test",
+        "OPENAI_BASE_URL": assistants.url + "/v1",
+        "TELEGRAM_API_URL": bot_api.url,
+        "BOT_MODE": "polling",
+        "STATE_BACKEND": "sqlite",
+        "THREADS_DB_PATH": os.path.join(workdir, "threads.sqlite3"),
+        "QA_LOG_DIR": workdir,
+        "MESSAGE_COUNT_PATH": os.path.join(workdir, "message_count.json"),
+        "IMAGE_CACHE_PATH": os.path.join(workdir, "image_cache.sqlite3"),
+    })
+    # La persistencia de cada bot se guarda en ./data
+    os.chdir(workdir)
+
+
+def make_update(update_id, message_id, chat_id, text):
+    user = {"id": chat_id, "is_bot": False, "first_name": f"Usuario{chat_id}", "username": f"usuario{chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def run(args, workdir):
+    assistants = FakeAssistantsAPI(
+        queued_time=args.queued_time, queued_jitter=args.queued_jitter,
+        first_token_latency=args.first_token_latency, token_rate=args.token_rate,
+        rate_limit_ratio=args.rate_limit_ratio, api_latency=args.api_latency, seed=args.seed,
+    )
+    bot_api = FakeBotAPI(send_latency=args.send_latency)
+    await assistants.start()
+    await bot_api.start()
+    configure_environment(workdir, assistants, bot_api)
+
+    # Después de fijar el entorno: config.py lo lee al importarse
+    from telegram_openai_assistant.bot import Bot
+    from telegram_openai_assistant.conversation_manager import ConversationManager
+    from telegram_openai_assistant.log import configure_logging, shutdown_logging
+
+    configure_logging(args.log_level, "text", stream=sys.stderr)
+    manager = ConversationManager()
+    bots = {
+        f"LoadBot{i}": Bot(f"LoadBot{i}", f"{100000 + i}:LOAD-TEST", "asst_load_test", manager)
+        for i in range(args.bots)
+    }
+    manager.register_bots(bots)
+    await manager.start()
+    await asyncio.gather(*(bot.start("external") for bot in bots.values()))
+
+    # Se envuelve handle_turn para saber cuándo termina cada turno y si se aceptó
+    finished = {}
+    handle_turn = manager.handle_turn
+
+    async def tracked_handle_turn(group_id, message, bot_name=None):
+        accepted = await handle_turn(group_id, message, bot_name)
+        future = finished.pop(group_id, None)
+        if future is not None and not future.done():
+            future.set_result(accepted)
+        return accepted
+
+    manager.handle_turn = tracked_handle_turn
+
+    marker = assistants.answer.split()[0]
+    update_ids, message_ids = itertools.count(1), itertools.count(1)
+    rng = random.Random(args.seed)
+    first_message, turn_time = [], []
+    outcomes = {"ok": 0, "no_answer": 0, "rejected": 0, "timeout": 0}
+    bot_list = list(bots.values())
+
+    async def user(index):
+        chat_id = 1000 + index
+        bot = bot_list[index % len(bot_list)]
+        await asyncio.sleep(rng.uniform(0, args.ramp))
+        for _ in range(args.turns):
+            done = finished[chat_id] = asyncio.get_running_loop().create_future()
+            sent_before = len(bot_api.sent)
+            start = time.perf_counter()
+            await bot.deliver_update(make_update(next(update_ids), next(message_ids), chat_id, rng.choice(QUESTIONS)))
+            try:
+                accepted = await asyncio.wait_for(done, args.turn_timeout)
+            except asyncio.TimeoutError:
+                finished.pop(chat_id, None)
+                outcomes["timeout"] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            if not accepted:
+                outcomes["rejected"] += 1
+                continue
+            answer_at = next((at for at, chat, _, text in bot_api.sent[sent_before:]
+                              if chat == chat_id and marker in text), None)
+            if answer_at is None:
+                outcomes["no_answer"] += 1
+                continue
+            outcomes["ok"] += 1
+            first_message.append(answer_at - start)
+            turn_time.append(elapsed)
+            await asyncio.sleep(rng.uniform(0, args.think))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(index) for index in range(args.chats)))
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*(bot.stop() for bot in bots.values()))
+    await manager.shutdown()
+    shutdown_logging()
+    await assistants.stop()
+    await bot_api.stop()
+
+    total = sum(outcomes.values())
+    errors = total - outcomes["ok"]
+    results = {
+        "chats": args.chats, "turns": total, "bots": args.bots, "seconds": round(elapsed, 3),
+        "turns_per_second": round(outcomes["ok"] / elapsed, 2),
+        "messages_per_second": round((bot_api.stats["sent"] + bot_api.stats["edited"]) / elapsed, 2),
+        "first_message_ms": {name: round(percentile(first_message, q) * 1000, 1) for name, q in PERCENTILES},
+        "turn_ms": {name: round(percentile(turn_time, q) * 1000, 1) for name, q in PERCENTILES},
+        "outcomes": outcomes,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "openai": assistants.stats,
+        "telegram": bot_api.stats,
+    }
+    return results
+
+
+def report(results):
+    first, turn = results["first_message_ms"], results["turn_ms"]
+    print(f"{results['chats']} chats, {results['turns']} turnos, {results['bots']} bot(s) en {results['seconds']:.2f}s")
+    print(f"throughput:      {results['turns_per_second']:.2f} turnos/s, "
+          f"{results['messages_per_second']:.2f} envíos+ediciones/s")
+    print(f"primer mensaje:  p50 {first['p50']:.0f} ms, p95 {first['p95']:.0f} ms, p99 {first['p99']:.0f} ms")
+    print(f"turno completo:  p50 {turn['p50']:.0f} ms, p95 {turn['p95']:.0f} ms, p99 {turn['p99']:.0f} ms")
+    print(f"resultados:      {results['outcomes']} (tasa de error {results['error_rate']:.2%})")
+    print(f"OpenAI falso:    {results['openai']}")
+    print(f"Bot API falsa:   {results['telegram']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=3, help="mensajes por chat")
+    parser.add_argument("--bots", type=int, default=1)
+    parser.add_argument("--ramp", type=float, default=1.0, help="segundos en los que arrancan todos los chats")
+    parser.add_argument("--think", type=float, default=0.5, help="pausa máxima entre respuesta y mensaje")
+    parser.add_argument("--turn-timeout", type=float, default=60.0)
+    parser.add_argument("--queued-time", type=float, default=0.2, help="segundos de cada run en cola")
+    parser.add_argument("--queued-jitter", type=float, default=0.3)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens por segundo de cada run")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="fracción de POST a OpenAI con 429")
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--send-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    parser.add_argument("--max-error-rate", type=float, help="falla si la tasa de error la supera")
+    parser.add_argument("--max-p95-ms", type=float, help="falla si el p95 del primer mensaje lo supera")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_load_") as workdir:
+        try:
+            results = asyncio.run(run(args, workdir))
+        finally:
+            os.chdir(cwd)
+    report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    failed = False
+    if args.max_error_rate is not None and results["error_rate"] > args.max_error_rate:
+        print(f"FALLO: tasa de error {results['error_rate']:.2%} > {args.max_error_rate:.2%}")
+        failed = True
+    if args.max_p95_ms is not None and results["first_message_ms"]["p95"] > args.max_p95_ms:
+        print(f"FALLO: p95 del primer mensaje {results['first_message_ms']['p95']:.0f} ms > {args.max_p95_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
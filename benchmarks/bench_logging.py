@@ -0,0 +1,79 @@
+"""
+Coste por registro en el hilo del bot: `print` síncrono frente al logging por cola.
+
+Mide cuánto tarda en volver cada llamada (el trabajo que queda en el event
+loop) con la salida a /dev/null: el antiguo `print(f"[DEBUG] ...")`, un
+`logger.debug` con el nivel desactivado, uno descartado por muestreo y un
+`logger.info` que se encola para el hilo de escritura. Al final comprueba que
+los turnos muestreados conservan todos sus registros.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_logging --records 200000
+"""
+import argparse
+import io
+import json
+import os
+import time
+from contextlib import redirect_stdout
+
+from telegram_openai_assistant.log import configure_logging, get_logger, new_trace, shutdown_logging
+
+logger = get_logger("bench")
+MESSAGE = "¿Cuántas horas debe dormir un bebé de 4 meses?"
+
+
+def per_call(fn, records):
+    start = time.perf_counter()
+    for i in range(records):
+        fn(i)
+    return (time.perf_counter() - start) / records * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--turns", type=int, default=1_000)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull:
+        with redirect_stdout(devnull):
+            cost = per_call(lambda i: print(f"[DEBUG] Procesando mensaje para group_id: {i}: {MESSAGE}"), args.records)
+        print(f"print síncrono:               {cost:6.2f} µs/registro")
+
+        configure_logging("INFO", "json", queue_size=args.records + 1, stream=devnull)
+        cost = per_call(lambda i: logger.debug("Procesando mensaje para group_id: %s", i), args.records)
+        print(f"logger.debug con nivel INFO:  {cost:6.2f} µs/registro")
+
+        configure_logging("DEBUG", "json", sample_rate=0.0, queue_size=args.records + 1, stream=devnull)
+        new_trace(bot="Regen", chat_id=1)
+        cost = per_call(lambda i: logger.debug("Procesando mensaje para group_id: %s", i), args.records)
+        print(f"logger.debug fuera de muestra: {cost:5.2f} µs/registro")
+
+        configure_logging("DEBUG", "json", queue_size=args.records + 1, stream=devnull)
+        new_trace(bot="Regen", chat_id=2)
+        cost = per_call(lambda i: logger.info("Procesando mensaje para group_id: %s", i), args.records)
+        shutdown_logging()
+        print(f"logger.info encolado:         {cost:6.2f} µs/registro")
+
+    # Reconstrucción de turnos: o están todos los registros de un turno o ninguno
+    output = io.StringIO()
+    configure_logging("DEBUG", "json", sample_rate=args.sample_rate, stream=output)
+    for turn in range(args.turns):
+        new_trace(bot="Regen", chat_id=turn)
+        for step in ("recibido", "encolado", "run", "enviado"):
+            logger.debug("Turno %s: %s", turn, step)
+    shutdown_logging()
+    per_trace = {}
+    for line in output.getvalue().splitlines():
+        record = json.loads(line)
+        per_trace[record["trace_id"]] = per_trace.get(record["trace_id"], 0) + 1
+    complete = sum(1 for count in per_trace.values() if count == 4)
+    print(f"turnos muestreados: {len(per_trace)}/{args.turns} (objetivo {args.sample_rate:.0%}), "
+          f"completos: {complete}/{len(per_trace)}")
+
+
+if __name__ == "__main__":
+    main()
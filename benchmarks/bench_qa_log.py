@@ -0,0 +1,98 @@
+"""
+Coste de escritura del log de Q&A a medida que crece el histórico.
+
+Escribe `--records` registros con `QALog` e imprime el tiempo por tramo: con el
+log append-only el coste por registro se mantiene plano hasta 1M. Como
+referencia, mide también el antiguo `json.load` + `json.dump` de todo el array
+para unos pocos miles de registros.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_qa_log --records 1000000
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from telegram_openai_assistant.qa_log import QALog, iter_records
+
+RECORD = {
+    "telegram_id": 123456789,
+    "username": "Lucía",
+    "question": "¿Cuántas horas debe dormir un bebé de 4 meses?",
+    "answer": "A los 4 meses la mayoría de bebés duermen entre 12 y 16 horas al día, incluidas las siestas.",
+}
+
+
+def legacy_save_qa(path: Path, record):
+    """Copia del antiguo utils.save_qa: lee todo el array y lo reescribe."""
+    if not path.exists():
+        path.write_text("[]")
+    with open(path, "r+") as file:
+        data = json.load(file)
+        data.append(record)
+        file.seek(0)
+        json.dump(data, file, indent=4)
+
+
+async def bench_qa_log(directory: Path, records: int, segments: int):
+    log = QALog(directory / "bench.jsonl", batch_size=1000, flush_interval=0.5)
+    await log.start()
+    per_segment = records // segments
+    results = []
+    for segment in range(segments):
+        start = time.perf_counter()
+        for i in range(per_segment):
+            log.log(RECORD)
+            # Cede el loop de vez en cuando como haría un bot real entre mensajes
+            if i % log.batch_size == 0:
+                await asyncio.sleep(0)
+        await log.flush()
+        elapsed = time.perf_counter() - start
+        results.append(elapsed)
+        written = (segment + 1) * per_segment
+        print(f"  hasta {written:>9,} registros: {elapsed / per_segment * 1e6:7.2f} µs/registro")
+    await log.close()
+    return results
+
+
+def bench_legacy(directory: Path, records: int, segments: int):
+    path = directory / "legacy.json"
+    per_segment = records // segments
+    for segment in range(segments):
+        start = time.perf_counter()
+        for _ in range(per_segment):
+            legacy_save_qa(path, RECORD)
+        elapsed = time.perf_counter() - start
+        written = (segment + 1) * per_segment
+        print(f"  hasta {written:>9,} registros: {elapsed / per_segment * 1e6:7.2f} µs/registro")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--legacy-records", type=int, default=2_000)
+    parser.add_argument("--segments", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        print(f"QALog (JSONL append-only), {args.records:,} registros:")
+        results = asyncio.run(bench_qa_log(directory, args.records, args.segments))
+
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_records(directory / "bench.jsonl"))
+        print(f"  lectura en streaming de {count:,} registros: {time.perf_counter() - start:.2f}s")
+
+        print(f"save_qa antiguo (JSON reescrito), {args.legacy_records:,} registros:")
+        bench_legacy(directory, args.legacy_records, args.segments)
+
+    first, last = results[0], results[-1]
+    print(f"último tramo / primer tramo (QALog): {last / first:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Micro-benchmark del renderizado Markdown -> HTML de Telegram.
+
+Compara el pipeline antiguo (`process_markdown` + `prepare_text_for_html` +
+personalización, copiados aquí) con `render_telegram_html` sobre el corpus de
+respuestas reales de `benchmarks/corpus/answers.md`, tanto con la respuesta
+completa como con los prefijos que se ven durante el streaming. Cuenta además
+cuántas salidas no son HTML válido para Telegram.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_renderer --repeat 200
+"""
+import argparse
+import re
+import time
+from html.parser import HTMLParser
+from pathlib import Path
+
+from telegram_openai_assistant.renderer import render_telegram_html
+
+CORPUS = Path(__file__).parent / "corpus" / "answers.md"
+ALLOWED_TAGS = {"b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "a", "code", "pre", "blockquote", "tg-spoiler", "span"}
+
+
+def load_corpus():
+    return [answer.strip() for answer in CORPUS.read_text(encoding="utf-8").split("\n=====\n") if answer.strip()]
+
+
+# --- Pipeline antiguo (copia literal) -----------------------------------------
+
+def legacy_process_markdown(text):
+    text = re.sub(r'\s+:', r':', text)
+    text = re.sub(r'(\d+)\.\s+([^:]+):', r'\1. *\2*:', text)
+    text = re.sub(r'([^\s])\*\*', r'\1 **', text)
+    text = re.sub(r'\*\*([^\s])', r'** \1', text)
+    text = re.sub(r'\*\*([^*]+)\*\*', r'*\1*', text)
+    return text
+
+
+def legacy_prepare_text_for_html(text):
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    text = re.sub(r'\s+:', r':', text)
+    text = re.sub(r'(\d+)\.\s+([^:]+):', r'\1. <b>\2</b>:', text)
+    text = re.sub(r'\*\*([^*]+)\*\*', r'<b>\1</b>', text)
+    text = re.sub(r'\*([^*]+)\*', r'<b>\1</b>', text)
+    text = re.sub(r'_([^_]+)_', r'<i>\1</i>', text)
+    text = text.replace('&lt;b&gt;', '<b>').replace('&lt;/b&gt;', '</b>')
+    text = text.replace('&lt;i&gt;', '<i>').replace('&lt;/i&gt;', '</i>')
+    return text
+
+
+def legacy_personalize(chunk, user_name):
+    if re.search(r'^(hola|buenos días|buenas tardes|buenas noches)', chunk.lower()):
+        chunk = chunk.replace('Hola', f'Hola {user_name}', 1)
+    elif 'espero' in chunk.lower() and '!' in chunk:
+        chunk = chunk.replace('!', f", {user_name}!", 1)
+    return chunk
+
+
+def legacy_render(text, user_name="Lucía"):
+    return legacy_prepare_text_for_html(legacy_personalize(legacy_process_markdown(text), user_name))
+
+
+# --- Validación ---------------------------------------------------------------
+
+class _TagChecker(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []
+        self.valid = True
+
+    def handle_starttag(self, tag, attrs):
+        # Etiquetas fuera del subconjunto de Telegram o anidadas en sí mismas (<b><b>)
+        if tag not in ALLOWED_TAGS or tag in self.stack:
+            self.valid = False
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            self.valid = False
+
+
+def is_valid_telegram_html(html):
+    checker = _TagChecker()
+    checker.feed(html)
+    checker.close()
+    return checker.valid and not checker.stack
+
+
+def bench(render, samples, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sample in samples:
+            render(sample)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeat * len(samples)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    answers = load_corpus()
+    # Prefijos como los que se renderizan en cada edición del streaming
+    prefixes = [answer[:cut] for answer in answers for cut in range(40, len(answer), 40)]
+
+    for name, samples in (("respuestas completas", answers), ("prefijos de streaming", prefixes)):
+        legacy_us = bench(legacy_render, samples, args.repeat)
+        new_us = bench(render_telegram_html, samples, args.repeat)
+        legacy_invalid = sum(not is_valid_telegram_html(legacy_render(s)) for s in samples)
+        new_invalid = sum(not is_valid_telegram_html(render_telegram_html(s)) for s in samples)
+        print(f"{name} ({len(samples)} textos):")
+        print(f"  antiguo:  {legacy_us:8.1f} µs/texto, {legacy_invalid} con HTML inválido")
+        print(f"  nuevo:    {new_us:8.1f} µs/texto, {new_invalid} con HTML inválido")
+        assert new_invalid == 0, "render_telegram_html produjo HTML inválido"
+
+
+if __name__ == "__main__":
+    main()
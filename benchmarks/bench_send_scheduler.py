@@ -0,0 +1,79 @@
+"""
+Satura un bot falso con respuestas de muchos chats a la vez y cuenta los 429.
+
+Compara el envío directo (como hacía `send_to_telegram`) con el paso por
+`OutboundScheduler`: el planificador debe terminar con cero `RetryAfter`.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_send_scheduler --chats 40 --groups 4 --chunks 6
+"""
+import argparse
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from telegram_openai_assistant.send_scheduler import OutboundScheduler
+
+from .fakes import FakeTelegramBot
+
+
+def chat_ids(chats, groups):
+    return list(range(1, chats + 1)) + [-(1000 + g) for g in range(groups)]
+
+
+async def direct(args):
+    bot = FakeTelegramBot()
+
+    async def answer(chat_id):
+        for chunk in range(args.chunks):
+            try:
+                await bot.send_message(chat_id=chat_id, text=f"Párrafo {chunk}")
+            except RetryAfter:
+                pass  # el código antiguo lo trataba como un fallo de formato
+
+    start = time.perf_counter()
+    await asyncio.gather(*(answer(chat_id) for chat_id in chat_ids(args.chats, args.groups)))
+    return bot, time.perf_counter() - start, None
+
+
+async def scheduled(args):
+    bot = FakeTelegramBot()
+    outbound = OutboundScheduler(bot)
+    await outbound.start()
+
+    async def answer(chat_id):
+        # Como stream_response: los párrafos llegan uno tras otro, sin esperar al envío
+        sends = []
+        for chunk in range(args.chunks):
+            sends.append(asyncio.create_task(outbound.send_message(chat_id=chat_id, text=f"Párrafo {chunk}")))
+            await asyncio.sleep(args.chunk_interval)
+        await asyncio.gather(*sends)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(answer(chat_id) for chat_id in chat_ids(args.chats, args.groups)))
+    elapsed = time.perf_counter() - start
+    await outbound.close()
+    return bot, elapsed, outbound.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--chunks", type=int, default=6)
+    parser.add_argument("--chunk-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    bot, elapsed, _ = asyncio.run(direct(args))
+    print(f"envío directo:  {len(bot.accepted)} aceptados, {bot.rejected} x 429 en {elapsed:.2f}s")
+
+    bot, elapsed, stats = asyncio.run(scheduled(args))
+    print(f"planificador:   {len(bot.accepted)} aceptados, {bot.rejected} x 429 en {elapsed:.2f}s")
+    print(f"                {stats}")
+    assert bot.rejected == 0, "el planificador no debería provocar ningún 429"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Leases de chat entre varios nodos sobre el mismo estado compartido.
+
+Lanza `--nodes` nodos (cada uno con su `ChatLeases`) que procesan turnos de
+`--chats` chats a la vez contra el mismo backend, SQLite o el Redis en memoria
+de `fakes.FakeRedis`, y comprueba que nunca hay dos nodos dentro del mismo
+chat. Después simula la caída de un nodo que tenía un lease y mide cuánto
+tarda otro nodo en quedarse con el chat (debe ser ~`--ttl`), y un nodo que
+pierde el lease a mitad de turno, cuyo turno debe interrumpirse en la
+siguiente renovación (~`--ttl` / 3).
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_state_store --nodes 3 --chats 50 --turns 20
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from telegram_openai_assistant.state_store import ChatLeases, RedisStateStore, SQLiteStateStore
+
+from .fakes import FakeRedis
+
+
+async def contend(stores, args):
+    leases = [ChatLeases(store, f"node-{i}", ttl=args.ttl, poll_interval=0.005) for i, store in enumerate(stores)]
+    # Dentro de un nodo los turnos de un chat ya van en fila (ChatScheduler)
+    local = [{} for _ in leases]
+    holders = {}
+    violations = 0
+    overhead = []
+
+    async def turn(index, group_id):
+        node = leases[index]
+
+        async def body():
+            nonlocal violations
+            overhead.append(time.perf_counter() - start)
+            if group_id in holders:
+                violations += 1
+            holders[group_id] = node.owner
+            try:
+                await asyncio.sleep(args.turn_time)
+            finally:
+                del holders[group_id]
+
+        async with local[index].setdefault(group_id, asyncio.Lock()):
+            start = time.perf_counter()
+            assert await node.run(group_id, body)
+
+    async def node_loop(index):
+        for _ in range(args.turns):
+            await asyncio.gather(*(turn(index, random.randrange(args.chats)) for _ in range(args.chats // 4 or 1)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(node_loop(index) for index in range(len(leases))))
+    elapsed = time.perf_counter() - start
+    waited = sum(node.stats["waited"] for node in leases)
+    overhead.sort()
+    print(f"  {len(overhead):,} turnos en {elapsed:.2f}s, {waited:,} esperaron a otro nodo, "
+          f"{violations} solapamientos")
+    print(f"  toma del lease: p50 {overhead[len(overhead) // 2] * 1e3:.2f} ms, "
+          f"p99 {overhead[int(len(overhead) * 0.99)] * 1e3:.2f} ms (incluye esperas)")
+    return violations
+
+
+async def failover(stores, args):
+    dead, alive = stores[0], ChatLeases(stores[1], "node-survivor", ttl=args.ttl, poll_interval=0.01)
+    # El nodo "muere" con el lease tomado: nadie lo renueva ni lo suelta
+    await dead.acquire_lease(999, "node-dead", args.ttl)
+    start = time.perf_counter()
+    held = await alive.run(999, lambda: asyncio.sleep(0))
+    took = time.perf_counter() - start
+    print(f"  caída de un nodo: el chat cambió de nodo en {took:.2f}s (ttl {args.ttl:.2f}s, conseguido={held})")
+
+
+async def lost(stores, args):
+    slow = ChatLeases(stores[0], "node-slow", ttl=args.ttl, poll_interval=0.01)
+    turn = asyncio.create_task(slow.run(998, lambda: asyncio.sleep(args.ttl * 10)))
+    await asyncio.sleep(args.ttl / 10)
+    # Otro nodo se queda con el chat (como si el lento hubiera estado parado más de `ttl`)
+    await stores[1].release_lease(998, "node-slow")
+    await stores[1].acquire_lease(998, "node-other", args.ttl)
+    start = time.perf_counter()
+    ran = await turn
+    took = time.perf_counter() - start
+    print(f"  lease perdido a mitad de turno: turno interrumpido en {took:.2f}s (terminado={ran})")
+    await stores[1].release_lease(998, "node-other")
+    return int(ran)
+
+
+async def run(name, stores, args):
+    print(f"{name}, {args.nodes} nodos:")
+    violations = await contend(stores, args)
+    await failover(stores, args)
+    violations += await lost(stores, args)
+    for store in stores:
+        await store.close()
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--turn-time", type=float, default=0.005)
+    parser.add_argument("--ttl", type=float, default=0.5)
+    parser.add_argument("--redis-latency", type=float, default=0.0002)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "state.sqlite3")
+        # Una conexión por nodo, como procesos distintos sobre el mismo archivo
+        sqlite = [SQLiteStateStore(db_path) for _ in range(args.nodes)]
+        violations = asyncio.run(run("SQLite", sqlite, args))
+
+    server = FakeRedis(latency=args.redis_latency)
+    redis = [RedisStateStore(server) for _ in range(args.nodes)]
+    violations += asyncio.run(run("Redis (en memoria)", redis, args))
+    print(f"solapamientos totales: {violations}")
+
+
+if __name__ == "__main__":
+    main()
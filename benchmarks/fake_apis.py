@@ -0,0 +1,370 @@
+"""
+Servidores HTTP locales que imitan la API de Assistants de OpenAI y la Bot API
+de Telegram, para probar el bot completo sin red.
+
+A diferencia de `fakes.py`, que sustituye a los clientes en memoria, aquí los
+clientes reales (`AsyncOpenAI` y el `Bot` de python-telegram-bot) hablan HTTP
+con estos servidores: basta apuntarlos con `OPENAI_BASE_URL` y
+`TELEGRAM_API_URL`. Solo usan asyncio, sin dependencias.
+"""
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from .fakes import FloodLimits
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def params(self) -> Dict:
+        """Cuerpo como dict, sea JSON o un formulario (python-telegram-bot envía formularios)."""
+        if not self.body:
+            return dict(self.query)
+        if self.headers.get("content-type", "").startswith("application/json"):
+            return json.loads(self.body)
+        return dict(parse_qsl(self.body.decode()))
+
+
+class Response:
+    """Respuesta completa (`body`) o en streaming (`stream`, un iterador asíncrono de bytes)."""
+    __slots__ = ("status", "body", "headers", "stream")
+
+    def __init__(self, status: int = 200, body: bytes = b"", headers: Optional[Dict[str, str]] = None,
+                 stream: Optional[AsyncIterator[bytes]] = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.stream = stream
+
+    @classmethod
+    def json(cls, data, status: int = 200, headers: Optional[Dict[str, str]] = None) -> "Response":
+        return cls(status, json.dumps(data).encode(), {"Content-Type": "application/json", **(headers or {})})
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class FakeHTTPServer:
+    """
+    Servidor HTTP/1.1 mínimo con keep-alive y respuestas chunked para SSE.
+    Las subclases implementan `handle(request) -> Response`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def handle(self, request: Request) -> Response:
+        raise NotImplementedError
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        url = urlsplit(target)
+        return Request(method, url.path, dict(parse_qsl(url.query)), headers, body)
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Response):
+        head = [f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}"]
+        headers = dict(response.headers)
+        if response.stream is None:
+            headers["Content-Length"] = str(len(response.body))
+        else:
+            headers["Transfer-Encoding"] = "chunked"
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if response.stream is None:
+            writer.write(response.body)
+            await writer.drain()
+            return
+        async for chunk in response.stream:
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                try:
+                    response = await self.handle(request)
+                except Exception as e:
+                    response = Response.json({"error": {"message": repr(e)}}, status=500)
+                await self._write_response(writer, response)
+                if request.headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def _sse(event: str, data) -> bytes:
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n".encode()
+
+
+_THREAD_PATH = re.compile(r"^/v1/threads/([^/]+)(?:/(messages|runs)(?:/([^/]+)(?:/(cancel))?)?)?$")
+
+
+class FakeAssistantsAPI(FakeHTTPServer):
+    """
+    API de Assistants falsa: threads, mensajes, runs en streaming (SSE),
+    cancelación de runs y lectura del asistente.
+
+    Cada run pasa `queued_time` segundos en cola (con `queued_jitter` de
+    variación aleatoria), espera `first_token_latency` y emite `answer` a
+    `token_rate` tokens (palabras) por segundo, `tokens_per_delta` por evento
+    `thread.message.delta`. Una fracción `rate_limit_ratio` de las peticiones
+    POST se responde con un 429 y `retry-after-ms`. Como la API real, rechaza
+    con un 400 añadir mensajes o lanzar un run en un thread con un run activo.
+    """
+
+    def __init__(self, answer: Optional[str] = None, queued_time: float = 0.2, queued_jitter: float = 0.0,
+                 first_token_latency: float = 0.3, token_rate: float = 50.0, tokens_per_delta: int = 3,
+                 rate_limit_ratio: float = 0.0, retry_after: float = 0.5, api_latency: float = 0.02,
+                 seed: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.answer = answer or (
+            "Respuesta de prueba: durante los primeros meses el bebé duerme entre 14 y 17 horas al día, "
+            "repartidas en varias siestas.\n\nEs normal que se despierte por la noche para comer. "
+            "Si tienes dudas, consulta con tu pediatra."
+        )
+        self.queued_time = queued_time
+        self.queued_jitter = queued_jitter
+        self.first_token_latency = first_token_latency
+        self.token_rate = token_rate
+        self.tokens_per_delta = tokens_per_delta
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.api_latency = api_latency
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        # {thread_id: run_id activo}; los runs cancelados se marcan en `_cancelled`
+        self.active_runs: Dict[str, str] = {}
+        self._cancelled = set()
+        self.stats = {"threads": 0, "messages": 0, "runs": 0, "completed": 0, "cancelled": 0,
+                      "rate_limited": 0, "conflicts": 0, "deleted_threads": 0}
+
+    def _id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self.ids):06d}"
+
+    def _run(self, run_id: str, thread_id: str, assistant_id: str, status: str) -> Dict:
+        return {"id": run_id, "object": "thread.run", "created_at": int(time.time()), "assistant_id": assistant_id,
+                "thread_id": thread_id, "status": status, "instructions": "", "tools": [], "metadata": {}}
+
+    def _message(self, message_id: str, thread_id: str, role: str, text: str, status: str = "completed",
+                 run_id: Optional[str] = None) -> Dict:
+        content = [{"type": "text", "text": {"value": text, "annotations": []}}] if text else []
+        return {"id": message_id, "object": "thread.message", "created_at": int(time.time()),
+                "thread_id": thread_id, "role": role, "content": content, "status": status,
+                "assistant_id": None, "run_id": run_id, "attachments": [], "metadata": {}}
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        kind = "rate_limit_exceeded" if status == 429 else "invalid_request_error"
+        return Response.json({"error": {"message": message, "type": kind, "code": None, "param": None}},
+                             status=status, headers=headers)
+
+    def _rate_limited(self) -> Optional[Response]:
+        if self.rate_limit_ratio and self.random.random() < self.rate_limit_ratio:
+            self.stats["rate_limited"] += 1
+            return self._error(429, "Rate limit reached", {"retry-after-ms": str(int(self.retry_after * 1000))})
+        return None
+
+    async def handle(self, request: Request) -> Response:
+        await asyncio.sleep(self.api_latency)
+        if request.method == "POST":
+            limited = self._rate_limited()
+            if limited is not None:
+                return limited
+
+        if request.path.startswith("/v1/assistants/"):
+            assistant_id = request.path.rsplit("/", 1)[1]
+            return Response.json({"id": assistant_id, "object": "assistant", "created_at": 0, "name": "Fake",
+                                  "model": "gpt-fake", "instructions": "", "tools": [], "metadata": {}})
+        if request.path == "/v1/threads" and request.method == "POST":
+            self.stats["threads"] += 1
+            return Response.json({"id": self._id("thread"), "object": "thread", "created_at": int(time.time()),
+                                  "metadata": {}, "tool_resources": None})
+
+        match = _THREAD_PATH.match(request.path)
+        if not match:
+            return self._error(404, f"Unknown path {request.path}")
+        thread_id, collection, item, action = match.groups()
+        if collection is None and request.method == "DELETE":
+            self.stats["deleted_threads"] += 1
+            return Response.json({"id": thread_id, "object": "thread.deleted", "deleted": True})
+        if collection == "messages" and request.method == "POST":
+            if thread_id in self.active_runs:
+                self.stats["conflicts"] += 1
+                return self._error(400, f"Can't add messages to {thread_id} while a run "
+                                        f"{self.active_runs[thread_id]} is active.")
+            self.stats["messages"] += 1
+            content = request.params().get("content", "")
+            text = content if isinstance(content, str) else json.dumps(content)
+            return Response.json(self._message(self._id("msg"), thread_id, "user", text))
+        if collection in ("messages", "runs") and item is None and request.method == "GET":
+            return Response.json({"object": "list", "data": [], "first_id": None, "last_id": None, "has_more": False})
+        if collection == "runs" and item is None and request.method == "POST":
+            if thread_id in self.active_runs:
+                self.stats["conflicts"] += 1
+                return self._error(400, f"Thread {thread_id} already has an active run {self.active_runs[thread_id]}.")
+            params = request.params()
+            run_id = self._id("run")
+            self.active_runs[thread_id] = run_id
+            self.stats["runs"] += 1
+            return Response(200, headers={"Content-Type": "text/event-stream"},
+                            stream=self._stream_run(thread_id, run_id, params.get("assistant_id", "")))
+        if collection == "runs" and action == "cancel":
+            if self.active_runs.get(thread_id) != item:
+                return self._error(400, f"Cannot cancel run {item}: it is not active.")
+            self._cancelled.add(item)
+            return Response.json(self._run(item, thread_id, "", "cancelling"))
+        return self._error(404, f"Unsupported {request.method} {request.path}")
+
+    async def _stream_run(self, thread_id: str, run_id: str, assistant_id: str) -> AsyncIterator[bytes]:
+        status = "completed"
+        try:
+            yield _sse("thread.run.created", self._run(run_id, thread_id, assistant_id, "queued"))
+            queued = self.queued_time + self.random.uniform(0, self.queued_jitter)
+            await asyncio.sleep(queued)
+            yield _sse("thread.run.in_progress", self._run(run_id, thread_id, assistant_id, "in_progress"))
+            message_id = self._id("msg")
+            yield _sse("thread.message.created",
+                       self._message(message_id, thread_id, "assistant", "", "in_progress", run_id))
+            await asyncio.sleep(self.first_token_latency)
+
+            tokens = re.findall(r"\S+\s*|\s+", self.answer)
+            sent = ""
+            for start in range(0, len(tokens), self.tokens_per_delta):
+                if run_id in self._cancelled:
+                    status = "cancelled"
+                    break
+                chunk = "".join(tokens[start:start + self.tokens_per_delta])
+                await asyncio.sleep(len(tokens[start:start + self.tokens_per_delta]) / self.token_rate)
+                sent += chunk
+                yield _sse("thread.message.delta", {
+                    "id": message_id, "object": "thread.message.delta",
+                    "delta": {"content": [{"index": 0, "type": "text", "text": {"value": chunk, "annotations": []}}]},
+                })
+            yield _sse("thread.message.completed",
+                       self._message(message_id, thread_id, "assistant", sent, "completed", run_id))
+            yield _sse(f"thread.run.{status}", self._run(run_id, thread_id, assistant_id, status))
+            yield _sse("done", "[DONE]")
+        finally:
+            self.active_runs.pop(thread_id, None)
+            self._cancelled.discard(run_id)
+            self.stats[status] += 1
+
+
+class FakeBotAPI(FakeHTTPServer):
+    """
+    Bot API de Telegram falsa para python-telegram-bot: `url` es el valor de
+    `TELEGRAM_API_URL` (el bot pide `<url>/bot<token>/<método>`).
+
+    Responde a getMe, sendMessage, editMessageText, deleteMessage y
+    sendChatAction (el resto devuelve `true`), con `send_latency` segundos por
+    petición. Los envíos y ediciones pasan por `FloodLimits`: si los superan se
+    responde con el 429 de Telegram y su `retry_after`. Cada envío aceptado se
+    guarda en `sent` como (instante de `time.perf_counter`, chat_id, método, texto).
+    """
+
+    def __init__(self, send_latency: float = 0.02, chat_rate: float = 1.0, global_per_second: int = 30,
+                 group_per_minute: int = 20, **kwargs):
+        super().__init__(**kwargs)
+        self.send_latency = send_latency
+        self.limits = FloodLimits(chat_rate, global_per_second, group_per_minute)
+        self.sent: List[Tuple[float, int, str, str]] = []
+        self.message_ids = itertools.count(1)
+        self.stats = {"requests": 0, "sent": 0, "edited": 0, "rate_limited": 0}
+
+    def _user(self, token: str) -> Dict:
+        bot_id = int(token.split(":", 1)[0]) if token.split(":", 1)[0].isdigit() else 1
+        return {"id": bot_id, "is_bot": True, "first_name": "LoadBot", "username": f"load_bot_{bot_id}"}
+
+    async def handle(self, request: Request) -> Response:
+        self.stats["requests"] += 1
+        _, _, rest = request.path.partition("/bot")
+        token, _, method = rest.rpartition("/")
+        params = request.params()
+        if method == "getMe":
+            return Response.json({"ok": True, "result": self._user(token)})
+        if method not in ("sendMessage", "editMessageText"):
+            return Response.json({"ok": True, "result": True})
+
+        await asyncio.sleep(self.send_latency)
+        chat_id = int(params["chat_id"])
+        retry_after = self.limits.check(chat_id)
+        if retry_after is not None:
+            self.stats["rate_limited"] += 1
+            return Response.json({"ok": False, "error_code": 429,
+                                  "description": f"Too Many Requests: retry after {retry_after}",
+                                  "parameters": {"retry_after": retry_after}}, status=429)
+        text = params.get("text", "")
+        self.sent.append((time.perf_counter(), chat_id, method, text))
+        if method == "sendMessage":
+            self.stats["sent"] += 1
+            message_id = next(self.message_ids)
+        else:
+            self.stats["edited"] += 1
+            message_id = int(params["message_id"])
+        chat_type = "private" if chat_id > 0 else "group"
+        return Response.json({"ok": True, "result": {
+            "message_id": message_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": chat_type}, "from": self._user(token),
+        }})
@@ -0,0 +1,305 @@
+"""
+Dobles en memoria de la API de Assistants para los benchmarks.
+
+Imitan solo la superficie de `AsyncOpenAI` que usa `AssistantHandler`, con una
+latencia configurable por delta para simular runs lentos sin tocar la red.
+"""
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+
+def _event(name, data):
+    return SimpleNamespace(event=name, data=data)
+
+
+def _text_delta(value):
+    text = SimpleNamespace(value=value)
+    return SimpleNamespace(delta=SimpleNamespace(content=[SimpleNamespace(type="text", text=text)]))
+
+
+class FakeRunStream:
+    """
+    Equivalente a `AsyncAssistantStreamManager`: al iterarlo emite los eventos
+    de un run (created, in_progress, un message.delta por delta, message.completed
+    y completed) esperando `delta_latency` antes de cada delta. Si el run se
+    cancela con `runs.cancel`, deja de emitir deltas y termina con cancelled.
+    """
+
+    def __init__(self, run_id, deltas, delta_latency, cancelled=None):
+        self._run_id = run_id
+        self._deltas = deltas
+        self._delta_latency = delta_latency
+        self._cancelled = cancelled if cancelled is not None else set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def _run(self, status):
+        return SimpleNamespace(id=self._run_id, status=status)
+
+    async def __aiter__(self):
+        yield _event("thread.run.created", self._run("queued"))
+        yield _event("thread.run.in_progress", self._run("in_progress"))
+        sent, status = [], "completed"
+        for delta in self._deltas:
+            await asyncio.sleep(self._delta_latency)
+            if self._run_id in self._cancelled:
+                status = "cancelled"
+                break
+            sent.append(delta)
+            yield _event("thread.message.delta", _text_delta(delta))
+        text = SimpleNamespace(value="".join(sent))
+        yield _event("thread.message.completed", SimpleNamespace(content=[SimpleNamespace(type="text", text=text)]))
+        yield _event(f"thread.run.{status}", self._run(status))
+
+
+class FakeRuns:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def stream(self, thread_id, assistant_id, **kwargs):
+        self._owner.calls.append(("runs.stream", thread_id))
+        return FakeRunStream(f"run_{next(self._owner.ids)}", self._owner.deltas, self._owner.next_delta_latency(),
+                             self._owner.cancelled)
+
+    async def cancel(self, run_id, thread_id, **kwargs):
+        self._owner.calls.append(("runs.cancel", thread_id))
+        await asyncio.sleep(self._owner.api_latency)
+        self._owner.cancelled.add(run_id)
+        return SimpleNamespace(id=run_id, status="cancelling")
+
+
+class FakeMessages:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def create(self, thread_id, role, content, **kwargs):
+        self._owner.calls.append(("messages.create", thread_id))
+        await asyncio.sleep(self._owner.api_latency)
+        return SimpleNamespace(id=f"msg_{next(self._owner.ids)}", thread_id=thread_id, role=role)
+
+
+class FakeThreads:
+    def __init__(self, owner):
+        self._owner = owner
+        self.messages = FakeMessages(owner)
+        self.runs = FakeRuns(owner)
+
+    async def create(self, **kwargs):
+        self._owner.calls.append(("threads.create", None))
+        await asyncio.sleep(self._owner.api_latency)
+        return SimpleNamespace(id=f"thread_{next(self._owner.ids)}")
+
+
+class FakeAsyncOpenAI:
+    """
+    Cliente falso: cada run emite `deltas` esperando un tiempo fijo entre ellos.
+    `delta_latencies` se recorre en ciclo, un valor por run, para mezclar runs
+    rápidos y lentos.
+    """
+
+    def __init__(self, deltas=None, delta_latencies=(0.05,), api_latency=0.01):
+        self.deltas = deltas or ["Hola", ", esto ", "es una ", "respuesta.\n\n", "Segundo párrafo."]
+        self.api_latency = api_latency
+        self.calls = []
+        self.cancelled = set()
+        self.ids = itertools.count(1)
+        self._latencies = itertools.cycle(delta_latencies)
+        self.beta = SimpleNamespace(threads=FakeThreads(self))
+
+    def next_delta_latency(self):
+        return next(self._latencies)
+
+
+class FloodLimits:
+    """
+    Límites de envío de la Bot API de Telegram.
+
+    `check(chat_id)` devuelve los segundos de `retry_after` de un 429 si se
+    envía a un chat antes de 1/chat_rate segundos desde el envío anterior, si
+    se superan `global_per_second` envíos en el último segundo o
+    `group_per_minute` en el último minuto para un grupo; si no, registra el
+    envío y devuelve None.
+    """
+
+    def __init__(self, chat_rate=1.0, global_per_second=30, group_per_minute=20, tolerance=0.02):
+        self.chat_rate = chat_rate
+        self.global_per_second = global_per_second
+        self.group_per_minute = group_per_minute
+        self.tolerance = tolerance
+        self.accepted = []
+        self.rejected = 0
+        self._last_per_chat = {}
+
+    def check(self, chat_id):
+        import time
+
+        now = time.monotonic()
+        last = self._last_per_chat.get(chat_id)
+        retry_after = None
+        if last is not None and now - last < 1 / self.chat_rate - self.tolerance:
+            retry_after = 1
+        elif sum(1 for t, _ in self.accepted if now - t < 1) >= self.global_per_second:
+            retry_after = 1
+        elif chat_id < 0 and sum(1 for t, c in self.accepted if c == chat_id and now - t < 60) >= self.group_per_minute:
+            retry_after = 3
+        if retry_after is not None:
+            self.rejected += 1
+            return retry_after
+        self._last_per_chat[chat_id] = now
+        self.accepted.append((now, chat_id))
+        return None
+
+
+class FakeTelegramBot:
+    """
+    Bot de Telegram falso que aplica los límites de envío de la Bot API
+    (`FloodLimits`): lanza `RetryAfter` (un 429) al superarlos. Registra todos
+    los envíos aceptados y los 429 devueltos.
+    """
+
+    def __init__(self, chat_rate=1.0, global_per_second=30, group_per_minute=20, send_latency=0.02, tolerance=0.02):
+        self.limits = FloodLimits(chat_rate, global_per_second, group_per_minute, tolerance)
+        self.send_latency = send_latency
+        self._message_ids = itertools.count(1)
+
+    @property
+    def accepted(self):
+        return self.limits.accepted
+
+    @property
+    def rejected(self):
+        return self.limits.rejected
+
+    def _check(self, chat_id):
+        from telegram.error import RetryAfter
+
+        retry_after = self.limits.check(chat_id)
+        if retry_after is not None:
+            raise RetryAfter(retry_after)
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        await asyncio.sleep(self.send_latency)
+        self._check(chat_id)
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=chat_id, text=text)
+
+    async def edit_message_text(self, chat_id, message_id, text, parse_mode=None, **kwargs):
+        await asyncio.sleep(self.send_latency)
+        self._check(chat_id)
+        return SimpleNamespace(message_id=message_id, chat_id=chat_id, text=text)
+
+
+class FakeRedis:
+    """
+    Servidor Redis en memoria con los comandos que usa `RedisStateStore`.
+
+    Los conjuntos ordenados se guardan como dicts {miembro: puntuación}.
+    Las claves caducan con `px` y `pexpire`; `eval` solo entiende los scripts
+    de leases de `state_store` (renovar y soltar si el dueño coincide). Varias
+    instancias de `RedisStateStore` sobre el mismo `FakeRedis` se comportan
+    como nodos distintos contra un mismo servidor.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._data = {}
+        self._expires = {}
+
+    def _alive(self, key):
+        import time
+
+        expires = self._expires.get(key)
+        if expires is not None and time.monotonic() >= expires:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def _pexpire(self, key, ms):
+        import time
+
+        self._expires[key] = time.monotonic() + int(ms) / 1000
+
+    async def get(self, key):
+        await asyncio.sleep(self.latency)
+        return self._data[key] if self._alive(key) else None
+
+    async def set(self, key, value, nx=False, px=None):
+        await asyncio.sleep(self.latency)
+        if nx and self._alive(key):
+            return None
+        self._data[key] = value
+        self._expires.pop(key, None)
+        if px is not None:
+            self._pexpire(key, px)
+        return True
+
+    async def delete(self, *keys):
+        await asyncio.sleep(self.latency)
+        deleted = sum(1 for key in keys if self._alive(key))
+        for key in keys:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return deleted
+
+    async def hgetall(self, key):
+        await asyncio.sleep(self.latency)
+        return dict(self._data[key]) if self._alive(key) else {}
+
+    async def hset(self, key, mapping):
+        await asyncio.sleep(self.latency)
+        if not self._alive(key):
+            self._data[key] = {}
+        self._data[key].update(mapping)
+        return len(mapping)
+
+    async def zadd(self, key, mapping):
+        await asyncio.sleep(self.latency)
+        if not self._alive(key):
+            self._data[key] = {}
+        added = sum(1 for member in mapping if member not in self._data[key])
+        self._data[key].update(mapping)
+        return added
+
+    async def zrem(self, key, *members):
+        await asyncio.sleep(self.latency)
+        if not self._alive(key):
+            return 0
+        return sum(self._data[key].pop(member, None) is not None for member in members)
+
+    async def zscore(self, key, member):
+        await asyncio.sleep(self.latency)
+        return self._data[key].get(member) if self._alive(key) else None
+
+    async def zrangebyscore(self, key, min, max, start=None, num=None):
+        await asyncio.sleep(self.latency)
+        if not self._alive(key):
+            return []
+        low = float("-inf") if min == "-inf" else float(min)
+        high = float("inf") if max == "+inf" else float(max)
+        members = [member for member, score in sorted(self._data[key].items(), key=lambda item: item[1])
+                   if low <= score <= high]
+        if start is not None:
+            members = members[start:start + num if num is not None else None]
+        return members
+
+    async def eval(self, script, numkeys, key, owner, *args):
+        from telegram_openai_assistant.state_store import RELEASE_SCRIPT, RENEW_SCRIPT
+
+        await asyncio.sleep(self.latency)
+        if not (self._alive(key) and self._data[key] == owner):
+            return 0
+        if script == RENEW_SCRIPT:
+            self._pexpire(key, args[0])
+            return 1
+        if script == RELEASE_SCRIPT:
+            del self._data[key]
+            self._expires.pop(key, None)
+            return 1
+        raise NotImplementedError("Script no soportado por FakeRedis")
+
+    async def aclose(self):
+        pass
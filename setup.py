@@ -7,14 +7,19 @@ setup(
     install_requires=[
         'python-telegram-bot==20.6',  # Make sure to specify the correct versions
         'openai',
-        'Flask',
         'python-dotenv',
+        'Pillow',
         # Add other dependencies here
     ],
+    extras_require={
+        # Servidor HTTP para BOT_MODE=webhook y los health checks
+        'webhook': ['uvicorn'],
+        # Estado compartido entre nodos con STATE_BACKEND=redis
+        'redis': ['redis'],
+    },
     entry_points={
         'console_scripts': [
             'chatbot = telegram_openai_assistant.bot:main',
-            'keepalive=keep_alive:start_keep_alive' 
         ],
     },
 )
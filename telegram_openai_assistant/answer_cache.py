@@ -0,0 +1,293 @@
+# answer_cache.py
+# Caché de respuestas por asistente: índice BM25 en memoria sobre el log de Q&A
+import asyncio
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .log import get_logger
+from .metrics import ANSWER_CACHE_LOOKUPS, ANSWER_CACHE_SAVED
+from .qa_log import iter_records
+
+logger = get_logger(__name__)
+
+# Palabras vacías del español y fórmulas de cortesía: no distinguen una pregunta de otra
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante como cual cuando de del desde donde durante
+e el ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue ha hay la las le les
+lo los me mi mis muy nos o os para pero por que se si sobre su sus te tengo tiene tu tus un una
+uno unos unas y ya yo
+hola buenas buenos dias tardes noches favor porfa gracias saludos quisiera queria saber pregunta duda
+""".split())
+
+# Negaciones y opuestos: "no duerma" o "sin lactosa" cambian la respuesta aunque el resto coincida
+POLARITY = frozenset("""
+no ni nunca jamas tampoco nada nadie ningun ninguna ninguno sin con contra antes despues mas menos
+""".split())
+
+# Mensajes que solo tienen sentido con lo anterior de la conversación
+_FOLLOW_UP_RE = re.compile(
+    r"^(y|pero|entonces|vale|ok|okay|sí|si|no|gracias|perfecto|bueno|también|tambien|otra|otro|más|mas)\b"
+    r"|\b(eso|esto|esa|ese|lo anterior|lo que (me )?(dijiste|has dicho)|antes|arriba|tu respuesta)\b",
+    re.IGNORECASE,
+)
+# Etiqueta que añaden los handlers con el nombre del usuario
+USER_INFO_RE = re.compile(r'\[INFORMACIÓN DEL USUARIO: Nombre=([^\]]+)\]\s*\n*')
+_WORD_RE = re.compile(r"\w+")
+_ACCENTS = str.maketrans("áàäâéèëêíìïîóòöôúùüûñç", "aaaaeeeeiiiioooouuuunc")
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin tildes ni signos y con los espacios colapsados."""
+    return " ".join(_WORD_RE.findall(text.lower().translate(_ACCENTS)))
+
+
+def tokenize(text: str) -> List[str]:
+    """Palabras con contenido de una pregunta."""
+    return _content_words(normalize(text))
+
+
+def _content_words(normalized: str) -> List[str]:
+    return [word for word in normalized.split() if word not in STOPWORDS]
+
+
+def strip_user_info(text: str) -> str:
+    """Quita las etiquetas con el nombre del usuario."""
+    return USER_INFO_RE.sub("", text).strip()
+
+
+def mentions_user(text: str, user_name: str) -> bool:
+    """True si el texto nombra al usuario (alguna palabra de su nombre de más de dos letras)."""
+    names = {word for word in normalize(user_name).split() if len(word) > 2 and word not in STOPWORDS}
+    return bool(names) and not names.isdisjoint(normalize(text).split())
+
+
+def is_follow_up(text: str, min_tokens: int = 3, words: Optional[List[str]] = None) -> bool:
+    """
+    True si el mensaje depende del contexto (muy corto o con referencias a lo
+    anterior). `words` son sus palabras con contenido, si ya se calcularon.
+    """
+    words = tokenize(text) if words is None else words
+    return len(words) < min_tokens or bool(_FOLLOW_UP_RE.search(text.strip()))
+
+
+def _numbers(terms: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(term for term in terms if term.isdigit())
+
+
+def _polarity(terms: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(term for term in terms if term in POLARITY)
+
+
+class _Entry:
+    __slots__ = ("key", "terms", "length", "numbers", "polarity", "answer", "created")
+
+    def __init__(self, key: str, terms: Dict[str, int], answer: str, created: float):
+        self.key = key
+        self.terms = terms
+        self.length = sum(terms.values())
+        # Edades, semanas, temperaturas...: la respuesta solo vale para los mismos números
+        self.numbers = _numbers(terms)
+        # Y solo para la misma pregunta en positivo o en negativo, con o sin...
+        self.polarity = _polarity(terms)
+        self.answer = answer
+        self.created = created
+
+
+class AnswerCache:
+    """
+    Respuestas ya dadas por un asistente, para contestar al instante las
+    preguntas que se repiten.
+
+    Cada pregunta se normaliza y se indexa en un índice invertido en memoria
+    que crece con cada respuesta nueva (y se carga del log de Q&A al arrancar).
+    `lookup` puntúa las candidatas con BM25 y solo devuelve una respuesta si la
+    confianza (la puntuación dividida entre la mayor de las de cada pregunta
+    consigo misma, 1.0 para la misma pregunta) llega a `min_confidence` y tiene
+    los mismos números (no vale la respuesta de "4 meses" para "8 meses") y las
+    mismas negaciones y opuestos de `POLARITY` (ni la de "duerma" para "no
+    duerma" ni la de "con lactosa" para "sin lactosa"). Los mensajes que
+    dependen del contexto (`is_follow_up`) nunca se sirven ni se guardan.
+
+    La caché es común a todos los chats del asistente, así que solo guarda lo
+    que vale para cualquiera: sin las etiquetas con el nombre del usuario y sin
+    las preguntas y respuestas que lo nombran (`add` con `user_name`). Las
+    entradas
+    caducan a los `ttl` segundos y, pasadas `max_entries`, sale la usada hace
+    más tiempo. `label` (el assistant id) etiqueta las métricas.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 7 * 86400, min_confidence: float = 0.95,
+                 min_tokens: int = 3, label: str = ""):
+        self.label = label
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_confidence = min_confidence
+        self.min_tokens = min_tokens
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._keys: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_length = 0
+        self._next_id = 0
+        # Duración media de un turno con run, para estimar el tiempo ahorrado con cada acierto
+        self._run_seconds = 0.0
+        self._runs = 0
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "added": 0, "personal": 0, "evicted": 0,
+                      "expired": 0, "saved_seconds": 0.0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """Fracción de preguntas consultadas (sin contar las que dependen del contexto) servidas desde la caché."""
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _idf(self, term: str) -> float:
+        df = len(self._postings.get(term, ()))
+        n = len(self._entries)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _score(self, query: Iterable[str], terms: Dict[str, int], length: int) -> float:
+        average = self._total_length / len(self._entries) if self._entries else length or 1
+        norm = self.K1 * (1 - self.B + self.B * length / average)
+        score = 0.0
+        for term in query:
+            tf = terms.get(term)
+            if tf:
+                score += self._idf(term) * tf * (self.K1 + 1) / (tf + norm)
+        return score
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._keys.pop(entry.key, None)
+        self._total_length -= entry.length
+        for term in entry.terms:
+            postings = self._postings[term]
+            del postings[entry_id]
+            if not postings:
+                del self._postings[term]
+
+    def add(self, question: str, answer: str, created: Optional[float] = None, user_name: str = "") -> bool:
+        """
+        Indexa una respuesta; la de una pregunta ya indexada sustituye a la anterior.
+        No guarda la que nombra a `user_name` (el usuario que preguntó), ni en la pregunta ni en la respuesta.
+        """
+        question, answer = strip_user_info(question), strip_user_info(answer)
+        key = normalize(question)
+        words = _content_words(key)
+        if not answer or is_follow_up(question, self.min_tokens, words):
+            return False
+        if user_name and (mentions_user(answer, user_name) or mentions_user(question, user_name)):
+            self.stats["personal"] += 1
+            return False
+        created = time.time() if created is None else created
+        if time.time() - created >= self.ttl:
+            return False
+        if key in self._keys:
+            self._remove(self._keys[key])
+        entry_id = self._next_id
+        self._next_id += 1
+        entry = _Entry(key, dict(Counter(words)), answer, created)
+        self._entries[entry_id] = entry
+        self._keys[key] = entry_id
+        self._total_length += entry.length
+        for term, tf in entry.terms.items():
+            self._postings.setdefault(term, {})[entry_id] = tf
+        self.stats["added"] += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.stats["evicted"] += 1
+        return True
+
+    def lookup(self, question: str) -> Optional[Tuple[str, float]]:
+        """Devuelve (respuesta, confianza) si hay una respuesta guardada para esta pregunta."""
+        question = strip_user_info(question)
+        key = normalize(question)
+        query = _content_words(key)
+        if is_follow_up(question, self.min_tokens, query):
+            self.stats["bypassed"] += 1
+            ANSWER_CACHE_LOOKUPS.inc(self.label, "bypass")
+            return None
+        now = time.time()
+        best, best_confidence = None, 0.0
+        entry_id = self._keys.get(key)
+        if entry_id is not None:
+            best, best_confidence = entry_id, 1.0
+        else:
+            terms = dict(Counter(query))
+            numbers = _numbers(terms)
+            polarity = _polarity(terms)
+            contributions = {term: self._score((term,), terms, len(query)) for term in terms}
+            query_self = sum(contributions.values())
+            # Una candidata a la que le falte un término que pese más que el margen de
+            # confianza no puede llegar al mínimo: se recorre la lista más corta de esos
+            # términos y se exigen los demás
+            required = sorted(
+                (term for term, weight in contributions.items() if weight > (1 - self.min_confidence) * query_self),
+                key=lambda term: len(self._postings.get(term, ())),
+            )
+            if required:
+                candidates = self._postings.get(required[0], {})
+            else:
+                candidates = {candidate for term in terms for candidate in self._postings.get(term, ())}
+            for candidate in candidates:
+                entry = self._entries[candidate]
+                if entry.numbers != numbers or entry.polarity != polarity:
+                    continue
+                if not all(term in entry.terms for term in required[1:]):
+                    continue
+                score = self._score(terms, entry.terms, entry.length)
+                confidence = score / max(query_self, self._score(entry.terms, entry.terms, entry.length))
+                if confidence > best_confidence:
+                    best, best_confidence = candidate, confidence
+        if best is not None and now - self._entries[best].created >= self.ttl:
+            self._remove(best)
+            self.stats["expired"] += 1
+            best = None
+        if best is None or best_confidence < self.min_confidence:
+            self.stats["misses"] += 1
+            ANSWER_CACHE_LOOKUPS.inc(self.label, "miss")
+            return None
+        self._entries.move_to_end(best)
+        self.stats["hits"] += 1
+        ANSWER_CACHE_LOOKUPS.inc(self.label, "hit")
+        return self._entries[best].answer, best_confidence
+
+    def observe_run(self, seconds: float):
+        """Registra lo que tardó un turno que sí necesitó un run."""
+        self._runs += 1
+        self._run_seconds += (seconds - self._run_seconds) / self._runs
+
+    def record_saved(self, served_seconds: float) -> float:
+        """Anota y devuelve el tiempo ahorrado por un acierto que se sirvió en `served_seconds`."""
+        saved = max(0.0, self._run_seconds - served_seconds)
+        self.stats["saved_seconds"] += saved
+        ANSWER_CACHE_SAVED.inc(self.label, amount=saved)
+        return saved
+
+    async def load(self, path) -> int:
+        """Indexa las respuestas vigentes de un log de Q&A (leído fuera del event loop)."""
+        cutoff = time.time() - self.ttl
+
+        def read():
+            return [
+                (record["question"], record["answer"], record.get("timestamp", 0.0), record.get("username") or "")
+                for record in iter_records(path)
+                if record.get("question") and record.get("answer") and record.get("timestamp", 0.0) > cutoff
+            ]
+
+        records = await asyncio.to_thread(read)
+        # Los más recientes al final: son los que se quedan si no caben todos
+        added = sum(
+            self.add(question, answer, created, user_name)
+            for question, answer, created, user_name in records[-self.max_entries:]
+        )
+        logger.info("Caché de respuestas: %s respuestas cargadas de %s", added, path)
+        return added
@@ -1,302 +1,424 @@
-import time
-import asyncio
-import re
-import os
-import base64
-from typing import Optional, Dict, Callable, Any
-
-
-def clean_text_and_split(text):
-    """
-    Divide el texto en párrafos formateados preservando los espacios originales.
-    """
-    paragraphs = re.split(r'\n\n+', text)
-    return [p for p in paragraphs if p.strip()]
-
-
-def process_markdown(text):
-    """
-    Procesa el texto para asegurar que el formato markdown de Telegram es correcto.
-    """
-    text = re.sub(r'\s+:', r':', text)
-    text = re.sub(r'(\d+)\.\s+([^:]+):', r'\1. *\2*:', text)
-    text = re.sub(r'([^\s])\*\*', r'\1 **', text)
-    text = re.sub(r'\*\*([^\s])', r'** \1', text)
-    text = re.sub(r'\*\*([^*]+)\*\*', r'*\1*', text)
-    return text
-
-
-class AssistantHandler:
-    def __init__(self, client, assistant_id):
-        self.client = client
-        self.assistant_id = assistant_id
-        self.thread_id = None
-        self.message_history = []
-        self.threads: Dict[int, str] = {}  # Almacenar {group_id: thread_id} en memoria
-
-    async def stream_response(self, group_id: int, message_str: str, send_to_telegram):
-        """Envía un mensaje al asistente y transmite la respuesta al usuario."""
-        thread_id = self.threads.get(group_id)
-
-        if not thread_id:
-            print(f"[DEBUG] No se encontró un thread_id para group_id: {group_id}, creando uno nuevo.")
-            thread = self.client.beta.threads.create()
-            if thread and hasattr(thread, 'id') and thread.id:
-                self.threads[group_id] = thread.id
-                thread_id = thread.id
-                print(f"[DEBUG] Nuevo thread_id creado: {thread_id} para group_id: {group_id}")
-            else:
-                print(f"[ERROR] No se pudo crear un thread para group_id: {group_id}")
-                return
-
-        print(f"[DEBUG] Usando thread_id: {thread_id} para group_id: {group_id}")
-
-        # Enviar el mensaje al asistente
-        try:
-            self.client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=message_str
-            )
-            self.message_history.append({"role": "user", "content": message_str})
-        except Exception as e:
-            print(f"[ERROR] Error enviando mensaje al asistente: {e}")
-            return
-
-        try:
-            with self.client.beta.threads.runs.create_and_stream(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id,
-            ) as event_handler:
-                buffer = ""
-                accumulated_text = ""
-                
-                for partial_text in event_handler.text_deltas:
-                    buffer += partial_text
-                    
-                    # Cuando detectamos un doble salto de línea, enviamos el párrafo
-                    if '\n\n' in buffer:
-                        parts = buffer.split('\n\n', 1)
-                        accumulated_text += parts[0]
-                        
-                        # Procesar el texto acumulado para asegurar formato markdown correcto
-                        processed_text = process_markdown(accumulated_text.strip())
-                        
-                        if processed_text:
-                            await send_to_telegram(processed_text)
-                            self.message_history.append({"role": "assistant", "content": processed_text})
-                        
-                        buffer = parts[1]
-                        accumulated_text = ""
-                
-                # Enviar cualquier texto restante en el buffer
-                if buffer.strip():
-                    processed_text = process_markdown(buffer.strip())
-                    await send_to_telegram(processed_text)
-                    self.message_history.append({"role": "assistant", "content": processed_text})
-                    
-        except Exception as e:
-            print(f"[ERROR] Error durante el streaming: {e}")
-
-    async def stream_image_response(self, group_id: int, message_str: str, image_base64: str, image_path: str, send_to_telegram):
-        """Método utilizando Files API con timeout y manejo mejorado de queued"""
-        thread_id = self.threads.get(group_id)
-
-        if not thread_id:
-            print(f"[DEBUG] No se encontró un thread_id para group_id: {group_id}, creando uno nuevo.")
-            thread = self.client.beta.threads.create()
-            if thread and hasattr(thread, 'id') and thread.id:
-                self.threads[group_id] = thread.id
-                thread_id = thread.id
-                print(f"[DEBUG] Nuevo thread_id creado: {thread_id} para group_id: {group_id}")
-            else:
-                print(f"[ERROR] No se pudo crear un thread para group_id: {group_id}")
-                return
-
-        print(f"[DEBUG] Usando thread_id: {thread_id} para group_id: {group_id} con imagen")
-
-        # Primero creamos un mensaje informativo para el usuario
-        await send_to_telegram("🔍 Estoy analizando la imagen. Esto puede tardar unos momentos...")
-
-        # Guardar información del modelo que usa el asistente para diagnóstico
-        try:
-            assistant_info = self.client.beta.assistants.retrieve(self.assistant_id)
-            model_name = getattr(assistant_info, 'model', 'desconocido')
-            print(f"[DEBUG] Modelo del asistente: {model_name}")
-        except Exception as e:
-            model_name = "desconocido"
-            print(f"[DEBUG] No se pudo obtener información del modelo: {e}")
-
-        # Intentar subir el archivo a OpenAI para obtener el file_id
-        try:
-            print(f"[DEBUG] Subiendo imagen a OpenAI Files API...")
-            
-            # Crear el mensaje del usuario con el texto
-            self.client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=message_str
-            )
-            print("[DEBUG] Mensaje de texto enviado correctamente")
-            
-            # Subir la imagen
-            with open(image_path, 'rb') as f:
-                file_upload = self.client.files.create(
-                    file=f,
-                    purpose="assistants"
-                )
-            
-            file_id = file_upload.id
-            print(f"[DEBUG] Archivo subido exitosamente, ID: {file_id}")
-            
-            # Intentar con el formato image_file directamente (el que funcionó antes)
-            try:
-                self.client.beta.threads.messages.create(
-                    thread_id=thread_id,
-                    role="user",
-                    content=[
-                        {
-                            "type": "image_file",
-                            "image_file": {
-                                "file_id": file_id
-                            }
-                        }
-                    ]
-                )
-                print("[DEBUG] Mensaje con imagen enviado correctamente")
-            except Exception as e:
-                print(f"[ERROR] Error enviando mensaje con image_file: {e}")
-                # Intentar con formato alternativo como último recurso
-                try:
-                    print("[DEBUG] Intentando formato alternativo...")
-                    with open(image_path, "rb") as img_file:
-                        b64_image = base64.b64encode(img_file.read()).decode()
-                    
-                    self.client.beta.threads.messages.create(
-                        thread_id=thread_id,
-                        role="user",
-                        content=[
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{b64_image}"
-                                }
-                            }
-                        ]
-                    )
-                    print("[DEBUG] Formato alternativo tuvo éxito")
-                except Exception as e2:
-                    print(f"[ERROR] Error con el formato alternativo: {e2}")
-                    await send_to_telegram("❌ No pude procesar la imagen. Por favor, intenta con otra imagen o consulta sin imagen.")
-                    return
-            
-        except Exception as e:
-            print(f"[ERROR] Error subiendo archivo a OpenAI: {e}")
-            await send_to_telegram(f"⚠️ No se pudo subir la imagen. Error: {str(e)}")
-            return
-
-        # Registramos en el historial
-        self.message_history.append({
-            "role": "user", 
-            "content": f"{message_str} [IMAGEN adjuntada como archivo: {file_id}]"
-        })
-
-        # Ejecutar el asistente para procesar el mensaje y la imagen
-        try:
-            print("[DEBUG] Iniciando análisis de la imagen...")
-            
-            # Crear un run para el thread
-            run = self.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id
-            )
-            
-            # Esperar a que termine la ejecución
-            run_status = run.status
-            run_id = run.id
-            
-            # Variables para controlar el timeout
-            max_wait_time = 120  # Segundos máximos de espera (2 minutos)
-            start_time = time.time()
-            queued_message_sent = False
-            queued_time_start = None
-            
-            while run_status not in ["completed", "failed", "cancelled", "expired"]:
-                elapsed_time = time.time() - start_time
-                print(f"[DEBUG] Estado actual del run: {run_status}, tiempo transcurrido: {elapsed_time:.1f}s")
-                
-                # Manejar el estado "queued" específicamente
-                if run_status == "queued":
-                    if not queued_message_sent:
-                        await send_to_telegram("🔄 Tu solicitud está en cola. Esto puede tardar un momento debido a alta demanda...")
-                        queued_message_sent = True
-                        queued_time_start = time.time()
-                    
-                    # Si ha estado en cola por más de 30 segundos, informar al usuario
-                    if queued_time_start and (time.time() - queued_time_start > 30):
-                        await send_to_telegram("⏳ Tu solicitud sigue en cola. A veces el procesamiento de imágenes puede tardar un poco más. Gracias por tu paciencia.")
-                        # Reset para no enviar este mensaje de nuevo
-                        queued_time_start = None
-                
-                # Verificar si excedimos el tiempo máximo de espera
-                if elapsed_time > max_wait_time:
-                    print(f"[WARN] Excedido tiempo máximo de espera ({max_wait_time}s)")
-                    await send_to_telegram("⚠️ El análisis está tomando más tiempo del esperado. Puedo continuar esperando o puedes cancelar e intentarlo nuevamente. ¿Quieres continuar esperando?")
-                    
-                    # Extender el tiempo de espera
-                    max_wait_time += 60  # Añadir un minuto más
-                
-                # Esperar un poco antes de verificar de nuevo (con backoff exponencial)
-                base_wait = min(5, 1 + (elapsed_time / 20))  # Incrementar el tiempo de espera gradualmente
-                await asyncio.sleep(base_wait)
-                
-                # Obtener estado actualizado
-                try:
-                    run = self.client.beta.threads.runs.retrieve(
-                        thread_id=thread_id,
-                        run_id=run_id
-                    )
-                    run_status = run.status
-                except Exception as e:
-                    print(f"[ERROR] Error al obtener estado del run: {e}")
-                    # Si hay error al obtener estado, incrementar el tiempo de espera
-                    await asyncio.sleep(5)
-            
-            # Informar sobre estado final
-            print(f"[DEBUG] Run completado con estado: {run_status}, tiempo total: {time.time() - start_time:.1f}s")
-            
-            if run_status == "completed":
-                # Obtener los mensajes de respuesta
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=thread_id
-                )
-                
-                # Extraer el último mensaje del asistente
-                assistant_messages = []
-                for msg in messages.data:
-                    if msg.role == "assistant" and msg.run_id == run_id:
-                        # Extraer el contenido del mensaje
-                        for content_item in msg.content:
-                            if content_item.type == "text":
-                                assistant_messages.append(content_item.text.value)
-                
-                # Enviar las respuestas del asistente
-                if assistant_messages:
-                    for msg_text in assistant_messages:
-                        processed_text = process_markdown(msg_text)
-                        await send_to_telegram(processed_text)
-                        self.message_history.append({"role": "assistant", "content": processed_text})
-                else:
-                    await send_to_telegram(f"⚠️ El asistente no generó una respuesta para la imagen. Modelo usado: {model_name}")
-            else:
-                await send_to_telegram(f"❌ El análisis falló con estado: {run_status}. Modelo usado: {model_name}")
-                
-        except Exception as e:
-            print(f"[ERROR] Error durante el análisis de la imagen: {e}")
-            await send_to_telegram(f"Lo siento, ocurrió un error al analizar la imagen: {str(e)}")
-
-    def trim_message_history(self):
-        """Mantiene el historial de mensajes limitado a los últimos 20 mensajes."""
-        max_messages = 20
-        if len(self.message_history) > max_messages:
-            self.message_history = self.message_history[-max_messages:]
\ No newline at end of file
+import time
+import asyncio
+import re
+import os
+import base64
+from typing import Optional, Dict, Callable, Any, Awaitable, List, Tuple
+
+from .assistant_metadata import AssistantMetadataCache
+from .history import ChatHistory
+from .log import get_logger
+from .metrics import FIRST_DELTA, IMAGE_UPLOADS, OPENAI_REQUEST, PHOTO_UPLOAD, RUN_DURATION
+
+logger = get_logger(__name__)
+
+# Segundos sin eventos del run antes de avisar al usuario en los análisis de imágenes
+QUEUED_NOTICE_AFTER = 5
+STILL_QUEUED_NOTICE_AFTER = 35
+SLOW_NOTICE_AFTER = 120
+
+# Estados en los que un run ya no ocupa el thread
+FINAL_RUN_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete")
+
+
+def clean_text_and_split(text):
+    """
+    Divide el texto en párrafos formateados preservando los espacios originales.
+    """
+    paragraphs = re.split(r'\n\n+', text)
+    return [p for p in paragraphs if p.strip()]
+
+
+class AssistantHandler:
+    """
+    Puente entre un asistente de OpenAI y los chats de Telegram.
+
+    `client` debe ser un `AsyncOpenAI`: todas las llamadas a la API de Assistants
+    se esperan con await para no bloquear el event loop compartido por todos los bots.
+    Los threads por chat se toman del `StateStore` común a todos los bots y nodos.
+    Los últimos mensajes de cada chat se guardan en `history` (un `ChatHistory`,
+    normalmente el del `ConversationManager`, compartido por todos los bots).
+    """
+    def __init__(self, client, assistant_id, state, image_cache=None, metadata_ttl: float = 600.0,
+                 bot_name: str = "", history: Optional[ChatHistory] = None):
+        self.client = client
+        self.bot_name = bot_name  # Etiqueta de las métricas
+        self.assistant_id = assistant_id
+        self.state = state
+        self.image_cache = image_cache
+        # Modelo, herramientas e instrucciones del asistente; se carga en Bot.start
+        self.metadata = AssistantMetadataCache(client, assistant_id, ttl=metadata_ttl)
+        self.history = history if history is not None else ChatHistory()
+
+    async def stream_response(self, group_id: int, message_str: str, send_to_telegram, progressive=None,
+                              cancel: Optional[asyncio.Event] = None) -> Tuple[str, Optional[str]]:
+        """
+        Envía un mensaje al asistente y transmite la respuesta al usuario.
+
+        Con `progressive` (un `ProgressiveMessage`) la respuesta se muestra editando
+        un único mensaje a medida que llegan los deltas; sin él, se envía un mensaje
+        por párrafo con `send_to_telegram`. Quien pasa `progressive` llama a su `finish`.
+        Si se activa `cancel`, el run se cancela y se deja de mostrar la respuesta.
+        Devuelve (estado final del run, texto completo de la respuesta); el estado
+        es "error" y el texto None si falló alguna llamada a OpenAI.
+        """
+        thread_id = await self.state.get_or_create(group_id, self.client.beta.threads.create)
+        if not thread_id:
+            return "error", None
+
+        logger.debug("Usando thread_id: %s para group_id: %s", thread_id, group_id)
+
+        # Enviar el mensaje al asistente
+        try:
+            start = time.perf_counter()
+            await self.client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=message_str
+            )
+            OPENAI_REQUEST.observe(time.perf_counter() - start, self.bot_name, "messages.create")
+            self.history.add(group_id, "user", message_str)
+        except Exception as e:
+            logger.error("Error enviando mensaje al asistente: %s", e)
+            return "error", None
+
+        if cancel is not None and cancel.is_set():
+            # Llegó otro mensaje antes de lanzar el run: el siguiente turno responde a los dos
+            return "cancelled", ""
+
+        try:
+            status, _, answer = await self._relay_run(thread_id, send_to_telegram, progressive, cancel=cancel)
+        except Exception as e:
+            logger.error("Error durante el streaming: %s", e)
+            return "error", None
+
+        if status != "completed":
+            logger.warning("El run terminó con estado %s", status)
+        self.history.add(group_id, "assistant", answer)
+        return status, answer
+
+    async def record_exchange(self, group_id: int, question: str, answer: str) -> bool:
+        """
+        Añade al thread del chat una pregunta y su respuesta sin lanzar un run
+        (p. ej. una respuesta servida desde la caché), para que el asistente la
+        tenga en cuenta en las siguientes preguntas.
+        """
+        thread_id = await self.state.get_or_create(group_id, self.client.beta.threads.create)
+        if not thread_id:
+            return False
+        try:
+            start = time.perf_counter()
+            for role, content in (("user", question), ("assistant", answer)):
+                await self.client.beta.threads.messages.create(thread_id=thread_id, role=role, content=content)
+            OPENAI_REQUEST.observe(time.perf_counter() - start, self.bot_name, "record_exchange")
+        except Exception as e:
+            logger.error("No se pudo añadir la respuesta de la caché al thread %s: %s", thread_id, e)
+            return False
+        self.history.add(group_id, "user", question)
+        self.history.add(group_id, "assistant", answer)
+        return True
+
+    async def _cancel_run(self, thread_id: str, run_id: str):
+        start = time.perf_counter()
+        try:
+            await self.client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+            OPENAI_REQUEST.observe(time.perf_counter() - start, self.bot_name, "runs.cancel")
+            logger.debug("Run %s cancelado", run_id)
+        except Exception as e:
+            # Lo normal es que el run acabara justo antes: no hay nada que cancelar
+            logger.debug("No se pudo cancelar el run %s: %s", run_id, e)
+
+    async def _stream_run(self, thread_id: str, on_text: Callable[[str], Awaitable],
+                          on_idle: Optional[Callable[[str, float], Awaitable]] = None,
+                          idle_interval: float = 5.0,
+                          cancel: Optional[asyncio.Event] = None) -> Tuple[str, Optional[str], List[str]]:
+        """
+        Lanza un run en streaming y pasa cada delta de texto a `on_text` según llega.
+
+        Con `on_idle`, si pasan `idle_interval` segundos sin ningún evento se llama a
+        `on_idle(estado del run, segundos sin eventos)`; los avisos al usuario
+        dependen así de los eventos del run y no de un bucle de sondeo.
+        Cuando se activa `cancel` se llama a `runs.cancel` (en cuanto se conoce el
+        run_id) y ya no se pasa más texto a `on_text`; el stream se sigue leyendo
+        hasta que el run termina para que el thread quede libre para el siguiente.
+        Si se cancela la tarea que lo espera, también se cancela el run.
+        Devuelve (estado final, run_id, textos de los mensajes completados).
+        """
+        status, run_id, texts = "queued", None, []
+        started, first_delta = time.perf_counter(), True
+        cancel_wait = asyncio.ensure_future(cancel.wait()) if cancel is not None else None
+        cancelling = False
+        async with self.client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=self.assistant_id,
+        ) as stream:
+            events = stream.__aiter__()
+            next_event = None
+            idle = 0.0
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set() and run_id is not None and not cancelling:
+                        cancelling = True
+                        await self._cancel_run(thread_id, run_id)
+                    if next_event is None:
+                        next_event = asyncio.ensure_future(events.__anext__())
+                    waiters = {next_event}
+                    if cancel_wait is not None and not cancel_wait.done():
+                        waiters.add(cancel_wait)
+                    done, _ = await asyncio.wait(waiters, timeout=idle_interval if on_idle else None,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        idle += idle_interval
+                        await on_idle(status, idle)
+                        continue
+                    if next_event not in done:
+                        # Despertó la cancelación
+                        continue
+                    try:
+                        event = next_event.result()
+                    except StopAsyncIteration:
+                        break
+                    next_event = None
+                    idle = 0.0
+
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                        run_id, status = event.data.id, event.data.status
+                    elif event.event == "thread.message.delta" and not cancelling:
+                        for block in event.data.delta.content or []:
+                            if block.type == "text" and block.text and block.text.value:
+                                if first_delta:
+                                    FIRST_DELTA.observe(time.perf_counter() - started, self.bot_name)
+                                    first_delta = False
+                                await on_text(block.text.value)
+                    elif event.event == "thread.message.completed":
+                        texts.extend(item.text.value for item in event.data.content if item.type == "text")
+            except asyncio.CancelledError:
+                # Se cancela la tarea del turno (p. ej. se perdió el lease del chat): que el
+                # run no siga ocupando el thread del que se hace cargo otro nodo
+                if run_id is not None and not cancelling and status not in FINAL_RUN_STATUSES:
+                    await self._cancel_run(thread_id, run_id)
+                raise
+            finally:
+                if next_event is not None and not next_event.done():
+                    next_event.cancel()
+                if cancel_wait is not None and not cancel_wait.done():
+                    cancel_wait.cancel()
+                RUN_DURATION.observe(time.perf_counter() - started, self.bot_name, status)
+        return status, run_id, texts
+
+    async def _relay_run(self, thread_id: str, send_to_telegram, progressive=None,
+                         on_idle: Optional[Callable[[str, float], Awaitable]] = None,
+                         cancel: Optional[asyncio.Event] = None) -> Tuple[str, Optional[str], str]:
+        """
+        Ejecuta un run y muestra la respuesta al usuario a medida que llega: editando
+        `progressive` o, sin él, con un mensaje por párrafo. Devuelve
+        (estado final, run_id, respuesta completa o, si se canceló con `cancel`,
+        el texto recibido hasta entonces).
+        """
+        answer = ""
+        buffer = ""
+
+        async def on_text(delta: str):
+            nonlocal answer, buffer
+            answer += delta
+            if progressive is not None:
+                await progressive.append(delta)
+                return
+            buffer += delta
+            # Cuando detectamos un doble salto de línea, enviamos el párrafo
+            while '\n\n' in buffer:
+                paragraph, buffer = buffer.split('\n\n', 1)
+                # El formato HTML de Telegram se aplica al enviar (renderer.py)
+                if paragraph.strip():
+                    await send_to_telegram(paragraph.strip())
+
+        status, run_id, texts = await self._stream_run(thread_id, on_text, on_idle=on_idle, cancel=cancel)
+        if cancel is not None and cancel.is_set():
+            # Lo que quedaba por enviar ya no le interesa al usuario
+            return status, run_id, answer.strip()
+
+        # Enviar cualquier texto restante en el buffer
+        if buffer.strip():
+            await send_to_telegram(buffer.strip())
+        if not answer.strip() and texts:
+            # Sin deltas (p. ej. un mensaje que llega entero): se usa el texto completado
+            answer = "\n\n".join(texts)
+            if progressive is not None:
+                await progressive.append(answer)
+            else:
+                await send_to_telegram(answer.strip())
+        return status, run_id, answer.strip()
+
+    async def stream_image_response(self, group_id: int, message_str: str, image: "PreparedImage", send_to_telegram,
+                                    progressive=None) -> Optional[str]:
+        """
+        Envía una imagen con su texto al asistente y transmite la respuesta igual que
+        `stream_response`, con los mismos eventos del run en streaming.
+        Las imágenes que ya se subieron (misma foto o, si está activado, una casi
+        igual) reutilizan su file_id a través de `image_cache`.
+        Devuelve el texto de la respuesta del asistente, si la hubo.
+        """
+        thread_id = await self.state.get_or_create(group_id, self.client.beta.threads.create)
+        if not thread_id:
+            return
+
+        logger.debug("Usando thread_id: %s para group_id: %s con imagen", thread_id, group_id)
+
+        # Primero creamos un mensaje informativo para el usuario
+        await send_to_telegram("🔍 Estoy analizando la imagen. Esto puede tardar unos momentos...")
+
+        # Modelo del asistente para diagnóstico, desde la caché (sin llamar a OpenAI)
+        model_name = self.metadata.model or "desconocido"
+
+        # Subir la imagen (o reutilizar una subida anterior) y añadirla al thread
+        try:
+            # Crear el mensaje del usuario con el texto
+            start = time.perf_counter()
+            await self.client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=message_str
+            )
+            OPENAI_REQUEST.observe(time.perf_counter() - start, self.bot_name, "messages.create")
+            logger.debug("Mensaje de texto enviado correctamente")
+            
+            file_id, cached = await self._upload_image(image)
+            
+            # Intentar con el formato image_file directamente (el que funcionó antes)
+            try:
+                await self._add_image_file(thread_id, file_id)
+            except Exception as e:
+                logger.error("Error enviando mensaje con image_file: %s", e)
+                added = False
+                if cached:
+                    # El archivo de la caché puede haberse borrado en OpenAI: se sube de nuevo
+                    self.image_cache.discard(file_id)
+                    try:
+                        file_id, _ = await self._upload_image(image)
+                        await self._add_image_file(thread_id, file_id)
+                        added = True
+                    except Exception as e2:
+                        logger.error("Error al volver a subir la imagen: %s", e2)
+                if not added:
+                    # Intentar con formato alternativo como último recurso
+                    try:
+                        logger.debug("Intentando formato alternativo...")
+                        b64_image = base64.b64encode(image.data).decode()
+                        
+                        await self.client.beta.threads.messages.create(
+                            thread_id=thread_id,
+                            role="user",
+                            content=[
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": f"data:image/jpeg;base64,{b64_image}"
+                                    }
+                                }
+                            ]
+                        )
+                        logger.debug("Formato alternativo tuvo éxito")
+                    except Exception as e2:
+                        logger.error("Error con el formato alternativo: %s", e2)
+                        await send_to_telegram("❌ No pude procesar la imagen. Por favor, intenta con otra imagen o consulta sin imagen.")
+                        return
+            
+        except Exception as e:
+            logger.error("Error subiendo archivo a OpenAI: %s", e)
+            await send_to_telegram(f"⚠️ No se pudo subir la imagen. Error: {str(e)}")
+            return
+
+        # Registramos en el historial
+        self.history.add(group_id, "user", f"{message_str} [IMAGEN adjuntada como archivo: {file_id}]")
+
+        # Avisos mientras el run no avanza, según el último evento recibido
+        next_slow_notice = SLOW_NOTICE_AFTER
+        queued_notices = []
+
+        async def on_idle(status: str, idle: float):
+            nonlocal next_slow_notice
+            if status == "queued":
+                if idle >= QUEUED_NOTICE_AFTER and not queued_notices:
+                    queued_notices.append(idle)
+                    await send_to_telegram("🔄 Tu solicitud está en cola. Esto puede tardar un momento debido a alta demanda...")
+                elif idle >= STILL_QUEUED_NOTICE_AFTER and len(queued_notices) == 1:
+                    queued_notices.append(idle)
+                    await send_to_telegram("⏳ Tu solicitud sigue en cola. A veces el procesamiento de imágenes puede tardar un poco más. Gracias por tu paciencia.")
+            elif idle >= next_slow_notice:
+                logger.warning("El run lleva %.0fs sin eventos", idle)
+                await send_to_telegram("⚠️ El análisis está tomando más tiempo del esperado. Puedo continuar esperando o puedes cancelar e intentarlo nuevamente. ¿Quieres continuar esperando?")
+                # Volver a avisar si pasa otro minuto sin novedades
+                next_slow_notice = idle + 60
+
+        # Ejecutar el asistente para procesar el mensaje y la imagen
+        try:
+            logger.debug("Iniciando análisis de la imagen...")
+            start_time = time.time()
+            run_status, run_id, answer = await self._relay_run(thread_id, send_to_telegram, progressive, on_idle=on_idle)
+            logger.debug("Run completado con estado: %s, tiempo total: %.1fs", run_status, time.time() - start_time)
+
+            if run_status == "completed" and not answer and run_id:
+                # El stream no trajo texto: leer solo los mensajes de este run
+                texts = []
+                async for msg in self.client.beta.threads.messages.list(thread_id=thread_id, run_id=run_id, order="asc"):
+                    if msg.role == "assistant":
+                        texts.extend(item.text.value for item in msg.content if item.type == "text")
+                answer = "\n\n".join(texts).strip()
+                if answer:
+                    if progressive is not None:
+                        await progressive.append(answer)
+                    else:
+                        await send_to_telegram(answer)
+
+            if run_status == "completed":
+                if answer:
+                    self.history.add(group_id, "assistant", answer)
+                    return answer
+                await send_to_telegram(f"⚠️ El asistente no generó una respuesta para la imagen. Modelo usado: {model_name}")
+            else:
+                await send_to_telegram(f"❌ El análisis falló con estado: {run_status}. Modelo usado: {model_name}")
+                
+        except Exception as e:
+            logger.error("Error durante el análisis de la imagen: %s", e)
+            await send_to_telegram(f"Lo siento, ocurrió un error al analizar la imagen: {str(e)}")
+
+    async def _upload_image(self, image: "PreparedImage"):
+        """
+        Devuelve (file_id, si venía de la caché) para la imagen, subiéndola solo
+        si no se había subido ya.
+        """
+        if self.image_cache is not None:
+            file_id = self.image_cache.lookup(image.sha256, image.dhash)
+            if file_id:
+                logger.debug("Imagen ya subida, se reutiliza el archivo %s", file_id)
+                IMAGE_UPLOADS.inc(self.bot_name, "cache")
+                return file_id, True
+
+        logger.debug("Subiendo imagen a OpenAI Files API...")
+        # Subir la imagen directamente desde memoria
+        start = time.perf_counter()
+        file_upload = await self.client.files.create(
+            file=("image.jpg", image.data, "image/jpeg"),
+            purpose="assistants"
+        )
+        PHOTO_UPLOAD.observe(time.perf_counter() - start, self.bot_name)
+        IMAGE_UPLOADS.inc(self.bot_name, "upload")
+        logger.debug("Archivo subido exitosamente, ID: %s", file_upload.id)
+        if self.image_cache is not None:
+            self.image_cache.add(image.sha256, image.dhash, file_upload.id)
+        return file_upload.id, False
+
+    async def _add_image_file(self, thread_id: str, file_id: str):
+        await self.client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=[
+                {
+                    "type": "image_file",
+                    "image_file": {
+                        "file_id": file_id
+                    }
+                }
+            ]
+        )
+        logger.debug("Mensaje con imagen enviado correctamente")
@@ -0,0 +1,75 @@
+# assistant_metadata.py
+# Caché con TTL de los datos del asistente de OpenAI (modelo, herramientas, instrucciones)
+import asyncio
+import time
+from typing import List, Optional
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class AssistantMetadataCache:
+    """
+    Guarda el resultado de `assistants.retrieve` de un asistente.
+
+    `start` lo carga al arrancar el bot y una tarea en segundo plano lo refresca
+    cada `ttl` segundos, así que leer `model`, `tools` o `instructions` nunca
+    hace una llamada a OpenAI en el camino de un mensaje. Si un refresco falla
+    se conservan los últimos datos buenos y se reintenta en `retry_interval`.
+    """
+
+    def __init__(self, client, assistant_id: str, ttl: float = 600.0, retry_interval: float = 30.0):
+        self.client = client
+        self.assistant_id = assistant_id
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.assistant = None
+        self.fetched_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.assistant, "model", None)
+
+    @property
+    def tools(self) -> List:
+        return list(getattr(self.assistant, "tools", None) or [])
+
+    @property
+    def instructions(self) -> Optional[str]:
+        return getattr(self.assistant, "instructions", None)
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.fetched_at > self.ttl
+
+    async def refresh(self) -> bool:
+        """Vuelve a leer el asistente de OpenAI. Devuelve False si no se pudo."""
+        try:
+            self.assistant = await self.client.beta.assistants.retrieve(self.assistant_id)
+        except Exception as e:
+            logger.warning("No se pudo obtener la información del asistente %s: %s", self.assistant_id, e)
+            return False
+        self.fetched_at = time.monotonic()
+        logger.debug("Modelo del asistente %s: %s", self.assistant_id, self.model)
+        return True
+
+    async def start(self):
+        """Carga los datos del asistente y arranca el refresco periódico."""
+        ok = await self.refresh()
+        self._task = asyncio.create_task(self._refresher(ok))
+
+    async def _refresher(self, ok: bool):
+        while True:
+            await asyncio.sleep(self.ttl if ok else self.retry_interval)
+            ok = await self.refresh()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
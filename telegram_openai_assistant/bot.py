@@ -1,184 +1,294 @@
-import asyncio
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, PicklePersistence
-from telegram import Update
-from openai import OpenAI
-
-from .conversation_manager import ConversationManager
-from .assistant_handler import AssistantHandler
-from .config import telegram_token_bots, assistant_id_bots
-from .handlers import BotHandlers
-
-from .config import client_api_key
-
-import threading
-import subprocess
-import os
-
-def start_keep_alive():
-    """Ejecuta keep_alive.py en segundo plano"""
-    try:
-        subprocess.Popen(["python", "keep_alive.py"])
-        print("Keep-alive ejecutado correctamente")
-    except Exception as e:
-        print(f"No se pudo iniciar keep_alive: {e}")
-
-
-# Inicia el servidor Flask antes de lanzar el bot
-try:
-    start_keep_alive()
-except Exception as e:
-    print(f"No se pudo iniciar keep_alive: {e}")
-
-
-client = OpenAI(api_key=client_api_key)
-
-
-
-class Bot:
-    def __init__(self, bot_name: str, token: str, assistant_id: str, manager: ConversationManager):
-        """Initialize the bot application with a token and assistant_id"""
-        self.token = token
-        self.bot_name = bot_name
-        self.assistant_id = assistant_id
-        self.manager = manager
-        self.assistant_handler = AssistantHandler(client, assistant_id)
-        
-        # Configurar persistencia de datos para guardar información de usuario
-        persistence_directory = os.path.join("data", f"{bot_name}_data")
-        os.makedirs(persistence_directory, exist_ok=True)
-        persistence_path = os.path.join(persistence_directory, "bot_data.pickle")
-        
-        # Crear el objeto de persistencia - compatible con python-telegram-bot 21.x
-        # Verificar versión y ajustar parámetros
-        try:
-            # Intentar con la API más reciente
-            persistence = PicklePersistence(
-                filepath=persistence_path,
-                chat_data_json=True,  # En lugar de store_chat_data
-                user_data_json=True   # Guardar también datos de usuario
-            )
-        except TypeError:
-            try:
-                # Intentar con la API alternativa
-                persistence = PicklePersistence(
-                    filepath=persistence_path
-                )
-                print(f"Usando PicklePersistence básico para {bot_name}")
-            except Exception as e:
-                print(f"Error al crear persistencia, continuando sin ella: {e}")
-                persistence = None
-        
-        self.handlers = BotHandlers(bot_name, assistant_id, token, manager)
-        
-        # Construir la aplicación con o sin persistencia
-        if persistence:
-            self.application = ApplicationBuilder().token(token).persistence(persistence).pool_timeout(60.0).build()
-        else:
-            self.application = ApplicationBuilder().token(token).pool_timeout(60.0).build()
-            
-        self.setup_handlers()
-
-    def setup_handlers(self):
-        """Sets up the command and message handlers."""
-        self.application.add_handler(CommandHandler("start", self.handlers.start))
-        self.application.add_handler(CommandHandler("help", self.handlers.help_command))
-        self.application.add_handler(CommandHandler("end", self.end_conversation))
-        
-        # Añadir manejador para fotos
-        self.application.add_handler(MessageHandler(filters.PHOTO, self.handlers.process_photo))
-        
-        # Manejador para mensajes de texto (debe ir después de los comandos y fotos)
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handlers.process_message))
-
-    async def end_conversation(self, update: Update, context):
-        """End the current conversation."""
-        await self.handlers.end_conversation(update, context)
-
-    async def send_message(self, message: str):
-        """Send a message to the specified chat_id"""
-        await self.application.bot.send_message(chat_id=self.chat_id, text=message)
-
-    async def start(self):
-        """Start the bot."""
-        await self.application.initialize()
-        await self.application.start()
-        await self.application.updater.start_polling()
-
-    async def stop(self):
-        """Stop the bot."""
-        await self.application.updater.stop()
-        await self.application.stop()
-        await self.application.shutdown()
-
-
-async def start_bots(manager: ConversationManager):
-    """Runs all bot applications concurrently."""
-    print("Iniciando aplicación de bots...")
-    names = ["Regen", "Degen"]
-    bots = {}
-    
-    # Intentar crear cada bot
-    for name, token, assistant_id in zip(names, telegram_token_bots, assistant_id_bots):
-        try:
-            print(f"Creando bot {name}...")
-            bot = Bot(name, token, assistant_id, manager)
-            bots[name] = bot
-        except Exception as e:
-            print(f"Error al crear bot {name}: {e}")
-    
-    if not bots:
-        print("No se pudo crear ningún bot. Saliendo.")
-        return
-        
-    manager.register_bots(bots)
-    
-    # Start all bots concurrently
-    print("Iniciando todos los bots...")
-    await asyncio.gather(*(bot.start() for bot in bots.values()))
-
-    try:
-        # Keep the event loop running until interrupted
-        print("Bots en funcionamiento. Presiona Ctrl+C para detener.")
-        while True:
-            await asyncio.sleep(1)
-    except KeyboardInterrupt:
-        print("Bots apagándose...")
-    except Exception as e:
-        print(f"Error inesperado: {e}")
-    finally:
-        print("Limpiando recursos...")
-        # Stop polling for all bots
-        stop_tasks = [bot.application.updater.stop() for bot in bots.values()]
-        await asyncio.gather(*stop_tasks)
-
-        # Stop all applications
-        stop_tasks = [bot.application.stop() for bot in bots.values()]
-        await asyncio.gather(*stop_tasks)
-
-        # Shutdown all applications
-        shutdown_tasks = [bot.application.shutdown() for bot in bots.values()]
-        await asyncio.gather(*shutdown_tasks)
-
-
-def main():
-    """Main function to run the bots."""
-    print("Iniciando bots de telegram...")
-    
-    # Asegurar carpetas necesarias
-    os.makedirs("data", exist_ok=True)
-    temp_image_folder = os.path.join("data", "temp_images")
-    os.makedirs(temp_image_folder, exist_ok=True)
-    
-    manager = ConversationManager()
-    
-    try:
-        asyncio.run(start_bots(manager))
-    except Exception as e:
-        print(f"Error en la ejecución principal: {e}")
-
-
-if __name__ == "__main__":
-    main()
-
-# Asegurar que main es exportada correctamente
+import asyncio
+from typing import List, Optional
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, PicklePersistence
+from telegram import Update
+from openai import AsyncOpenAI
+
+from .conversation_manager import ConversationManager
+from .assistant_handler import AssistantHandler
+from .handlers import BotHandlers
+from .qa_log import QALog
+from .send_scheduler import OutboundScheduler
+
+from .config import client_api_key, qa_log_dir, qa_log_batch_size, qa_log_flush_interval, assistant_metadata_ttl
+from .config import openai_base_url, telegram_api_url
+from .config import telegram_global_rate, telegram_chat_rate, telegram_chat_burst, telegram_group_rate_per_minute
+
+from .config import bot_mode, webhook_url, webhook_secret, http_host, http_port, metrics_port
+from .config import log_level, log_format, log_sample_rate, log_queue_size
+from .fleet import BotSpec, consume_updates, load_bot_specs, run_fleet
+from .log import configure_logging, get_logger
+from .webhook import WebhookServer, uvicorn, webhook_path
+
+import os
+
+logger = get_logger(__name__)
+
+
+# Cliente async compartido: las llamadas a OpenAI no bloquean el event loop de los bots
+client = AsyncOpenAI(api_key=client_api_key, base_url=openai_base_url)
+
+
+
+class Bot:
+    def __init__(self, bot_name: str, token: str, assistant_id: str, manager: ConversationManager,
+                 worker_id: Optional[int] = None, global_rate: float = telegram_global_rate):
+        """
+        Initialize the bot application with a token and assistant_id.
+        `global_rate` es el límite global de envíos del bot en este proceso.
+        """
+        self.token = token
+        self.bot_name = bot_name
+        self.assistant_id = assistant_id
+        self.manager = manager
+        # True cuando el bot ya recibe actualizaciones (lo consulta /readyz)
+        self.ready = False
+        self.assistant_handler = AssistantHandler(
+            client, assistant_id, manager.state, manager.image_cache, metadata_ttl=assistant_metadata_ttl,
+            bot_name=bot_name, history=manager.history,
+        )
+        # Log append-only de preguntas/respuestas; importa una vez el antiguo JSON del bot
+        self.qa_log = QALog(
+            os.path.join(qa_log_dir, f"{bot_name}_questions_answers.jsonl"),
+            batch_size=qa_log_batch_size,
+            flush_interval=qa_log_flush_interval,
+            legacy_json_path=f"{bot_name}_questions_answers.json",
+        )
+        # Respuestas ya dadas por el asistente (None si ANSWER_CACHE_SIZE=0)
+        self.answer_cache = manager.answer_cache_for(assistant_id)
+        
+        # Configurar persistencia de datos para guardar información de usuario
+        persistence_directory = os.path.join("data", f"{bot_name}_data")
+        os.makedirs(persistence_directory, exist_ok=True)
+        # En la flota cada proceso guarda sus propios chats
+        persistence_file = "bot_data.pickle" if worker_id is None else f"bot_data.w{worker_id}.pickle"
+        persistence_path = os.path.join(persistence_directory, persistence_file)
+        
+        # Crear el objeto de persistencia - compatible con python-telegram-bot 21.x
+        # Verificar versión y ajustar parámetros
+        try:
+            # Intentar con la API más reciente
+            persistence = PicklePersistence(
+                filepath=persistence_path,
+                chat_data_json=True,  # En lugar de store_chat_data
+                user_data_json=True   # Guardar también datos de usuario
+            )
+        except TypeError:
+            try:
+                # Intentar con la API alternativa
+                persistence = PicklePersistence(
+                    filepath=persistence_path
+                )
+                logger.info("Usando PicklePersistence básico para %s", bot_name)
+            except Exception as e:
+                logger.warning("Error al crear persistencia, continuando sin ella: %s", e)
+                persistence = None
+        
+        self.handlers = BotHandlers(bot_name, assistant_id, token, manager)
+        
+        # Construir la aplicación con o sin persistencia. Las actualizaciones se procesan
+        # de forma concurrente: el orden por chat y el límite de runs los impone el
+        # ChatScheduler del ConversationManager.
+        builder = ApplicationBuilder().token(token).pool_timeout(60.0).concurrent_updates(True)
+        if persistence:
+            builder = builder.persistence(persistence)
+        if telegram_api_url:
+            builder = builder.base_url(telegram_api_url.rstrip("/") + "/bot")
+        self.application = builder.build()
+
+        # Cola de salida con límites global, por chat y por grupo
+        self.outbound = OutboundScheduler(
+            self.application.bot,
+            global_rate=global_rate,
+            chat_rate=telegram_chat_rate,
+            chat_burst=telegram_chat_burst,
+            group_rate_per_minute=telegram_group_rate_per_minute,
+        )
+        self.handlers.outbound = self.outbound
+            
+        self.setup_handlers()
+
+    def setup_handlers(self):
+        """Sets up the command and message handlers."""
+        self.application.add_handler(CommandHandler("start", self.handlers.start))
+        self.application.add_handler(CommandHandler("help", self.handlers.help_command))
+        self.application.add_handler(CommandHandler("end", self.end_conversation))
+        
+        # Añadir manejador para fotos
+        self.application.add_handler(MessageHandler(filters.PHOTO, self.handlers.process_photo))
+        
+        # Manejador para mensajes de texto (debe ir después de los comandos y fotos)
+        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handlers.process_message))
+
+    async def end_conversation(self, update: Update, context):
+        """End the current conversation."""
+        await self.handlers.end_conversation(update, context)
+
+    def drop_chat(self, group_id: int) -> Optional[dict]:
+        """
+        Saca de memoria (y de la persistencia, en el próximo volcado) los
+        chat_data del chat y, en chats privados, los user_data del usuario.
+        Devuelve los chat_data que había; los handlers los rellenan de nuevo
+        con el siguiente mensaje.
+        """
+        data = self.application.chat_data.get(group_id)
+        if data is not None:
+            data = dict(data)
+            self.application.drop_chat_data(group_id)
+        # En un chat privado el id del chat es el del usuario
+        if group_id > 0 and group_id in self.application.user_data:
+            self.application.drop_user_data(group_id)
+        return data
+
+    async def send_message(self, message: str):
+        """Send a message to the specified chat_id"""
+        await self.application.bot.send_message(chat_id=self.chat_id, text=message)
+
+    async def deliver_update(self, data: dict):
+        """Mete en la cola de la Application una actualización recibida en JSON (webhook)."""
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+
+    async def start(self, receive: str = bot_mode):
+        """
+        Start the bot. `receive` decide cómo llegan las actualizaciones: "polling",
+        "webhook" (registra el webhook en Telegram) o "external" (las entrega otro
+        proceso con `deliver_update`).
+        """
+        await self.qa_log.start()
+        if self.answer_cache is not None:
+            await self.answer_cache.load(self.qa_log.path)
+        # Datos del asistente en caché antes de recibir el primer mensaje
+        await self.assistant_handler.metadata.start()
+        await self.application.initialize()
+        # Los chats cargados de la persistencia cuentan como activos desde ahora
+        self.manager.sweeper.track(self.application.chat_data.keys())
+        await self.outbound.start()
+        await self.application.start()
+        if receive == "webhook":
+            # Telegram empuja las actualizaciones al WebhookServer común
+            await self.application.bot.set_webhook(
+                url=webhook_url.rstrip("/") + webhook_path(self.token),
+                secret_token=webhook_secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        elif receive == "polling":
+            await self.application.updater.start_polling()
+        self.ready = True
+
+    async def stop(self):
+        """Stop the bot."""
+        self.ready = False
+        if self.application.updater.running:
+            await self.application.updater.stop()
+        await self.application.stop()
+        await self.outbound.close()
+        await self.application.shutdown()
+        await self.qa_log.close()
+        await self.assistant_handler.metadata.close()
+
+
+async def start_bots(manager: ConversationManager, specs: List[BotSpec], serve_http: bool = True,
+                     receive: str = bot_mode, updates=None, global_rate: float = telegram_global_rate):
+    """
+    Runs all bot applications concurrently.
+
+    `serve_http` arranca el servidor de webhooks y health checks (en la flota lo
+    lleva el supervisor) y `updates` es la cola por la que el supervisor entrega
+    las actualizaciones a este proceso. `global_rate` es el límite global de
+    envíos de cada bot en este proceso (en la flota, su parte del total).
+    """
+    logger.info("Iniciando aplicación de bots...")
+    bots = {}
+    
+    # Intentar crear cada bot
+    for spec in specs:
+        try:
+            logger.info("Creando bot %s...", spec.name)
+            bot = Bot(spec.name, spec.token, spec.assistant_id, manager, worker_id=manager.worker_id,
+                      global_rate=global_rate)
+            bots[spec.name] = bot
+        except Exception as e:
+            logger.error("Error al crear bot %s: %s", spec.name, e)
+    
+    if not bots:
+        logger.error("No se pudo crear ningún bot. Saliendo.")
+        return
+        
+    manager.register_bots(bots)
+    await manager.start()
+
+    # Un único servidor HTTP: webhooks de todos los bots, /healthz, /readyz y /metrics
+    server = WebhookServer(
+        {webhook_path(bot.token): bot.deliver_update for bot in bots.values()},
+        lambda: all(bot.ready for bot in bots.values()),
+        host=http_host, port=http_port, secret_token=webhook_secret,
+    )
+    if serve_http and (receive == "webhook" or uvicorn is not None):
+        await server.start()
+    elif serve_http:
+        logger.warning("uvicorn no está instalado: sin servidor de health checks")
+    elif metrics_port and manager.worker_id is not None and uvicorn is not None:
+        # Proceso de la flota: solo health checks y /metrics, en su propio puerto
+        server = WebhookServer(
+            {}, lambda: all(bot.ready for bot in bots.values()),
+            host=http_host, port=metrics_port + manager.worker_id,
+        )
+        await server.start()
+    
+    # Start all bots concurrently
+    logger.info("Iniciando todos los bots en modo %s...", receive)
+    await asyncio.gather(*(bot.start(receive) for bot in bots.values()))
+
+    try:
+        # Keep the event loop running until interrupted
+        logger.info("Bots en funcionamiento. Presiona Ctrl+C para detener.")
+        if updates is not None:
+            # El supervisor envía None por la cola para apagar el proceso
+            await consume_updates(updates, bots)
+        else:
+            while True:
+                await asyncio.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Bots apagándose...")
+    except Exception as e:
+        logger.exception("Error inesperado: %s", e)
+    finally:
+        logger.info("Limpiando recursos...")
+        # Stop polling, stop and shut down every bot, flushing its Q&A log
+        await asyncio.gather(*(bot.stop() for bot in bots.values()))
+        await server.stop()
+        await manager.shutdown()
+
+
+def main():
+    """Main function to run the bots."""
+    configure_logging(log_level, log_format, sample_rate=log_sample_rate, queue_size=log_queue_size)
+    logger.info("Iniciando bots de telegram...")
+    
+    # Asegurar carpetas necesarias
+    os.makedirs("data", exist_ok=True)
+    
+    specs, workers = load_bot_specs()
+    if not specs:
+        logger.error("No hay bots configurados. Revisa FLEET_CONFIG o TELEGRAM_TOKEN_BOT/ASSISTANT_ID_BOT.")
+        return
+
+    if workers > 1:
+        # Varios procesos: el supervisor reparte bots (polling) o chats (webhook)
+        run_fleet(specs, workers)
+        return
+
+    manager = ConversationManager()
+    
+    try:
+        asyncio.run(start_bots(manager, specs))
+    except Exception as e:
+        logger.exception("Error en la ejecución principal: %s", e)
+
+
+if __name__ == "__main__":
+    main()
+
+# Asegurar que main es exportada correctamente
 __all__ = ['main']
\ No newline at end of file
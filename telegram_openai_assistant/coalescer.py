@@ -0,0 +1,91 @@
+# coalescer.py
+# Ráfagas de mensajes de un mismo chat que se contestan con un único run
+import asyncio
+from typing import Dict, List, Optional
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Burst:
+    __slots__ = ("group_id", "messages", "first", "last", "done")
+
+    def __init__(self, group_id: int, message: str, now: float, done: asyncio.Future):
+        self.group_id = group_id
+        self.messages = [message]
+        self.first = now
+        self.last = now
+        # Se resuelve con el resultado del turno para todos los mensajes de la ráfaga
+        self.done = done
+
+
+class MessageCoalescer:
+    """
+    Junta en un solo turno los mensajes que un usuario manda seguidos.
+
+    Cada chat tiene como mucho una ráfaga abierta: el primer mensaje la abre
+    (`open`) y su turno la cierra (`take`) justo antes de lanzar el run. Los
+    mensajes que llegan mientras tanto se suman a ella (`join`), tanto durante
+    la espera de `window` segundos sin mensajes nuevos (`settle`, como mucho
+    `max_wait` desde el primero) como mientras el turno espera en la cola del
+    chat detrás de otro run. Con `max_messages` o más mensajes la ráfaga deja de
+    aceptar más y el siguiente abre otra; `max_messages=1` desactiva la fusión.
+    """
+
+    def __init__(self, window: float = 0.0, max_wait: float = 3.0, max_messages: int = 10):
+        self.window = window
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self._open: Dict[int, _Burst] = {}
+        self.stats = {"bursts": 0, "merged": 0}
+
+    def join(self, group_id: int, message: str) -> Optional[asyncio.Future]:
+        """
+        Añade el mensaje a la ráfaga abierta del chat y devuelve el future de su
+        turno, o None si no hay ninguna que lo admita (el llamante abre otra).
+        """
+        burst = self._open.get(group_id)
+        if burst is None or len(burst.messages) >= self.max_messages:
+            return None
+        burst.messages.append(message)
+        burst.last = asyncio.get_running_loop().time()
+        self.stats["merged"] += 1
+        return burst.done
+
+    def open(self, group_id: int, message: str) -> _Burst:
+        """Abre una ráfaga nueva con este mensaje; sustituye a la abierta si estaba llena."""
+        loop = asyncio.get_running_loop()
+        burst = _Burst(group_id, message, loop.time(), loop.create_future())
+        self._open[group_id] = burst
+        self.stats["bursts"] += 1
+        return burst
+
+    def is_open(self, burst: _Burst) -> bool:
+        return self._open.get(burst.group_id) is burst
+
+    async def settle(self, burst: _Burst):
+        """Espera a que pasen `window` segundos sin mensajes nuevos (o `max_wait` desde el primero)."""
+        loop = asyncio.get_running_loop()
+        while self.is_open(burst) and len(burst.messages) < self.max_messages:
+            delay = min(burst.last + self.window, burst.first + self.max_wait) - loop.time()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def seal(self, group_id: int):
+        """Cierra la ráfaga abierta del chat, p. ej. antes de encolar una foto que no debe adelantar."""
+        self._open.pop(group_id, None)
+
+    def take(self, burst: _Burst) -> List[str]:
+        """Cierra la ráfaga (si seguía abierta) y devuelve sus mensajes en orden de llegada."""
+        if self.is_open(burst):
+            del self._open[burst.group_id]
+        return burst.messages
+
+    def finish(self, burst: _Burst, result):
+        """Despierta a los mensajes que se sumaron a la ráfaga con el resultado de su turno."""
+        if self.is_open(burst):
+            del self._open[burst.group_id]
+        if not burst.done.done():
+            burst.done.set_result(result)
@@ -12,13 +12,169 @@ telegram_token_bots = os.getenv("TELEGRAM_TOKEN_BOT", "").split(",")
 assistant_id_bots = os.getenv("ASSISTANT_ID_BOT", "").split(",")
 
 client_api_key = os.getenv("CLIENT_API_KEY")
+# URLs base de las APIs (vacías = las oficiales): un Bot API server propio o los
+# servidores falsos de benchmarks/bench_load.py
+openai_base_url = os.getenv("OPENAI_BASE_URL") or None
+telegram_api_url = os.getenv("TELEGRAM_API_URL", "")
 
 # Optional: Clean up whitespace from each item in the lists
 telegram_token_bots = [token.strip() for token in telegram_token_bots if token.strip()]
 assistant_id_bots = [aid.strip() for aid in assistant_id_bots if aid.strip()]
 
+# Límites de concurrencia: runs de OpenAI en curso entre todos los chats,
+# trabajos por chat (incluido el que se ejecuta) y trabajos pendientes en total
+max_concurrent_runs = int(os.getenv("MAX_CONCURRENT_RUNS", "8"))
+max_queued_per_chat = int(os.getenv("MAX_QUEUED_PER_CHAT", "3"))
+max_pending_runs = int(os.getenv("MAX_PENDING_RUNS", "200"))
+
+# Registro persistente de threads de OpenAI por chat (SQLite + caché LRU)
+threads_db_path = os.getenv("THREADS_DB_PATH", os.path.join("data", "threads.sqlite3"))
+thread_cache_size = int(os.getenv("THREAD_CACHE_SIZE", "1024"))
+
+# Estado compartido entre nodos (threads, usuarios y leases por chat): "sqlite"
+# (THREADS_DB_PATH, para uno o varios procesos en la misma máquina) o "redis"
+# (REDIS_URL, para varias máquinas). NODE_ID identifica a este nodo (por defecto
+# host:pid); un chat lo procesa solo el nodo con su lease, que dura
+# CHAT_LEASE_TTL segundos si no se renueva, y otro nodo espera como mucho
+# CHAT_LEASE_WAIT segundos a que quede libre
+state_backend = os.getenv("STATE_BACKEND", "sqlite").strip().lower()
+redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+state_prefix = os.getenv("STATE_PREFIX", "tgbot:")
+node_id = os.getenv("NODE_ID", "")
+chat_lease_ttl = float(os.getenv("CHAT_LEASE_TTL", "30"))
+chat_lease_wait = float(os.getenv("CHAT_LEASE_WAIT", "120"))
+# Con STATE_BACKEND=sqlite, milisegundos que una consulta espera a que otro proceso
+# suelte la base de datos antes de fallar (un lease ocupado se reintenta después)
+sqlite_busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "200"))
+
+# Log append-only de preguntas/respuestas: carpeta y umbrales de volcado a disco
+qa_log_dir = os.getenv("QA_LOG_DIR", "data")
+qa_log_batch_size = int(os.getenv("QA_LOG_BATCH_SIZE", "100"))
+qa_log_flush_interval = float(os.getenv("QA_LOG_FLUSH_INTERVAL", "1.0"))
+
+# Contador de mensajes por bot/chat/día: archivo e intervalo de volcado en segundos
+message_count_path = os.getenv("MESSAGE_COUNT_PATH", os.path.join("data", "message_count.json"))
+message_count_flush_interval = float(os.getenv("MESSAGE_COUNT_FLUSH_INTERVAL", "30"))
+
+# Streaming de respuestas: "edit" edita un único mensaje a medida que llega el texto,
+# "paragraph" envía un mensaje por párrafo
+stream_mode = os.getenv("STREAM_MODE", "edit").strip().lower()
+stream_edit_interval_ms = int(os.getenv("STREAM_EDIT_INTERVAL_MS", "1000"))
+stream_edit_min_chars = int(os.getenv("STREAM_EDIT_MIN_CHARS", "60"))
+
+# Límites de envío a Telegram por bot: mensajes/s globales, mensajes/s por chat
+# (con ráfaga) y mensajes/min por grupo
+telegram_global_rate = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+telegram_chat_rate = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+telegram_chat_burst = float(os.getenv("TELEGRAM_CHAT_BURST", "1"))
+telegram_group_rate_per_minute = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", "20"))
+
+# Envíos a Telegram: intentos ante errores de red y espera base entre intentos (segundos)
+send_max_attempts = int(os.getenv("SEND_MAX_ATTEMPTS", "3"))
+send_retry_backoff = float(os.getenv("SEND_RETRY_BACKOFF", "1.0"))
+
+# Fotos: procesos para reducirlas, resolución útil para el modelo (lado mayor y
+# lado menor en píxeles) y calidad JPEG de la recompresión
+image_workers = int(os.getenv("IMAGE_WORKERS", "2"))
+image_max_side = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+image_short_side = int(os.getenv("IMAGE_SHORT_SIDE", "768"))
+image_jpeg_quality = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# Caché de imágenes subidas a OpenAI: base de datos, entradas máximas, días antes de
+# borrar el archivo remoto, distancia máxima de dHash para reutilizar una foto casi
+# igual (0 = solo fotos idénticas) y cada cuántos segundos se limpian los caducados
+image_cache_path = os.getenv("IMAGE_CACHE_PATH", os.path.join("data", "image_cache.sqlite3"))
+image_cache_size = int(os.getenv("IMAGE_CACHE_SIZE", "5000"))
+image_cache_ttl_days = float(os.getenv("IMAGE_CACHE_TTL_DAYS", "30"))
+image_cache_dhash_distance = int(os.getenv("IMAGE_CACHE_DHASH_DISTANCE", "0"))
+image_cache_cleanup_interval = float(os.getenv("IMAGE_CACHE_CLEANUP_INTERVAL", "3600"))
+
+# Segundos entre refrescos de los datos del asistente (modelo, herramientas, instrucciones)
+assistant_metadata_ttl = float(os.getenv("ASSISTANT_METADATA_TTL", "600"))
+
+# Recepción de actualizaciones: "polling" o "webhook". En modo webhook, WEBHOOK_URL es
+# la URL pública base del servidor (cada bot usa una ruta derivada de su token) y
+# WEBHOOK_SECRET la cabecera secreta que Telegram debe enviar. El mismo servidor HTTP
+# responde a /healthz, /readyz y /metrics en PORT en ambos modos.
+bot_mode = os.getenv("BOT_MODE", "polling").strip().lower()
+webhook_url = os.getenv("WEBHOOK_URL", "")
+webhook_secret = os.getenv("WEBHOOK_SECRET") or None
+http_host = os.getenv("HOST", "0.0.0.0")
+http_port = int(os.getenv("PORT", "10000"))
+# En la flota multiproceso, cada proceso sirve sus propias /metrics en
+# METRICS_PORT + número de proceso (0 = sin métricas por proceso)
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+
+if bot_mode == "webhook" and not webhook_url:
+    raise ValueError("BOT_MODE=webhook necesita WEBHOOK_URL")
+
+# Reparto de turnos entre bots: "receiver" (responde el bot que recibió el mensaje),
+# "round_robin" o "least_in_flight"; fallos seguidos para retirar un bot y segundos fuera
+dispatch_strategy = os.getenv("DISPATCH_STRATEGY", "receiver").strip().lower()
+bot_failure_threshold = int(os.getenv("BOT_FAILURE_THRESHOLD", "3"))
+bot_failure_cooldown = float(os.getenv("BOT_FAILURE_COOLDOWN", "60"))
+
+# Flota de bots: JSON con nombre, token y assistant id de cada bot (si no, se usan
+# TELEGRAM_TOKEN_BOT/ASSISTANT_ID_BOT con los nombres de BOT_NAMES) y número de
+# procesos; con más de uno, un supervisor reparte los bots o los chats entre ellos
+fleet_config_path = os.getenv("FLEET_CONFIG", "")
+bot_names = [name.strip() for name in os.getenv("BOT_NAMES", "").split(",") if name.strip()]
+fleet_workers = int(os.getenv("FLEET_WORKERS", "1"))
+
+# Logs: nivel, formato ("json", una línea por registro, o "text"), fracción de turnos
+# cuyos registros por debajo de WARNING se conservan y registros que caben en la cola
+# del hilo de escritura antes de empezar a descartar
+log_level = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+log_format = os.getenv("LOG_FORMAT", "json").strip().lower()
+log_sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+log_queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Caché de respuestas por asistente (opcional): las preguntas que se repiten se contestan
+# con una respuesta ya dada, sin lanzar un run. Respuestas como máximo por asistente
+# (0 = desactivada), días de vigencia, confianza mínima (0-1) para servir una respuesta
+# y palabras con contenido que debe tener una pregunta para no depender del contexto.
+# Privacidad: la caché es común a todos los chats del asistente, así que la respuesta
+# que recibió un usuario se sirve a otros que pregunten lo mismo. Se guarda sin la
+# etiqueta con su nombre y no se guardan las respuestas que lo nombran, pero una
+# respuesta a una pregunta con datos personales ("mi hija de 3 meses...") puede
+# llegar a otro chat con la misma pregunta. Déjala a 0 si eso no es aceptable
+answer_cache_size = int(os.getenv("ANSWER_CACHE_SIZE", "0"))
+answer_cache_ttl_days = float(os.getenv("ANSWER_CACHE_TTL_DAYS", "7"))
+answer_cache_min_confidence = float(os.getenv("ANSWER_CACHE_MIN_CONFIDENCE", "0.95"))
+answer_cache_min_tokens = int(os.getenv("ANSWER_CACHE_MIN_TOKENS", "3"))
+
+# Ráfagas de mensajes: los que un usuario manda seguidos se contestan con un solo run.
+# Milisegundos sin mensajes nuevos que se esperan antes de lanzar el turno (0 = no se
+# espera; aun así se juntan los que llegan mientras el turno está en cola), espera
+# máxima desde el primer mensaje y mensajes como máximo por turno (1 = sin fusión)
+coalesce_window_ms = int(os.getenv("COALESCE_WINDOW_MS", "0"))
+coalesce_max_wait_ms = int(os.getenv("COALESCE_MAX_WAIT_MS", "3000"))
+coalesce_max_messages = int(os.getenv("COALESCE_MAX_MESSAGES", "10"))
+
+# Mensaje nuevo mientras se responde al anterior: "append" (se responde después, junto
+# con los demás que lleguen), "queue" (cada mensaje en su propio turno) o "cancel" (se
+# cancela el run en curso, se descarta lo que quedaba por enviar y se responde a lo
+# nuevo). SUPERSEDE_POLICY_GROUPS se aplica a los grupos, donde el mensaje puede ser de
+# otra persona
+supersede_policy = os.getenv("SUPERSEDE_POLICY", "append").strip().lower()
+supersede_policy_groups = os.getenv("SUPERSEDE_POLICY_GROUPS", "append").strip().lower()
+
+# Historial reciente de cada chat en memoria: mensajes por chat, memoria máxima entre
+# todos los chats (al pasarla se olvidan los chats inactivos más antiguos) y caracteres
+# máximos de cada mensaje guardado
+history_per_chat = int(os.getenv("HISTORY_PER_CHAT", "20"))
+history_max_bytes = int(os.getenv("HISTORY_MAX_BYTES", str(32 * 1024 * 1024)))
+history_max_chars = int(os.getenv("HISTORY_MAX_CHARS", "4000"))
+
+# Chats inactivos: segundos sin mensajes tras los que su estado sale de memoria (chat_data,
+# historial, afinidad de bot; 0 = nunca), cada cuántos segundos se revisan y días sin
+# uso tras los que se borra su thread de OpenAI (0 = nunca; el siguiente mensaje del
+# chat empieza una conversación nueva)
+idle_chat_ttl = float(os.getenv("IDLE_CHAT_TTL", "3600"))
+idle_sweep_interval = float(os.getenv("IDLE_SWEEP_INTERVAL", "300"))
+thread_delete_after_days = float(os.getenv("THREAD_DELETE_AFTER_DAYS", "0"))
+
 # Debugging print to verify the lists (remove in production)
 #print("Telegram Tokens:", telegram_token_bots)
 #print("Assistant IDs:", assistant_id_bots)
 #print("Client API Key:", client_api_key)
-print("Vamos a por ello!")
\ No newline at end of file
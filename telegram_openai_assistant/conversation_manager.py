@@ -1,255 +1,681 @@
-import time
-import asyncio
-import re
-import os
-from typing import Optional, Dict
-from telegram.constants import ParseMode
-
-class ConversationManager:
-    """Manages global state and orchestrates bot-to-bot conversations."""
-    def __init__(self):
-        self.all_bots: Dict[str, 'Bot'] = {}  # Dictionary to hold all bots by name
-        self.active_conversation: Dict[int, dict] = {}  # {group_id: conversation_state}
-        self.bot_order: list[str] = []  # List of bot names in fixed order
-        self.current_bot_index: int = 0  # Tracks the current bot in the rotation
-        self.last_assistant_response = None
-        self.threads: Dict[int, str] = {}  # {group_id: thread_id} almacena los hilos en memoria
-        self.user_data: Dict[int, Dict[str, str]] = {}  # Almacena información de usuarios {group_id: {name: nombre, ...}}
-    
-    def register_bots(self, bots: Dict[str, 'Bot']):
-        """Registra los bots disponibles en la instancia de ConversationManager."""
-        self.all_bots = bots
-        print("[DEBUG] Bots registrados correctamente.")
-
-    def is_active(self, group_id: int) -> bool:
-        """Verifica si un group_id tiene una conversación activa."""
-        return group_id in self.threads
-
-    def get_thread_id(self, group_id: int) -> Optional[str]:
-        """Obtiene el thread_id asociado a un group_id si existe."""
-        return self.threads.get(group_id)
-
-    def set_thread_id(self, group_id: int, thread_id: str):
-        """Asocia un thread_id a un group_id en la memoria del proyecto."""
-        if thread_id and isinstance(thread_id, str):  # Asegurar que el thread_id es válido antes de asignarlo
-            self.threads[group_id] = thread_id
-            print(f"[DEBUG] Se asoció thread_id: {thread_id} al group_id: {group_id}")
-        else:
-            print(f"[DEBUG] No se encontró un thread_id para group_id: {group_id}, creando uno nuevo.")
-            next_bot = next(iter(self.all_bots.values()))
-            thread = next_bot.assistant_handler.client.beta.threads.create()
-            if thread and hasattr(thread, 'id') and thread.id:
-                self.threads[group_id] = thread.id
-                print(f"[DEBUG] Nuevo thread_id creado: {thread.id} para group_id: {group_id}")
-            else:
-                print(f"[ERROR] No se pudo crear un thread válido para group_id: {group_id}")
-
-    def get_next_bot(self) -> Optional[str]:
-        """Obtiene el siguiente bot disponible en la rotación para responder."""
-        if not self.all_bots:
-            return None
-        return next(iter(self.all_bots.keys()))
-
-    def prepare_text_for_html(self, text):
-        """
-        Prepara el texto para ser enviado con formato HTML a Telegram.
-        Convierte markdown básico a HTML y hace las sustituciones necesarias.
-        """
-        # Hacer un escape general de caracteres HTML
-        text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-        
-        # Eliminar espacios antes de los dos puntos
-        text = re.sub(r'\s+:', r':', text)
-        
-        # Detectar y formatear elementos de lista numerada (1. Título: Contenido)
-        text = re.sub(r'(\d+)\.\s+([^:]+):', r'\1. <b>\2</b>:', text)
-        
-        # Convertir **texto** o *texto* a <b>texto</b> (negrita)
-        text = re.sub(r'\*\*([^*]+)\*\*', r'<b>\1</b>', text)
-        text = re.sub(r'\*([^*]+)\*', r'<b>\1</b>', text)
-        
-        # Convertir _texto_ a <i>texto</i> (cursiva)
-        text = re.sub(r'_([^_]+)_', r'<i>\1</i>', text)
-        
-        # Restaurar las etiquetas HTML que necesitamos (deshacer los escapes para etiquetas que queremos permitir)
-        text = text.replace('&lt;b&gt;', '<b>').replace('&lt;/b&gt;', '</b>')
-        text = text.replace('&lt;i&gt;', '<i>').replace('&lt;/i&gt;', '</i>')
-        
-        return text
-
-    def save_user_info(self, group_id: int, name: str):
-        """Guarda información del usuario para personalizar respuestas."""
-        if group_id not in self.user_data:
-            self.user_data[group_id] = {}
-        self.user_data[group_id]['name'] = name
-        print(f"[DEBUG] Guardada información del usuario {name} para group_id: {group_id}")
-
-    def get_user_name(self, group_id: int) -> str:
-        """Obtiene el nombre del usuario si está disponible."""
-        if group_id in self.user_data and 'name' in self.user_data[group_id]:
-            return self.user_data[group_id]['name']
-        return ""
-
-    async def handle_turn(self, group_id: int, message: str) -> None:
-        """Procesa un mensaje para el grupo correspondiente."""
-        print(f"[DEBUG] Procesando mensaje para group_id: {group_id}")
-
-        # Extraer información del usuario si está en el formato esperado
-        user_name_match = re.search(r'\[INFORMACIÓN DEL USUARIO: Nombre=([^\]]+)\]', message)
-        if user_name_match:
-            user_name = user_name_match.group(1)
-            self.save_user_info(group_id, user_name)
-            # Eliminar la etiqueta de información del usuario del mensaje
-            message = re.sub(r'\[INFORMACIÓN DEL USUARIO: Nombre=[^\]]+\]\s*\n*', '', message)
-            print(f"[DEBUG] Mensaje procesado para {user_name}: {message}")
-
-        thread_id = self.get_thread_id(group_id)
-        if not thread_id:
-            self.set_thread_id(group_id, None)
-            thread_id = self.get_thread_id(group_id)
-
-        if not thread_id:
-            print(f"[ERROR] No se pudo obtener o crear un thread_id válido para group_id: {group_id}")
-            return
-
-        print(f"[DEBUG] Usando thread_id: {thread_id} para group_id: {group_id}")
-
-        next_bot_name = self.get_next_bot()
-        if not next_bot_name:
-            print("[ERROR] No hay bots disponibles para responder.")
-            return
-
-        next_bot = self.all_bots[next_bot_name]
-        user_name = self.get_user_name(group_id)
-
-        async def send_to_telegram(chunk):
-            """Envía la respuesta del bot al usuario/grupo correcto con formato HTML."""
-            try:
-                # Personalizar la respuesta con el nombre del usuario si está disponible
-                if user_name:
-                    # Añadir personalización inteligente - solo si la respuesta parece apropiada
-                    if re.search(r'^(hola|buenos días|buenas tardes|buenas noches)', chunk.lower()):
-                        chunk = chunk.replace('Hola', f'Hola {user_name}', 1)
-                    elif 'espero' in chunk.lower() and '!' in chunk:
-                        chunk = chunk.replace('!', f", {user_name}!", 1)
-                
-                # Convertir texto a formato HTML para mejor compatibilidad
-                html_text = self.prepare_text_for_html(chunk)
-                await next_bot.application.bot.send_message(
-                    chat_id=group_id, 
-                    text=html_text,
-                    parse_mode=ParseMode.HTML
-                )
-            except Exception as e:
-                # Si falla con HTML, intentar con Markdown
-                print(f"[WARN] Error enviando mensaje con HTML: {e}")
-                try:
-                    await next_bot.application.bot.send_message(
-                        chat_id=group_id, 
-                        text=chunk,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                except Exception as e:
-                    # Si falla con Markdown, intentar sin formato
-                    print(f"[WARN] Error enviando mensaje con Markdown: {e}")
-                    try:
-                        await next_bot.application.bot.send_message(
-                            chat_id=group_id, 
-                            text=chunk
-                        )
-                    except Exception as e:
-                        print(f"[ERROR] Error enviando mensaje a Telegram: {e}")
-
-        try:
-            await next_bot.assistant_handler.stream_response(group_id, message, send_to_telegram)
-        except Exception as e:
-            print(f"[ERROR] Error durante el procesamiento del mensaje: {e}")
-    
-    async def handle_image(self, group_id: int, message: str, image_base64: str, image_path: str) -> None:
-        """Procesa un mensaje que contiene una imagen."""
-        print(f"[DEBUG] Procesando imagen para group_id: {group_id}")
-        
-        # Extraer información del usuario
-        user_name_match = re.search(r'\[INFORMACIÓN DEL USUARIO: Nombre=([^\]]+)\]', message)
-        if user_name_match:
-            user_name = user_name_match.group(1)
-            self.save_user_info(group_id, user_name)
-            # Eliminar la etiqueta de información del usuario del mensaje
-            message = re.sub(r'\[INFORMACIÓN DEL USUARIO: Nombre=[^\]]+\]\s*\n*', '', message)
-            
-        thread_id = self.get_thread_id(group_id)
-        if not thread_id:
-            self.set_thread_id(group_id, None)
-            thread_id = self.get_thread_id(group_id)
-            
-        if not thread_id:
-            print(f"[ERROR] No se pudo obtener o crear un thread_id válido para group_id: {group_id}")
-            return
-            
-        next_bot_name = self.get_next_bot()
-        if not next_bot_name:
-            print("[ERROR] No hay bots disponibles para responder.")
-            return
-            
-        next_bot = self.all_bots[next_bot_name]
-        user_name = self.get_user_name(group_id)
-        
-        # Mismo callback de envío que en handle_turn
-        async def send_to_telegram(chunk):
-            try:
-                # Personalizar la respuesta con el nombre del usuario si está disponible
-                if user_name:
-                    # Añadir personalización inteligente - solo si la respuesta parece apropiada
-                    if re.search(r'^(hola|buenos días|buenas tardes|buenas noches)', chunk.lower()):
-                        chunk = chunk.replace('Hola', f'Hola {user_name}', 1)
-                    elif 'espero' in chunk.lower() and '!' in chunk:
-                        chunk = chunk.replace('!', f", {user_name}!", 1)
-                
-                # Convertir texto a formato HTML para mejor compatibilidad
-                html_text = self.prepare_text_for_html(chunk)
-                await next_bot.application.bot.send_message(
-                    chat_id=group_id, 
-                    text=html_text,
-                    parse_mode=ParseMode.HTML
-                )
-            except Exception as e:
-                print(f"[WARN] Error enviando mensaje con HTML: {e}")
-                try:
-                    await next_bot.application.bot.send_message(
-                        chat_id=group_id, 
-                        text=chunk,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                except Exception as e:
-                    try:
-                        await next_bot.application.bot.send_message(
-                            chat_id=group_id, 
-                            text=chunk
-                        )
-                    except Exception as e:
-                        print(f"[ERROR] Error enviando mensaje a Telegram: {e}")
-        
-        try:
-            # Llamar al método específico para imágenes en AssistantHandler
-            await next_bot.assistant_handler.stream_image_response(
-                group_id, message, image_base64, image_path, send_to_telegram
-            )
-        except Exception as e:
-            print(f"[ERROR] Error durante el procesamiento de la imagen: {e}")
-            # Intentar enviar un mensaje de error
-            try:
-                await next_bot.application.bot.send_message(
-                    chat_id=group_id,
-                    text=f"⚠️ Lo siento, hubo un problema al procesar la imagen. Error: {str(e)}",
-                    parse_mode=ParseMode.HTML
-                )
-            except:
-                pass  # Si esto también falla, lo dejamos pasar
-            
-    def end_conversation(self, group_id: int) -> bool:
-        """Finaliza una conversación activa."""
-        if group_id in self.threads:
-            del self.threads[group_id]
-            # No eliminamos los datos del usuario para mantener la personalización
-            return True
+import time
+import asyncio
+import re
+import os
+from typing import Awaitable, Callable, Optional, Dict, Tuple
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, NetworkError
+
+from .config import (
+    max_concurrent_runs, max_queued_per_chat, max_pending_runs, threads_db_path, thread_cache_size,
+    message_count_path, message_count_flush_interval,
+    stream_mode, stream_edit_interval_ms, stream_edit_min_chars, send_max_attempts, send_retry_backoff,
+    image_workers, image_max_side, image_short_side, image_jpeg_quality,
+    image_cache_path, image_cache_size, image_cache_ttl_days, image_cache_dhash_distance,
+    image_cache_cleanup_interval, dispatch_strategy, bot_failure_threshold, bot_failure_cooldown,
+    state_backend, redis_url, state_prefix, node_id, chat_lease_ttl, chat_lease_wait, sqlite_busy_timeout_ms,
+    answer_cache_size, answer_cache_ttl_days, answer_cache_min_confidence, answer_cache_min_tokens,
+    coalesce_window_ms, coalesce_max_wait_ms, coalesce_max_messages, supersede_policy, supersede_policy_groups,
+    history_per_chat, history_max_bytes, history_max_chars, idle_chat_ttl, idle_sweep_interval,
+    thread_delete_after_days,
+)
+from .answer_cache import USER_INFO_RE, AnswerCache
+from .coalescer import MessageCoalescer
+from .dispatch import Dispatcher
+from .history import ChatHistory
+from .image_cache import ImageUploadCache
+from .image_processing import ImageProcessor, PreparedImage
+from .message_counter import MessageCounter
+from .log import current_trace, get_logger, use_trace
+from .metrics import (
+    ANSWER_CACHE_ENTRIES, BOT_IN_FLIGHT, CHAT_HISTORY_BYTES, CHAT_HISTORY_CHATS, CHAT_HISTORY_RECORDS,
+    CHATS_IN_MEMORY, IDLE_EVICTIONS, MESSAGES_COALESCED, QUEUE_DEPTH, QUEUE_WAIT, RUNS_IN_FLIGHT, RUNS_SUPERSEDED,
+    SEND_RESULTS, TELEGRAM_SEND,
+)
+from .renderer import render_telegram_html, validate_telegram_html
+from .scheduler import ChatScheduler
+from .send_scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+from .streaming import ProgressiveMessage
+from .state_store import ChatLeases, create_state_store, default_node_id
+from .sweeper import IdleSweeper
+
+logger = get_logger(__name__)
+
+# Personalización de saludos con el nombre del usuario
+_GREETING_RE = re.compile(r'(hola|buenos días|buenas tardes|buenas noches)', re.IGNORECASE)
+_HOPE_RE = re.compile(r'espero', re.IGNORECASE)
+
+# Qué pasa con la respuesta en curso cuando llega otro mensaje del chat: "queue" (cada
+# mensaje tiene su propio turno después), "append" (los que lleguen se responden juntos
+# en el turno siguiente) o "cancel" (se cancela el run y se responde a lo nuevo)
+SUPERSEDE_POLICIES = ("queue", "append", "cancel")
+
+# Estados finales de un run que no cuentan como fallo del bot
+HEALTHY_RUN_STATUSES = ("completed", "cancelled")
+
+SUPERSEDED_NOTE = "✂️ Respuesta interrumpida: te contesto a tu nuevo mensaje."
+
+class ConversationManager:
+    """Manages global state and orchestrates bot-to-bot conversations."""
+    def __init__(self, worker_id: Optional[int] = None, state_client=None):
+        # Proceso de la flota al que pertenece (None si solo hay uno)
+        self.worker_id = worker_id
+        self.all_bots: Dict[str, 'Bot'] = {}  # Dictionary to hold all bots by name
+        self.active_conversation: Dict[int, dict] = {}  # {group_id: conversation_state}
+        self.bot_order: list[str] = []  # List of bot names in fixed order
+        self.current_bot_index: int = 0  # Tracks the current bot in the rotation
+        self.last_assistant_response = None
+        # Threads, datos de usuario y leases por chat, compartidos por todos los bots y nodos
+        # (`state_client` permite inyectar un cliente Redis ya creado)
+        self.state = create_state_store(
+            state_backend, threads_db_path, cache_size=thread_cache_size,
+            redis_url=redis_url, prefix=state_prefix, client=state_client, busy_timeout_ms=sqlite_busy_timeout_ms,
+        )
+        self.node_id = node_id or default_node_id()
+        self.leases = ChatLeases(self.state, self.node_id, ttl=chat_lease_ttl, wait_timeout=chat_lease_wait)
+        # Mensajes recibidos por bot, chat y día
+        # (cada proceso de la flota escribe su propio archivo; SQLite sí se comparte)
+        counter_path = message_count_path
+        if worker_id is not None:
+            root, ext = os.path.splitext(message_count_path)
+            counter_path = f"{root}.w{worker_id}{ext}"
+        self.message_counter = MessageCounter(counter_path, flush_interval=message_count_flush_interval)
+        # Una cola FIFO por chat y un límite global de runs en curso
+        self.scheduler = ChatScheduler(
+            max_in_flight=max_concurrent_runs,
+            max_queue_per_chat=max_queued_per_chat,
+            max_pending_total=max_pending_runs,
+        )
+        # Mensajes seguidos de un chat (o que llegan mientras su turno espera) en un solo run
+        self.coalescer = MessageCoalescer(
+            window=coalesce_window_ms / 1000,
+            max_wait=coalesce_max_wait_ms / 1000,
+            max_messages=coalesce_max_messages,
+        )
+        # Pool de procesos que reduce las fotos antes de subirlas
+        self.image_processor = ImageProcessor(
+            max_workers=image_workers, max_side=image_max_side, short_side=image_short_side,
+            quality=image_jpeg_quality, with_dhash=image_cache_dhash_distance > 0,
+        )
+        # Imágenes ya subidas a OpenAI (por hash) para no volver a subirlas
+        self.image_cache = ImageUploadCache(
+            image_cache_path,
+            max_entries=image_cache_size,
+            ttl=image_cache_ttl_days * 86400,
+            dhash_distance=image_cache_dhash_distance,
+            cleanup_interval=image_cache_cleanup_interval,
+        )
+        # Qué bot responde cada turno, con su carga y salud
+        self.dispatcher = Dispatcher(
+            dispatch_strategy, failure_threshold=bot_failure_threshold, cooldown=bot_failure_cooldown
+        )
+        # Política ante mensajes nuevos a mitad de respuesta, por chat (si no, la de por defecto)
+        # y run en curso de cada chat: su señal de cancelación y el bot que responde
+        for policy in (supersede_policy, supersede_policy_groups):
+            if policy not in SUPERSEDE_POLICIES:
+                raise ValueError(f"Política desconocida: {policy!r} (opciones: {', '.join(SUPERSEDE_POLICIES)})")
+        self.supersede_policies: Dict[int, str] = {}
+        self._running: Dict[int, Tuple[asyncio.Event, 'Bot']] = {}
+        # Últimos mensajes de cada chat, común a todos los bots y con un presupuesto de memoria
+        self.history = ChatHistory(per_chat=history_per_chat, max_bytes=history_max_bytes,
+                                   max_chars=history_max_chars)
+        # Saca de memoria los chats inactivos y, si se pide, borra sus threads antiguos
+        self.sweeper = IdleSweeper(
+            self.evict_chat, idle_ttl=idle_chat_ttl, interval=idle_sweep_interval,
+            stale_threads=self.state.stale_threads, delete_thread=self.delete_stale_thread,
+            thread_ttl=thread_delete_after_days * 86400,
+        )
+        # Respuestas ya dadas por cada asistente (solo con ANSWER_CACHE_SIZE > 0)
+        self.answer_caches: Dict[str, AnswerCache] = {}
+        # Formato elegido por mensaje y cuántas veces hubo que recurrir a texto plano o reintentar
+        self.send_stats = {"html": 0, "plain_fallback": 0, "html_rejected": 0, "network_retries": 0, "failed": 0}
+        # Gauges de /metrics: se leen al consultarlas, sin coste por turno
+        RUNS_IN_FLIGHT.set_function(lambda: self._per_bot(self.scheduler.in_flight_by))
+        QUEUE_DEPTH.set_function(lambda: self._per_bot(self.scheduler.pending_by))
+        BOT_IN_FLIGHT.set_function(
+            lambda: {name: health.in_flight for name, health in self.dispatcher.health.items()}
+        )
+        CHATS_IN_MEMORY.set_function(lambda: len(self.sweeper))
+        CHAT_HISTORY_CHATS.set_function(lambda: len(self.history))
+        CHAT_HISTORY_RECORDS.set_function(lambda: self.history.records)
+        CHAT_HISTORY_BYTES.set_function(lambda: self.history.bytes)
+        ANSWER_CACHE_ENTRIES.set_function(lambda: {key: len(cache) for key, cache in self.answer_caches.items()})
+
+    def _per_bot(self, counts) -> Dict[str, int]:
+        """Valor de cada bot para una gauge, con 0 en los que no tienen nada (la serie no desaparece)."""
+        values = {name: 0 for name in self.all_bots}
+        values.update(counts)
+        return values
+
+    def answer_cache_for(self, assistant_id: str) -> Optional[AnswerCache]:
+        """Caché de respuestas del asistente, común a los bots que lo usan (None si está desactivada)."""
+        if answer_cache_size <= 0:
+            return None
+        if assistant_id not in self.answer_caches:
+            self.answer_caches[assistant_id] = AnswerCache(
+                max_entries=answer_cache_size,
+                ttl=answer_cache_ttl_days * 86400,
+                min_confidence=answer_cache_min_confidence,
+                min_tokens=answer_cache_min_tokens,
+                label=assistant_id,
+            )
+        return self.answer_caches[assistant_id]
+    
+    def register_bots(self, bots: Dict[str, 'Bot']):
+        """Registra los bots disponibles en la instancia de ConversationManager."""
+        self.all_bots = bots
+        self.dispatcher.register(bots.keys())
+        logger.debug("Bots registrados correctamente (reparto: %s).", self.dispatcher.strategy)
+
+    async def start(self):
+        """Arranca las tareas en segundo plano del estado compartido."""
+        await self.message_counter.start()
+        # Todos los bots comparten el cliente de OpenAI: cualquiera sirve para borrar archivos
+        client = next(iter(self.all_bots.values())).assistant_handler.client if self.all_bots else None
+        await self.image_cache.start(client.files.delete if client else None)
+        if idle_chat_ttl > 0 or thread_delete_after_days > 0:
+            await self.sweeper.start()
+
+    async def shutdown(self):
+        """Detiene las colas de trabajo y guarda el estado pendiente."""
+        await self.sweeper.close()
+        await self.scheduler.shutdown()
+        await self.message_counter.close()
+        await self.image_processor.close()
+        await self.image_cache.close()
+        await self.state.close()
+        logger.info("Caché de imágenes: %s, aciertos %.0f%%", self.image_cache.stats, self.image_cache.hit_rate * 100)
+        logger.info("Formato de envíos: %s", self.send_stats)
+        logger.info("Turnos por bot: %s", self.dispatcher.snapshot())
+        logger.info("Leases de chats (%s): %s", self.node_id, self.leases.stats)
+        logger.info("Ráfagas de mensajes: %s", self.coalescer.stats)
+        logger.info("Chats inactivos: %s", self.sweeper.stats)
+        logger.info("Historial: %s chats, %s mensajes, %.1f MB, %s", len(self.history), self.history.records,
+                    self.history.bytes / 1e6, self.history.stats)
+        for assistant_id, cache in self.answer_caches.items():
+            logger.info("Caché de respuestas de %s: %s, aciertos %.0f%%", assistant_id, cache.stats,
+                        cache.hit_rate * 100)
+
+    async def evict_chat(self, group_id: int) -> bool:
+        """
+        Saca de memoria lo que el proceso guarda de un chat inactivo: chat_data y
+        user_data de los bots, historial, afinidad de bot y caché del thread. El
+        thread y el nombre del usuario siguen en el StateStore, y lo demás se
+        rehace con el siguiente mensaje. Devuelve False si el chat está ocupado.
+        """
+        if self.scheduler.is_busy(group_id) or group_id in self._running:
+            return False
+        name = None
+        for bot in self.all_bots.values():
+            data = bot.drop_chat(group_id) or {}
+            name = name or data.get('user_info', {}).get('name')
+        if name and not await self.get_user_name(group_id):
+            # El chat solo hizo /start: su nombre aún no estaba en el estado compartido
+            await self.save_user_info(group_id, name)
+        self.history.forget(group_id)
+        self.dispatcher.evict(group_id)
+        self.state.evict(group_id)
+        IDLE_EVICTIONS.inc("chat")
+        return True
+
+    async def delete_stale_thread(self, group_id: int, thread_id: str) -> bool:
+        """
+        Borra en OpenAI el thread de un chat que lleva THREAD_DELETE_AFTER_DAYS sin
+        usarse y lo olvida; si el usuario vuelve, empieza un thread nuevo. Se hace
+        con un lease propio del chat, así que ningún turno (de este u otro nodo)
+        puede usar el thread mientras se borra.
+        """
+        if self.scheduler.is_busy(group_id) or not self.all_bots:
+            return False
+        owner = f"{self.node_id}/sweeper"
+        if not await self.state.acquire_lease(group_id, owner, chat_lease_ttl):
+            return False
+        try:
+            # Con el lease en la mano se comprueba que sigue siendo el mismo thread y sin uso
+            last_used = await self.state.last_used(group_id) or 0.0
+            if (await self.state.get_thread(group_id) != thread_id
+                    or last_used > time.time() - self.sweeper.thread_ttl):
+                return False
+            client = next(iter(self.all_bots.values())).assistant_handler.client
+            try:
+                await client.beta.threads.delete(thread_id)
+            except Exception as e:
+                # Si ya no existe en OpenAI basta con olvidarlo; si no, se reintenta en otra pasada
+                if getattr(e, "status_code", None) != 404:
+                    raise
+            await self.state.delete_thread(group_id)
+            self.dispatcher.evict(group_id)
+            self.history.forget(group_id)
+            IDLE_EVICTIONS.inc("thread")
+            logger.debug("Thread %s del chat %s borrado por inactividad", thread_id, group_id)
+            return True
+        finally:
+            await self.state.release_lease(group_id, owner)
+
+    async def is_active(self, group_id: int) -> bool:
+        """Verifica si un group_id tiene una conversación activa."""
+        return await self.state.get_thread(group_id) is not None
+
+    async def get_thread_id(self, group_id: int) -> Optional[str]:
+        """Obtiene el thread_id asociado a un group_id si existe."""
+        return await self.state.get_thread(group_id)
+
+    async def set_thread_id(self, group_id: int, thread_id: str):
+        """Asocia un thread_id existente a un group_id."""
+        await self.state.set_thread(group_id, thread_id)
+        logger.debug("Se asoció thread_id: %s al group_id: %s", thread_id, group_id)
+
+    def supersede_policy(self, group_id: int) -> str:
+        """Política del chat ante un mensaje nuevo mientras se responde al anterior."""
+        policy = self.supersede_policies.get(group_id)
+        if policy is not None:
+            return policy
+        # Los ids negativos son grupos: ahí el mensaje nuevo puede ser de otra persona
+        return supersede_policy_groups if group_id < 0 else supersede_policy
+
+    def set_supersede_policy(self, group_id: int, policy: Optional[str]):
+        """Fija la política de un chat; con None vuelve a la de por defecto."""
+        if policy is None:
+            self.supersede_policies.pop(group_id, None)
+            return
+        if policy not in SUPERSEDE_POLICIES:
+            raise ValueError(f"Política desconocida: {policy!r} (opciones: {', '.join(SUPERSEDE_POLICIES)})")
+        self.supersede_policies[group_id] = policy
+
+    def supersede(self, group_id: int) -> bool:
+        """
+        Cancela el run en curso del chat y descarta los envíos suyos que siguen en
+        cola. Devuelve False si el chat no tenía ningún run que cancelar.
+        """
+        running = self._running.get(group_id)
+        if running is None or running[0].is_set():
+            return False
+        cancel, bot = running
+        cancel.set()
+        dropped = bot.outbound.drop(group_id, cancel)
+        RUNS_SUPERSEDED.inc(bot.bot_name)
+        logger.info("Run cancelado por un mensaje nuevo (%s envíos descartados)", dropped)
+        return True
+
+    def get_next_bot(self, group_id: int, receiver: Optional[str] = None) -> Optional[str]:
+        """
+        Obtiene el bot que debe responder en el chat según la estrategia de reparto,
+        la salud de cada bot y el bot que ya venía atendiendo el chat.
+        """
+        if not self.all_bots:
+            return None
+        return self.dispatcher.pick(group_id, receiver)
+
+    def personalize(self, chunk: str, user_name: str) -> str:
+        """Personaliza la respuesta con el nombre del usuario si está disponible."""
+        if user_name:
+            # Añadir personalización inteligente - solo si la respuesta parece apropiada
+            if _GREETING_RE.match(chunk):
+                chunk = chunk.replace('Hola', f'Hola {user_name}', 1)
+            elif '!' in chunk and _HOPE_RE.search(chunk):
+                chunk = chunk.replace('!', f", {user_name}!", 1)
+        return chunk
+
+    def _count_send(self, bot_name: str, result: str):
+        self.send_stats[result] += 1
+        SEND_RESULTS.inc(bot_name, result)
+
+    async def _deliver(self, deliver, chunk: str, user_name: str, bot_name: str = "", method: str = "send"):
+        """
+        Entrega `chunk` con `deliver(text, parse_mode)` y devuelve lo que devuelva
+        `deliver` o None si falla. `bot_name` y `method` etiquetan las métricas.
+
+        El modo de formato se elige una sola vez antes de enviar: HTML si el
+        renderizado pasa la validación local y texto plano si no. Solo se
+        reintenta ante errores de red; una petición rechazada por Telegram no se
+        repite con otro formato salvo que rechace el HTML ya validado.
+        """
+        chunk = self.personalize(chunk, user_name)
+        # Convertir el Markdown del asistente a HTML de Telegram en una sola pasada
+        html = render_telegram_html(chunk)
+        problem = validate_telegram_html(html)
+        if problem is None:
+            text, parse_mode = html, ParseMode.HTML
+            self._count_send(bot_name, "html")
+        else:
+            logger.warning("HTML no válido para Telegram (%s); se envía como texto plano", problem)
+            text, parse_mode = chunk, None
+            self._count_send(bot_name, "plain_fallback")
+
+        # Solo los errores de red gastan intentos; el reenvío en texto plano no
+        attempt = 1
+        while True:
+            start = time.perf_counter()
+            try:
+                result = await deliver(text, parse_mode)
+                TELEGRAM_SEND.observe(time.perf_counter() - start, bot_name, method)
+                return result
+            except BadRequest as e:
+                if "not modified" in e.message:
+                    # La edición no cambia nada: no es un fallo
+                    return None
+                if parse_mode is not None and "parse entities" in e.message:
+                    # El validador dejó pasar algo que Telegram no acepta
+                    logger.warning("Telegram rechazó el HTML validado: %s", e)
+                    self._count_send(bot_name, "html_rejected")
+                    text, parse_mode = chunk, None
+                    continue
+                logger.error("Telegram rechazó el mensaje: %s", e)
+                break
+            except NetworkError as e:
+                if attempt >= send_max_attempts:
+                    logger.error("Error de red enviando mensaje a Telegram: %s", e)
+                    break
+                self._count_send(bot_name, "network_retries")
+                logger.warning("Error de red enviando mensaje (intento %s/%s): %s", attempt, send_max_attempts, e)
+                await asyncio.sleep(send_retry_backoff * attempt)
+                attempt += 1
+            except Exception as e:
+                logger.error("Error enviando mensaje a Telegram: %s", e)
+                break
+        self._count_send(bot_name, "failed")
+        return None
+
+    async def send_formatted(self, bot: 'Bot', group_id: int, chunk: str, user_name: str,
+                             mergeable: bool = True, tag=None) -> Optional[int]:
+        """
+        Envía un mensaje nuevo con formato a través del planificador de salida del bot
+        y devuelve su message_id. Con `mergeable` puede fusionarse con otros envíos
+        pendientes del mismo chat; `tag` identifica el run para poder descartarlo.
+        """
+        async def deliver(text, parse_mode):
+            return await bot.outbound.send_message(
+                chat_id=group_id, text=text, parse_mode=parse_mode, mergeable=mergeable, tag=tag
+            )
+        message = await self._deliver(deliver, chunk, user_name, bot.bot_name, "send")
+        return message.message_id if message else None
+
+    async def edit_formatted(self, bot: 'Bot', group_id: int, message_id: int, chunk: str, user_name: str,
+                             priority: int = PRIORITY_NORMAL, tag=None):
+        """Reemplaza el texto de un mensaje ya enviado, con el mismo formato que send_formatted."""
+        async def deliver(text, parse_mode):
+            return await bot.outbound.edit_message_text(
+                chat_id=group_id, message_id=message_id, text=text, parse_mode=parse_mode, priority=priority,
+                tag=tag,
+            )
+        await self._deliver(deliver, chunk, user_name, bot.bot_name, "edit")
+
+    def make_progressive(self, bot: 'Bot', group_id: int, user_name: str, tag=None) -> ProgressiveMessage:
+        """Crea el mensaje que se irá editando mientras llega la respuesta en streaming."""
+        return ProgressiveMessage(
+            # El mensaje que se edita no puede fusionarse con otros envíos
+            send=lambda text: self.send_formatted(bot, group_id, text, user_name, mergeable=False, tag=tag),
+            edit=lambda message_id, text, final: self.edit_formatted(
+                bot, group_id, message_id, text, user_name,
+                priority=PRIORITY_NORMAL if final else PRIORITY_LOW, tag=tag,
+            ),
+            edit_interval=stream_edit_interval_ms / 1000,
+            min_chars=stream_edit_min_chars,
+        )
+
+    async def save_user_info(self, group_id: int, name: str):
+        """Guarda información del usuario para personalizar respuestas."""
+        await self.state.update_user(group_id, name=name)
+        logger.debug("Guardada información del usuario %s para group_id: %s", name, group_id)
+
+    async def extract_user_info(self, group_id: int, message: str) -> str:
+        """Guarda el nombre de la etiqueta de información del usuario y la quita del mensaje."""
+        user_name_match = USER_INFO_RE.search(message)
+        if not user_name_match:
+            return message
+        user_name = user_name_match.group(1)
+        await self.save_user_info(group_id, user_name)
+        message = message[:user_name_match.start()] + message[user_name_match.end():]
+        logger.debug("Mensaje procesado para %s (%s caracteres)", user_name, len(message))
+        return message
+
+    async def get_user_name(self, group_id: int) -> str:
+        """Obtiene el nombre del usuario si está disponible."""
+        return (await self.state.get_user(group_id)).get('name', "")
+
+    def log_qa(self, bot: 'Bot', group_id: int, user_name: str, question: str, answer: str, cached: bool = False):
+        """Registra el par pregunta/respuesta en el log del bot que respondió (no bloquea)."""
+        record = {
+            "telegram_id": group_id,
+            "username": user_name,
+            "question": question,
+            "answer": answer,
+            "timestamp": time.time(),
+        }
+        if cached:
+            record["cached"] = True
+        bot.qa_log.log(record)
+
+    async def _serve_cached(self, bot: 'Bot', group_id: int, question: str, answer: str,
+                            send_to_telegram, progressive=None) -> str:
+        """Muestra una respuesta de la caché como si llegara del asistente y la añade al thread."""
+        start = time.perf_counter()
+        if progressive is not None:
+            await progressive.append(answer)
+        else:
+            for paragraph in answer.split("\n\n"):
+                if paragraph.strip():
+                    await send_to_telegram(paragraph.strip())
+        bot.answer_cache.record_saved(time.perf_counter() - start)
+        # Con la pregunta y la respuesta en el thread, el asistente puede seguir la conversación
+        await bot.assistant_handler.record_exchange(group_id, question, answer)
+        return answer
+
+    @staticmethod
+    def _merge_messages(messages: list[str]) -> str:
+        """Une los mensajes de una ráfaga; la etiqueta con el nombre del usuario se queda solo en el primero."""
+        if len(messages) == 1:
+            return messages[0]
+        return "\n".join([messages[0]] + [USER_INFO_RE.sub("", message, count=1) for message in messages[1:]])
+
+    async def handle_turn(self, group_id: int, message: str, bot_name: Optional[str] = None) -> bool:
+        """
+        Encola un mensaje en la cola del chat y espera a que se procese.
+        `bot_name` es el bot que recibió el mensaje.
+        Devuelve False sin esperar si la cola del chat está llena.
+
+        Si el chat ya tiene un turno que aún no ha empezado, el mensaje se suma a
+        él en lugar de encolar otro: un solo mensaje al thread y un solo run
+        (salvo con la política "queue"). Con la política "cancel" además se
+        cancela la respuesta que esté en curso.
+        """
+        self.sweeper.touch(group_id)
+        policy = self.supersede_policy(group_id)
+        if policy == "cancel":
+            self.supersede(group_id)
+        joined = self.coalescer.join(group_id, message) if policy != "queue" else None
+        if joined is not None:
+            MESSAGES_COALESCED.inc(bot_name or "")
+            logger.debug("Mensaje sumado al turno pendiente del chat")
+            # shield: si se cancela este handler, el turno sigue para el resto de la ráfaga
+            return await asyncio.shield(joined)
+
+        burst = self.coalescer.open(group_id, message)
+        accepted = False
+        try:
+            await self.coalescer.settle(burst)
+            submitted, trace = time.perf_counter(), current_trace()
+
+            def run():
+                # Se cierra al empezar el turno: lo que llegue después irá en el siguiente
+                return self._run_turn(group_id, self._merge_messages(self.coalescer.take(burst)), bot_name)
+
+            future = self.scheduler.submit(
+                group_id, lambda: self._leased(group_id, run, bot_name, submitted, trace), label=bot_name or "",
+            )
+            if future is None:
+                return False
+            accepted = True
+            await future
+            return True
+        finally:
+            self.coalescer.finish(burst, accepted)
+
+    async def _leased(self, group_id: int, run: Callable[[], Awaitable], bot_name: Optional[str] = None,
+                      submitted: Optional[float] = None, trace=None) -> None:
+        """
+        Ejecuta el turno solo con el lease del chat, para que no lo procese otro nodo a la vez.
+        `trace` es la traza del handler que encoló el turno: la cola del chat corre en otra tarea.
+        """
+        started = None
+
+        async def body():
+            nonlocal started
+            started = time.perf_counter()
+            if submitted is not None:
+                QUEUE_WAIT.observe(started - submitted, bot_name or "")
+            await run()
+
+        with use_trace(trace or current_trace()):
+            # Si el lease se pierde a mitad, `run` se cancela: el chat ya lo atiende otro nodo
+            if await self.leases.run(group_id, body):
+                logger.debug("Turno terminado en %.0f ms", (time.perf_counter() - started) * 1000)
+            elif started is None:
+                logger.warning("El chat %s sigue ocupado por otro nodo; se descarta el turno", group_id)
+
+    async def _run_turn(self, group_id: int, message: str, receiver: Optional[str] = None) -> None:
+        """Procesa un mensaje para el grupo correspondiente."""
+        logger.debug("Procesando mensaje para group_id: %s", group_id)
+
+        # Extraer información del usuario si está en el formato esperado
+        message = await self.extract_user_info(group_id, message)
+
+        next_bot_name = self.get_next_bot(group_id, receiver)
+        if not next_bot_name:
+            logger.error("No hay bots disponibles para responder.")
+            return
+
+        next_bot = self.all_bots[next_bot_name]
+        user_name = await self.get_user_name(group_id)
+
+        # Se activa si un mensaje nuevo deja obsoleta esta respuesta; etiqueta también sus envíos
+        cancel = asyncio.Event()
+
+        async def send_to_telegram(chunk):
+            """Envía la respuesta del bot al usuario/grupo correcto con formato HTML."""
+            await self.send_formatted(next_bot, group_id, chunk, user_name, tag=cancel)
+
+        progressive = None
+        if stream_mode == "edit":
+            progressive = self.make_progressive(next_bot, group_id, user_name, tag=cancel)
+            progressive.begin()
+
+        # Estado final del run; la caché cuenta como "completed"
+        status = None
+        cache = next_bot.answer_cache
+        self.dispatcher.begin(next_bot_name)
+        try:
+            hit = cache.lookup(message) if cache is not None else None
+            if hit is not None:
+                logger.debug("Respuesta servida desde la caché (confianza %.2f)", hit[1])
+                answer = await self._serve_cached(next_bot, group_id, message, hit[0], send_to_telegram, progressive)
+                status = "completed"
+                self.log_qa(next_bot, group_id, user_name, message, answer, cached=True)
+            else:
+                started = time.perf_counter()
+                self._running[group_id] = (cancel, next_bot)
+                status, answer = await next_bot.assistant_handler.stream_response(
+                    group_id, message, send_to_telegram, progressive=progressive, cancel=cancel
+                )
+                if cancel.is_set():
+                    # Respuesta a medias: ni al log de Q&A ni a la caché
+                    if progressive is not None and not progressive.closed:
+                        await progressive.append(("\n\n" if answer else "") + SUPERSEDED_NOTE)
+                    else:
+                        await send_to_telegram(SUPERSEDED_NOTE)
+                elif status == "completed" and answer:
+                    self.log_qa(next_bot, group_id, user_name, message, answer)
+                    if cache is not None:
+                        cache.observe_run(time.perf_counter() - started)
+                        # Solo si no nombra al usuario: la caché es común a todos los chats
+                        cache.add(message, answer, user_name=user_name)
+        except Exception as e:
+            logger.error("Error durante el procesamiento del mensaje: %s", e)
+        finally:
+            if self._running.get(group_id, (None,))[0] is cancel:
+                del self._running[group_id]
+            # Los runs que acaban en failed/expired/incomplete (o sin llegar a lanzarse) son fallos
+            # del bot; los cancelados por un mensaje nuevo no
+            self.dispatcher.end(next_bot_name, ok=status in HEALTHY_RUN_STATUSES)
+            if progressive is not None:
+                await progressive.finish()
+    
+    async def handle_image(self, group_id: int, message: str, image: PreparedImage,
+                           bot_name: Optional[str] = None) -> bool:
+        """
+        Encola una imagen en la cola del chat y espera a que se procese.
+        Devuelve False sin esperar si la cola del chat está llena.
+        """
+        self.sweeper.touch(group_id)
+        # Los mensajes que lleguen después de la foto no deben contestarse antes que ella
+        self.coalescer.seal(group_id)
+        submitted, trace = time.perf_counter(), current_trace()
+        future = self.scheduler.submit(
+            group_id,
+            lambda: self._leased(group_id, lambda: self._run_image(group_id, message, image, bot_name), bot_name,
+                                 submitted, trace),
+            label=bot_name or "",
+        )
+        if future is None:
+            return False
+        await future
+        return True
+
+    async def _run_image(self, group_id: int, message: str, image: PreparedImage,
+                         receiver: Optional[str] = None) -> None:
+        """Procesa un mensaje que contiene una imagen."""
+        logger.debug("Procesando imagen para group_id: %s", group_id)
+        
+        # Extraer información del usuario
+        message = await self.extract_user_info(group_id, message)
+            
+        next_bot_name = self.get_next_bot(group_id, receiver)
+        if not next_bot_name:
+            logger.error("No hay bots disponibles para responder.")
+            return
+            
+        next_bot = self.all_bots[next_bot_name]
+        user_name = await self.get_user_name(group_id)
+        
+        # Mismo callback de envío que en handle_turn
+        async def send_to_telegram(chunk):
+            await self.send_formatted(next_bot, group_id, chunk, user_name)
+        
+        progressive = None
+        if stream_mode == "edit":
+            progressive = self.make_progressive(next_bot, group_id, user_name)
+
+        answer = None
+        self.dispatcher.begin(next_bot_name)
+        try:
+            # Llamar al método específico para imágenes en AssistantHandler
+            answer = await next_bot.assistant_handler.stream_image_response(
+                group_id, message, image, send_to_telegram, progressive=progressive
+            )
+            if answer:
+                self.log_qa(next_bot, group_id, user_name, message, answer)
+        except Exception as e:
+            logger.error("Error durante el procesamiento de la imagen: %s", e)
+            # Intentar enviar un mensaje de error
+            try:
+                await next_bot.outbound.send_message(
+                    chat_id=group_id,
+                    priority=PRIORITY_HIGH,
+                    text=f"⚠️ Lo siento, hubo un problema al procesar la imagen. Error: {str(e)}",
+                    parse_mode=ParseMode.HTML
+                )
+            except:
+                pass  # Si esto también falla, lo dejamos pasar
+        finally:
+            self.dispatcher.end(next_bot_name, ok=answer is not None)
+            if progressive is not None:
+                await progressive.finish()
+            
+    async def end_conversation(self, group_id: int) -> bool:
+        """Finaliza una conversación activa."""
+        self.dispatcher.forget(group_id)
+        self.history.forget(group_id)
+        if await self.state.delete_thread(group_id):
+            # No eliminamos los datos del usuario para mantener la personalización
+            return True
         return False
\ No newline at end of file
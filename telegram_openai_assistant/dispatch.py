@@ -0,0 +1,142 @@
+# dispatch.py
+# Elección del bot que responde a cada turno: estrategias, salud y afinidad por chat
+import itertools
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+STRATEGIES = ("receiver", "round_robin", "least_in_flight")
+
+
+class BotHealth:
+    """Carga y salud de un bot: turnos en curso y fallos consecutivos."""
+    __slots__ = ("in_flight", "failures", "unhealthy_until", "turns", "errors")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.turns = 0
+        self.errors = 0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+
+class Dispatcher:
+    """
+    Decide qué bot atiende cada turno.
+
+    Estrategias:
+      - "receiver": responde el bot que recibió la actualización.
+      - "round_robin": turnos repartidos por orden entre los bots del chat.
+      - "least_in_flight": el bot del chat con menos turnos en curso.
+
+    Solo son candidatos los bots que han recibido algo de ese chat (un bot no
+    puede escribir en un chat en el que no está). Con "receiver" responde
+    siempre el bot que recibió el mensaje mientras esté sano (en un chat privado
+    el id es el mismo para todos los bots, así que cada uno contesta en el suyo);
+    la afinidad solo guarda el bot que lo sustituye mientras no lo está. Con las
+    otras estrategias cada chat se queda pegado al bot que se le asignó, para que
+    el mismo asistente siga la conversación, y solo cambia de bot si ese bot deja
+    de estar sano: tras `failure_threshold` fallos seguidos se le retira durante
+    `cooldown` segundos y sus chats pasan a otro candidato.
+    """
+
+    def __init__(self, strategy: str = "receiver", failure_threshold: int = 3, cooldown: float = 60.0):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Estrategia de reparto desconocida: {strategy!r} (opciones: {', '.join(STRATEGIES)})")
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health: Dict[str, BotHealth] = {}
+        self._order: List[str] = []
+        self._round_robin = itertools.count()
+        self._members: Dict[int, Set[str]] = defaultdict(set)
+        self._sticky: Dict[int, str] = {}
+
+    def register(self, names: Iterable[str]):
+        """Da de alta los bots disponibles, en orden."""
+        self._order = list(names)
+        for name in self._order:
+            self.health.setdefault(name, BotHealth())
+
+    def pick(self, group_id: int, receiver: Optional[str] = None) -> Optional[str]:
+        """Devuelve el bot que debe responder en `group_id` a un mensaje recibido por `receiver`."""
+        if receiver is not None:
+            self._members[group_id].add(receiver)
+        candidates = [name for name in self._order if name in self._members[group_id]] or list(self._order)
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [name for name in candidates if self.health[name].healthy(now)]
+        if self.strategy == "receiver" and receiver in healthy:
+            return receiver
+
+        sticky = self._sticky.get(group_id)
+        if sticky in healthy:
+            return sticky
+        if sticky is not None:
+            logger.warning("El bot %s no está disponible; el chat %s pasa a otro bot", sticky, group_id)
+
+        # Si ningún candidato está sano, se intenta igualmente con todos
+        pool = healthy or candidates
+        if self.strategy == "receiver" and receiver in pool:
+            choice = receiver
+        elif self.strategy == "least_in_flight":
+            choice = min(pool, key=lambda name: (self.health[name].in_flight, self._order.index(name)))
+        elif self.strategy == "round_robin":
+            choice = pool[next(self._round_robin) % len(pool)]
+        else:
+            choice = pool[0]
+        self._sticky[group_id] = choice
+        return choice
+
+    def forget(self, group_id: int):
+        """Olvida la afinidad del chat (p. ej. al terminar la conversación)."""
+        self._sticky.pop(group_id, None)
+
+    def evict(self, group_id: int):
+        """
+        Olvida todo lo que se sabe del chat (afinidad y bots que lo reciben) para
+        liberar memoria; con el próximo mensaje vuelve a aprenderse.
+        """
+        self._sticky.pop(group_id, None)
+        self._members.pop(group_id, None)
+
+    def begin(self, name: str):
+        """Marca el inicio de un turno en el bot."""
+        health = self.health[name]
+        health.in_flight += 1
+        health.turns += 1
+
+    def end(self, name: str, ok: bool):
+        """Marca el final de un turno; los fallos seguidos dejan al bot fuera un rato."""
+        health = self.health[name]
+        health.in_flight -= 1
+        if ok:
+            health.failures = 0
+            return
+        health.errors += 1
+        health.failures += 1
+        if health.failures >= self.failure_threshold:
+            health.unhealthy_until = time.monotonic() + self.cooldown
+            health.failures = 0
+            logger.warning("El bot %s acumula fallos; fuera del reparto durante %.0fs", name, self.cooldown)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Estado de carga y salud de cada bot."""
+        now = time.monotonic()
+        return {
+            name: {
+                "in_flight": health.in_flight,
+                "turns": health.turns,
+                "errors": health.errors,
+                "healthy": health.healthy(now),
+            }
+            for name, health in self.health.items()
+        }
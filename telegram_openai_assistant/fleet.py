@@ -0,0 +1,252 @@
+# fleet.py
+# Flota de bots declarada en configuración y repartida entre varios procesos
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .config import (
+    telegram_token_bots, assistant_id_bots, bot_names, fleet_config_path, fleet_workers,
+    bot_mode, webhook_url, webhook_secret, http_host, http_port, telegram_global_rate,
+    log_level, log_format, log_sample_rate, log_queue_size,
+)
+from .log import configure_logging, get_logger
+from .webhook import WebhookServer, webhook_path
+
+logger = get_logger(__name__)
+
+DEFAULT_BOT_NAMES = ["Regen", "Degen"]
+MAX_RESTART_BACKOFF = 60.0
+
+
+class BotSpec(NamedTuple):
+    name: str
+    token: str
+    assistant_id: str
+
+
+def load_bot_specs(path: Optional[str] = fleet_config_path) -> Tuple[List[BotSpec], int]:
+    """
+    Devuelve (bots declarados, número de procesos).
+
+    Con `FLEET_CONFIG` los bots se leen de un JSON:
+
+        {"workers": 2,
+         "bots": [{"name": "Regen", "token_env": "REGEN_TOKEN", "assistant_id": "asst_..."},
+                  {"name": "Degen", "token": "123:ABC", "assistant_id": "asst_..."}]}
+
+    (`token_env` toma el token de esa variable de entorno para no guardarlo en
+    el archivo). Sin él, se emparejan TELEGRAM_TOKEN_BOT y ASSISTANT_ID_BOT con
+    los nombres de BOT_NAMES.
+    """
+    if path:
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        specs = [
+            BotSpec(entry["name"], entry.get("token") or os.environ[entry["token_env"]], entry["assistant_id"])
+            for entry in data["bots"]
+        ]
+        return specs, int(data.get("workers", fleet_workers))
+
+    if len(telegram_token_bots) != len(assistant_id_bots):
+        logger.warning("Hay %s tokens y %s assistant ids; solo se usan los que tienen pareja",
+                       len(telegram_token_bots), len(assistant_id_bots))
+    names = bot_names or DEFAULT_BOT_NAMES
+    specs = [
+        BotSpec(names[i] if i < len(names) else f"Bot{i + 1}", token, assistant_id)
+        for i, (token, assistant_id) in enumerate(zip(telegram_token_bots, assistant_id_bots))
+    ]
+    return specs, fleet_workers
+
+
+def chat_id_of(update: Dict) -> int:
+    """Chat de una actualización en JSON (mensaje, callback, cambio de miembros...)."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from")
+        if user:
+            return user["id"]
+    return 0
+
+
+def shard_for(chat_id: int, workers: int) -> int:
+    """Proceso que atiende el chat: siempre el mismo, para que su estado no se reparta."""
+    return chat_id % workers
+
+
+def worker_main(worker_id: int, specs: List[BotSpec], updates=None, global_rate: float = telegram_global_rate):
+    """
+    Punto de entrada de un proceso de la flota. Con `updates` (modo webhook) las
+    actualizaciones llegan por esa cola desde el supervisor; sin ella, cada bot
+    del proceso hace polling. `global_rate` es la parte del límite global de
+    envíos de cada bot que le toca a este proceso.
+    """
+    # Import diferido: el supervisor no necesita cargar los bots
+    from .bot import start_bots
+    from .conversation_manager import ConversationManager
+
+    # Proceso nuevo (spawn): hay que volver a configurar los logs
+    configure_logging(log_level, log_format, sample_rate=log_sample_rate, queue_size=log_queue_size)
+    logger.info("Proceso %s con bots %s", worker_id, ', '.join(spec.name for spec in specs))
+    manager = ConversationManager(worker_id=worker_id)
+    asyncio.run(start_bots(
+        manager, specs, serve_http=False, receive="external" if updates is not None else "polling", updates=updates,
+        global_rate=global_rate,
+    ))
+
+
+class Supervisor:
+    """
+    Lanza y vigila los procesos de la flota.
+
+    En modo polling cada bot vive en un único proceso (Telegram no admite dos
+    getUpdates a la vez para el mismo token) y los bots se reparten entre los
+    procesos. En modo webhook todos los procesos tienen todos los bots y el
+    supervisor recibe las actualizaciones en el servidor HTTP y las reparte por
+    chat_id, de modo que cada chat lo atiende siempre el mismo proceso. Como
+    entonces cada bot envía desde todos los procesos, cada uno recibe
+    `TELEGRAM_GLOBAL_RATE / procesos` de su límite global (los límites por chat
+    y por grupo no cambian: cada chat vive en un solo proceso).
+
+    Si un proceso muere se vuelve a lanzar con una espera creciente (hasta
+    `MAX_RESTART_BACKOFF` segundos) para no entrar en un bucle de reinicios.
+    """
+
+    def __init__(self, specs: List[BotSpec], workers: int, mode: str = bot_mode):
+        self.mode = mode
+        self._ctx = multiprocessing.get_context("spawn")
+        if mode == "webhook":
+            self.assignments = [list(specs) for _ in range(workers)]
+            self.queues = [self._ctx.Queue() for _ in range(workers)]
+        else:
+            workers = min(workers, len(specs))
+            self.assignments = [specs[i::workers] for i in range(workers)]
+            self.queues = [None] * workers
+        self.specs = specs
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.restarts = [0] * workers
+        self._started_at = [0.0] * workers
+        self._restart_at: List[Optional[float]] = [None] * workers
+
+    @property
+    def workers(self) -> int:
+        return len(self.assignments)
+
+    def _spawn(self, index: int):
+        global_rate = telegram_global_rate / self.workers if self.mode == "webhook" else telegram_global_rate
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self.assignments[index], self.queues[index], global_rate),
+            name=f"fleet-worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self._restart_at[index] = None
+
+    def alive(self) -> bool:
+        return all(process is not None and process.is_alive() for process in self.processes)
+
+    def routes(self) -> Dict:
+        """Rutas del servidor HTTP: cada actualización va a la cola del proceso de su chat."""
+        def deliver_to_shard(name: str):
+            async def deliver(data: Dict):
+                self.queues[shard_for(chat_id_of(data), self.workers)].put((name, data))
+            return deliver
+        return {webhook_path(spec.token): deliver_to_shard(spec.name) for spec in self.specs}
+
+    async def _set_webhooks(self):
+        from telegram import Bot as TelegramBot, Update
+
+        for spec in self.specs:
+            async with TelegramBot(spec.token) as telegram_bot:
+                await telegram_bot.set_webhook(
+                    url=webhook_url.rstrip("/") + webhook_path(spec.token),
+                    secret_token=webhook_secret,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+
+    def _check(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            if self._restart_at[index] is None:
+                # Un proceso que aguantó un rato vuelve a empezar con la espera mínima
+                if now - self._started_at[index] > MAX_RESTART_BACKOFF:
+                    self.restarts[index] = 0
+                backoff = min(MAX_RESTART_BACKOFF, 2 ** self.restarts[index])
+                logger.warning("El proceso %s terminó con código %s; se relanza en %.0fs",
+                               index, process.exitcode, backoff)
+                self._restart_at[index] = now + backoff
+            elif now >= self._restart_at[index]:
+                self.restarts[index] += 1
+                self._spawn(index)
+
+    async def run(self):
+        """Lanza los procesos y los vigila hasta que se interrumpe el supervisor."""
+        for index in range(self.workers):
+            self._spawn(index)
+        server = WebhookServer(
+            self.routes() if self.mode == "webhook" else {}, self.alive,
+            host=http_host, port=http_port, secret_token=webhook_secret,
+        )
+        try:
+            await server.start()
+        except RuntimeError as e:
+            if self.mode == "webhook":
+                raise
+            logger.warning("Sin servidor de health checks: %s", e)
+        if self.mode == "webhook":
+            await self._set_webhooks()
+        logger.info("Flota en marcha: %s bots en %s procesos (modo %s)", len(self.specs), self.workers, self.mode)
+        try:
+            while True:
+                self._check()
+                await asyncio.sleep(1)
+        finally:
+            await server.stop()
+            await self.stop()
+
+    async def stop(self):
+        """Pide a los procesos que terminen y fuerza a los que no lo hagan."""
+        for updates in self.queues:
+            if updates is not None:
+                updates.put(None)
+        for process in self.processes:
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, 15)
+            if process.is_alive():
+                process.terminate()
+
+
+async def consume_updates(updates, bots: Dict):
+    """En un proceso de la flota, pasa a cada bot las actualizaciones que le envía el supervisor."""
+    while True:
+        try:
+            item = await asyncio.to_thread(updates.get, True, 1.0)
+        except queue.Empty:
+            continue
+        if item is None:
+            return
+        name, data = item
+        bot = bots.get(name)
+        if bot is not None:
+            await bot.deliver_update(data)
+
+
+def run_fleet(specs: List[BotSpec], workers: int):
+    """Arranca la flota multiproceso y bloquea hasta Ctrl+C."""
+    supervisor = Supervisor(specs, workers)
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        logger.info("Flota detenida.")
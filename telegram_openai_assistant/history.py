@@ -0,0 +1,96 @@
+# history.py
+# Historial reciente de cada chat en memoria, acotado por chat y en bytes en total
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Tuple
+
+
+class _Record:
+    __slots__ = ("role", "content", "at")
+
+    def __init__(self, role: str, content: str, at: float):
+        self.role = role
+        self.content = content
+        self.at = at
+
+
+# Lo que ocupa un registro vacío en la ranura de un deque (objeto con slots + puntero)
+_RECORD_OVERHEAD = sys.getsizeof(_Record("user", "", 0.0)) + 8
+
+
+def _record_size(record: _Record) -> int:
+    return _RECORD_OVERHEAD + sys.getsizeof(record.content)
+
+
+class ChatHistory:
+    """
+    Últimos mensajes de cada chat (pregunta del usuario y respuesta del asistente).
+
+    Cada chat tiene un búfer circular de `per_chat` registros: al llegar uno
+    nuevo sale el más antiguo. Los textos de más de `max_chars` caracteres se
+    recortan. Si entre todos los chats se pasa de `max_bytes`, se vacían los
+    chats que llevan más tiempo sin actividad hasta volver al presupuesto, así
+    que la memoria no crece con el número de chats atendidos desde el arranque.
+    `bytes` es una estimación de la memoria que ocupan los registros.
+    """
+
+    def __init__(self, per_chat: int = 20, max_bytes: int = 32 * 1024 * 1024, max_chars: int = 4000):
+        self.per_chat = per_chat
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        # Del chat con actividad más antigua al más reciente
+        self._chats: "OrderedDict[int, Deque[_Record]]" = OrderedDict()
+        self.records = 0
+        self.bytes = 0
+        self.stats = {"added": 0, "truncated": 0, "rotated": 0, "evicted_chats": 0}
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, group_id: int) -> bool:
+        return group_id in self._chats
+
+    def add(self, group_id: int, role: str, content: str):
+        """Guarda un mensaje del chat; con `per_chat` ya guardados, sale el más antiguo."""
+        if not content or self.per_chat <= 0:
+            return
+        if len(content) > self.max_chars:
+            content = content[:self.max_chars]
+            self.stats["truncated"] += 1
+        buffer = self._chats.get(group_id)
+        if buffer is None:
+            buffer = self._chats[group_id] = deque(maxlen=self.per_chat)
+        else:
+            self._chats.move_to_end(group_id)
+        if len(buffer) == buffer.maxlen:
+            self.bytes -= _record_size(buffer[0])
+            self.records -= 1
+            self.stats["rotated"] += 1
+        record = _Record(role, content, time.time())
+        buffer.append(record)
+        self.bytes += _record_size(record)
+        self.records += 1
+        self.stats["added"] += 1
+        # El chat que acaba de escribir es el último en salir
+        while self.bytes > self.max_bytes and len(self._chats) > 1:
+            self.forget(next(iter(self._chats)))
+            self.stats["evicted_chats"] += 1
+
+    def get(self, group_id: int) -> List[Tuple[str, str]]:
+        """Mensajes guardados del chat como (rol, texto), del más antiguo al más reciente."""
+        return [(record.role, record.content) for record in self._chats.get(group_id, ())]
+
+    def last_activity(self, group_id: int) -> float:
+        """Hora (time.time) del último mensaje guardado del chat, 0 si no hay ninguno."""
+        buffer = self._chats.get(group_id)
+        return buffer[-1].at if buffer else 0.0
+
+    def forget(self, group_id: int) -> bool:
+        """Borra el historial de un chat."""
+        buffer = self._chats.pop(group_id, None)
+        if buffer is None:
+            return False
+        self.bytes -= sum(_record_size(record) for record in buffer)
+        self.records -= len(buffer)
+        return True
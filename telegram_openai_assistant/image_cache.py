@@ -0,0 +1,168 @@
+# image_cache.py
+# Caché de subidas de imágenes: hash del contenido -> file_id ya subido a OpenAI
+import asyncio
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+Entry = Tuple[str, Optional[int], float]  # (file_id, dhash, created_at)
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ImageUploadCache:
+    """
+    Recuerda qué imágenes se han subido ya a OpenAI para no volver a subirlas.
+
+    La clave es el sha256 de la foto recibida; opcionalmente, con
+    `dhash_distance > 0`, también se reutiliza la subida de una foto casi igual
+    (hash perceptual a esa distancia de Hamming o menos), p. ej. la misma
+    ecografía reenviada o recomprimida. Los bots comparten el cliente de OpenAI,
+    así que la caché es común a todos.
+
+    El índice está en memoria (LRU de como mucho `max_entries`) y persiste en
+    SQLite. Las entradas caducan a los `ttl` segundos de subirse; las que salen
+    por LRU o caducidad pasan a una lista de borrados pendientes que una tarea
+    en segundo plano elimina de OpenAI con `delete_file(file_id)`.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 5000, ttl: float = 30 * 86400,
+                 dhash_distance: int = 0, cleanup_interval: float = 3600.0):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dhash_distance = dhash_distance
+        self.cleanup_interval = cleanup_interval
+        self._index: "OrderedDict[str, Entry]" = OrderedDict()
+        self._delete_file: Optional[Callable[[str], Awaitable]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evicted": 0, "deleted_remote": 0}
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_files ("
+            " sha256 TEXT PRIMARY KEY,"
+            " dhash INTEGER,"
+            " file_id TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS pending_deletes (file_id TEXT PRIMARY KEY)")
+        for sha256, dhash, file_id, created_at in self._db.execute(
+            "SELECT sha256, dhash, file_id, created_at FROM image_files ORDER BY last_used"
+        ):
+            # SQLite guarda enteros con signo: el dHash se almacena desplazado a ese rango
+            self._index[sha256] = (file_id, None if dhash is None else dhash + 2 ** 63, created_at)
+        self._evict_overflow()
+
+    @property
+    def hit_rate(self) -> float:
+        """Fracción de imágenes que no hubo que subir."""
+        hits = self.stats["hits"] + self.stats["near_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def lookup(self, sha256: str, dhash: Optional[int] = None) -> Optional[str]:
+        """Devuelve el file_id de esta imagen (o de una casi igual) si sigue vigente."""
+        now = time.time()
+        entry = self._index.get(sha256)
+        if entry is not None and now - entry[2] < self.ttl:
+            self.stats["hits"] += 1
+            self._touch(sha256, now)
+            return entry[0]
+        if dhash is not None and self.dhash_distance > 0:
+            for key, (file_id, other, created_at) in reversed(self._index.items()):
+                if other is not None and now - created_at < self.ttl and _hamming(dhash, other) <= self.dhash_distance:
+                    self.stats["near_hits"] += 1
+                    self._touch(key, now)
+                    return file_id
+        self.stats["misses"] += 1
+        return None
+
+    def add(self, sha256: str, dhash: Optional[int], file_id: str):
+        """Registra una imagen recién subida."""
+        now = time.time()
+        self._index[sha256] = (file_id, dhash, now)
+        self._index.move_to_end(sha256)
+        self._db.execute(
+            "INSERT OR REPLACE INTO image_files (sha256, dhash, file_id, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (sha256, None if dhash is None else dhash - 2 ** 63, file_id, now, now),
+        )
+        self._evict_overflow()
+
+    def discard(self, file_id: str):
+        """Olvida un file_id que OpenAI ya no reconoce (sin intentar borrarlo)."""
+        for key in [key for key, entry in self._index.items() if entry[0] == file_id]:
+            del self._index[key]
+        self._db.execute("DELETE FROM image_files WHERE file_id = ?", (file_id,))
+
+    def _touch(self, sha256: str, now: float):
+        self._index.move_to_end(sha256)
+        self._db.execute("UPDATE image_files SET last_used = ? WHERE sha256 = ?", (now, sha256))
+
+    def _evict(self, sha256: str):
+        file_id = self._index.pop(sha256)[0]
+        self._db.execute("DELETE FROM image_files WHERE sha256 = ?", (sha256,))
+        # Otra foto puede compartir el file_id (p. ej. por un acierto exacto tras reenvío)
+        if not any(entry[0] == file_id for entry in self._index.values()):
+            self._db.execute("INSERT OR IGNORE INTO pending_deletes (file_id) VALUES (?)", (file_id,))
+        self.stats["evicted"] += 1
+
+    def _evict_overflow(self):
+        while len(self._index) > self.max_entries:
+            self._evict(next(iter(self._index)))
+
+    def expire(self):
+        """Retira del índice las entradas caducadas."""
+        oldest = time.time() - self.ttl
+        for sha256 in [key for key, entry in self._index.items() if entry[2] < oldest]:
+            self._evict(sha256)
+
+    async def delete_pending(self):
+        """Borra de OpenAI los archivos que ya no están en la caché."""
+        if self._delete_file is None:
+            return
+        file_ids = [row[0] for row in self._db.execute("SELECT file_id FROM pending_deletes")]
+        for file_id in file_ids:
+            try:
+                await self._delete_file(file_id)
+            except Exception as e:
+                # Un 404 significa que ya no existe; cualquier otro error se reintenta en la siguiente ronda
+                if getattr(e, "status_code", None) != 404:
+                    logger.warning("No se pudo borrar el archivo %s de OpenAI: %s", file_id, e)
+                    continue
+            self._db.execute("DELETE FROM pending_deletes WHERE file_id = ?", (file_id,))
+            self.stats["deleted_remote"] += 1
+
+    async def start(self, delete_file: Optional[Callable[[str], Awaitable]] = None):
+        """Arranca la limpieza periódica; sin `delete_file` solo se caducan entradas locales."""
+        self._delete_file = delete_file
+        self._task = asyncio.create_task(self._cleaner())
+
+    async def _cleaner(self):
+        while True:
+            self.expire()
+            await self.delete_pending()
+            await asyncio.sleep(self.cleanup_interval)
+
+    async def close(self):
+        """Detiene la limpieza periódica y cierra la base de datos."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._db.close()
@@ -0,0 +1,112 @@
+# image_processing.py
+# Reducción y recompresión de fotos en memoria antes de subirlas a OpenAI
+import asyncio
+import functools
+import hashlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+# Con detail="high" OpenAI encaja la imagen en 2048x2048 y luego deja el lado
+# corto en 768 px: cualquier resolución por encima se sube para nada
+DEFAULT_MAX_SIDE = 2048
+DEFAULT_SHORT_SIDE = 768
+DEFAULT_JPEG_QUALITY = 85
+
+
+class PreparedImage(NamedTuple):
+    """Foto lista para subir con las huellas que usa la caché de subidas."""
+    data: bytes
+    sha256: str              # hash de los bytes recibidos de Telegram
+    dhash: Optional[int]     # hash perceptual de 64 bits (None si está desactivado)
+
+
+def dhash(image: "Image.Image") -> int:
+    """
+    Hash perceptual de diferencias (dHash) de 64 bits: compara cada píxel con su
+    vecino en una miniatura en gris de 9x8. Dos fotos casi iguales (recomprimidas,
+    redimensionadas) difieren en pocos bits.
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def prepare_image(data: bytes, max_side: int = DEFAULT_MAX_SIDE, short_side: int = DEFAULT_SHORT_SIDE,
+                  quality: int = DEFAULT_JPEG_QUALITY, with_dhash: bool = False) -> PreparedImage:
+    """
+    Reduce una imagen a la resolución que el modelo llega a usar y la recodifica
+    como JPEG. Conserva los bytes originales si ya era pequeña y recodificarla no
+    ahorra nada.
+
+    Es una función de módulo (y no un método) para poder ejecutarla en un
+    `ProcessPoolExecutor`.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    with Image.open(io.BytesIO(data)) as image:
+        # Aplica la orientación EXIF antes de medir: las fotos de móvil suelen venir giradas
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        scale = min(1.0, max_side / max(width, height))
+        if min(width, height) * scale > short_side:
+            scale = short_side / min(width, height)
+        if scale < 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        perceptual = dhash(image) if with_dhash else None
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    if scale >= 1.0 and output.tell() >= len(data):
+        return PreparedImage(data, digest, perceptual)
+    return PreparedImage(output.getvalue(), digest, perceptual)
+
+
+class ImageProcessor:
+    """
+    Prepara las fotos recibidas en un pool de procesos.
+
+    Redimensionar y recomprimir es trabajo de CPU que bloquearía el event loop
+    compartido por todos los bots, así que se hace en procesos aparte. El pool
+    se crea con la primera imagen y se cierra con `close`.
+    """
+
+    def __init__(self, max_workers: int = 2, max_side: int = DEFAULT_MAX_SIDE,
+                 short_side: int = DEFAULT_SHORT_SIDE, quality: int = DEFAULT_JPEG_QUALITY,
+                 with_dhash: bool = False):
+        self.max_workers = max_workers
+        self._prepare = functools.partial(
+            prepare_image, max_side=max_side, short_side=short_side, quality=quality, with_dhash=with_dhash
+        )
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+
+    async def process(self, data: bytes) -> PreparedImage:
+        """Devuelve la imagen lista para subir; si no se puede procesar, la original."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._pool, self._prepare, data)
+        except Exception as e:
+            logger.warning("No se pudo reducir la imagen, se sube la original: %s", e)
+            result = PreparedImage(data, hashlib.sha256(data).hexdigest(), None)
+        self.stats["images"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(result.data)
+        return result
+
+    async def close(self):
+        """Cierra el pool de procesos sin bloquear el event loop."""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown)
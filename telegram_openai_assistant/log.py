@@ -0,0 +1,241 @@
+# log.py
+# Logging estructurado (una línea JSON por registro) sin bloquear el event loop,
+# con un trace id por actualización que acompaña al turno hasta el envío
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+# (trace id, campos del turno como bot y chat_id, si el turno entra en la muestra);
+# se copia a las tareas que se crean dentro
+Trace = Tuple[Optional[str], Dict, bool]
+_trace: contextvars.ContextVar[Trace] = contextvars.ContextVar("trace", default=(None, {}, True))
+_sample_rate = 1.0
+
+# Atributos de cualquier LogRecord: el resto son campos añadidos con `extra=`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "trace_id"}
+
+# Librerías que registran cada petición HTTP en INFO
+NOISY_LOGGERS = ("httpx", "httpcore", "telegram.ext", "apscheduler")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Argumentos que no pueden cambiar después de la llamada: el mensaje se formatea en el listener
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None))
+
+
+def new_trace(**fields) -> str:
+    """
+    Abre una traza para la actualización en curso y la devuelve. Con muestreo,
+    se decide aquí si los registros por debajo de WARNING de este turno se
+    guardan: o el turno entero o nada de él.
+    """
+    trace_id = uuid.uuid4().hex[:16]
+    sampled = _sample_rate >= 1.0 or int(trace_id[:8], 16) < _sample_rate * 0x100000000
+    _trace.set((trace_id, fields, sampled))
+    return trace_id
+
+
+def current_trace() -> Trace:
+    """Traza activa, para reanudarla en otra tarea con `use_trace`."""
+    return _trace.get()
+
+
+@contextmanager
+def use_trace(trace: Trace) -> Iterator[None]:
+    """Reanuda una traza capturada con `current_trace` (p. ej. en la tarea de la cola del chat)."""
+    token = _trace.set(trace)
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+
+
+class _TraceRecord(logging.LogRecord):
+    """
+    `LogRecord` de los loggers del paquete: los mismos atributos, pero sin
+    averiguar fichero, módulo, hilo ni proceso, que no salen en los registros.
+    """
+
+    def __init__(self, name, level, pathname, lineno, msg, args, exc_info, func=None, sinfo=None):
+        created = time.time()
+        self.name = name
+        self.msg = msg
+        if args and len(args) == 1 and isinstance(args[0], Mapping) and args[0]:
+            args = args[0]
+        self.args = args
+        self.levelname = logging.getLevelName(level)
+        self.levelno = level
+        self.pathname = self.filename = self.module = pathname
+        self.exc_info = exc_info
+        self.exc_text = None
+        self.stack_info = sinfo
+        self.lineno = lineno
+        self.funcName = func
+        self.created = created
+        self.msecs = int((created - int(created)) * 1000) + 0.0
+        self.relativeCreated = (created - logging._startTime) * 1000
+        self.thread = self.threadName = self.processName = self.process = None
+
+
+class TraceLogger(logging.Logger):
+    """
+    Logger que descarta los registros por debajo de WARNING de los turnos que
+    no entran en la muestra antes de crear el `LogRecord`, que es lo caro.
+    Los avisos y errores se guardan siempre.
+    """
+
+    def isEnabledFor(self, level: int) -> bool:
+        if level < logging.WARNING and not _trace.get()[2]:
+            return False
+        return super().isEnabledFor(level)
+
+    def makeRecord(self, name, level, fn, lno, msg, args, exc_info, func=None, extra=None, sinfo=None):
+        record = _TraceRecord(name, level, fn, lno, msg, args, exc_info, func, sinfo)
+        if extra is not None:
+            for key in extra:
+                if key in ("message", "asctime") or key in record.__dict__:
+                    raise KeyError(f"Attempt to overwrite {key!r} in LogRecord")
+                record.__dict__[key] = extra[key]
+        return record
+
+
+def get_logger(name: str) -> logging.Logger:
+    """`logging.getLogger` para los módulos del paquete, con muestreo por turno."""
+    previous = logging.getLoggerClass()
+    logging.setLoggerClass(TraceLogger)
+    try:
+        return logging.getLogger(name)
+    finally:
+        logging.setLoggerClass(previous)
+
+
+class TraceFilter(logging.Filter):
+    """Añade a cada registro el trace id y los campos del turno activo."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id, record.trace_fields, _ = _trace.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Deja el registro en una cola acotada y vuelve: el formateo y la escritura
+    los hace el hilo del `QueueListener`. Si la cola está llena el registro se
+    descarta y se cuenta en `dropped`, en lugar de frenar a los bots.
+
+    La cola es una `queue.SimpleQueue` (sin locks en Python) con el límite
+    comprobado a mano, y el handler no toma su lock de E/S: no escribe nada.
+    """
+
+    def __init__(self, log_queue: queue.SimpleQueue, maxsize: int = 10000):
+        super().__init__(log_queue)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Con argumentos mutables el mensaje se resuelve ya (pueden cambiar después); si no, en el listener
+        args = record.args
+        if args and (isinstance(args, Mapping) or not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args)):
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: hora, nivel, logger, mensaje, traza y campos extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            data["trace_id"] = trace_id
+            data.update(getattr(record, "trace_fields", {}))
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "trace_fields":
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para desarrollo: `hora NIVEL [traza] logger: mensaje`."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.trace_id = getattr(record, "trace_id", None) or "-"
+        return super().format(record)
+
+
+def configure_logging(level: str = "INFO", fmt: str = "json", sample_rate: float = 1.0,
+                      queue_size: int = 10000, stream=None) -> NonBlockingQueueHandler:
+    """
+    Envía todos los registros a una cola que vacía un hilo en segundo plano
+    hacia `stream` (stdout por defecto). Se puede llamar de nuevo para cambiar
+    la configuración; el listener anterior se detiene vaciando su cola.
+    """
+    global _listener, _sample_rate
+    if _listener is not None:
+        _listener.stop()
+    _sample_rate = sample_rate
+    # Ni hilo ni proceso ni fichero y línea salen en los registros: no hace falta averiguarlos
+    # en cada llamada (sin `_srcfile` el logging no recorre la pila buscando al llamante)
+    logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+    logging._srcfile = None
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = NonBlockingQueueHandler(log_queue, maxsize=queue_size)
+    handler.addFilter(TraceFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    return handler
+
+
+def shutdown_logging():
+    """Escribe los registros pendientes y detiene el hilo de salida."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
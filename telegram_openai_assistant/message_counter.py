@@ -0,0 +1,155 @@
+# message_counter.py
+# Contador de mensajes en memoria por bot, chat y día con volcado periódico a disco
+import asyncio
+import datetime
+import json
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+Key = Tuple[str, str, int]  # (día, bot, chat_id)
+
+
+class MessageCounter:
+    """
+    Cuenta mensajes por (día, bot, chat) en un dict en memoria.
+
+    `increment` es una simple suma sobre el dict: todo ocurre en el event loop,
+    así que no hace falta ningún lock y no se pierden incrementos entre bots. Una
+    tarea en segundo plano vuelca los contadores a disco cada `flush_interval`
+    segundos y `close` hace el último volcado al apagar.
+    """
+
+    def __init__(self, path, flush_interval: float = 30.0, retention_days: int = 90):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._counts: Dict[Key, int] = defaultdict(int)
+        self._today = ""
+        self._day_ends_at = 0.0
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self._load()
+
+    def _current_day(self) -> str:
+        # Solo se recalcula la fecha al cruzar la medianoche
+        now = time.time()
+        if now >= self._day_ends_at:
+            today = datetime.date.today()
+            tomorrow = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time())
+            self._today = today.isoformat()
+            self._day_ends_at = tomorrow.timestamp()
+        return self._today
+
+    def increment(self, bot_name: str, chat_id: int, amount: int = 1):
+        """Suma `amount` mensajes al chat en el día de hoy."""
+        self._counts[(self._current_day(), bot_name, chat_id)] += amount
+        self._dirty = True
+
+    def daily_total(self, day: Optional[str] = None, bot_name: Optional[str] = None) -> int:
+        """Total de mensajes de un día (hoy por defecto), opcionalmente de un solo bot."""
+        day = day or self._current_day()
+        return sum(
+            count for (d, bot, _), count in self._counts.items()
+            if d == day and (bot_name is None or bot == bot_name)
+        )
+
+    def totals_by_bot(self, day: Optional[str] = None) -> Dict[str, int]:
+        """Mensajes de un día desglosados por bot."""
+        day = day or self._current_day()
+        totals: Dict[str, int] = defaultdict(int)
+        for (d, bot, _), count in self._counts.items():
+            if d == day:
+                totals[bot] += count
+        return dict(totals)
+
+    def top_chats(self, n: int = 10, day: Optional[str] = None, bot_name: Optional[str] = None) -> List[Tuple[int, int]]:
+        """Los `n` chats con más mensajes del día como [(chat_id, mensajes)]."""
+        day = day or self._current_day()
+        per_chat: Dict[int, int] = defaultdict(int)
+        for (d, bot, chat_id), count in self._counts.items():
+            if d == day and (bot_name is None or bot == bot_name):
+                per_chat[chat_id] += count
+        return sorted(per_chat.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def days(self) -> List[str]:
+        """Días con datos, del más antiguo al más reciente."""
+        return sorted({d for d, _, _ in self._counts})
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error("No se pudo leer %s: %s", self.path, e)
+            return
+        if "counts" not in data:
+            # Formato antiguo: {"date": ..., "count": ...} con un único total global
+            if data.get("count"):
+                self._counts[(data["date"], "legacy", 0)] += data["count"]
+            return
+        for day, bots in data["counts"].items():
+            for bot, chats in bots.items():
+                for chat_id, count in chats.items():
+                    self._counts[(day, bot, int(chat_id))] += count
+
+    def _snapshot(self) -> Dict:
+        oldest = (datetime.date.today() - datetime.timedelta(days=self.retention_days)).isoformat()
+        for key in [key for key in self._counts if key[0] < oldest]:
+            del self._counts[key]
+        counts: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for (day, bot, chat_id), count in self._counts.items():
+            counts.setdefault(day, {}).setdefault(bot, {})[str(chat_id)] = count
+        return {"counts": counts}
+
+    def _write(self, snapshot: Dict):
+        # Escritura atómica: nunca queda un archivo a medio escribir
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(snapshot, file)
+        os.replace(tmp_path, self.path)
+
+    def save(self):
+        """Vuelca los contadores a disco de forma síncrona."""
+        self._write(self._snapshot())
+        self._dirty = False
+
+    async def flush(self):
+        """Vuelca los contadores a disco sin bloquear el event loop."""
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, self._snapshot())
+        except OSError as e:
+            self._dirty = True
+            logger.error("No se pudo guardar el contador de mensajes: %s", e)
+
+    async def start(self):
+        """Arranca el volcado periódico."""
+        self._task = asyncio.create_task(self._flusher())
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        """Detiene el volcado periódico y guarda lo pendiente."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
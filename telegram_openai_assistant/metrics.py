@@ -0,0 +1,233 @@
+# metrics.py
+# Contadores, histogramas y gauges en memoria con salida en formato de texto de Prometheus
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Segundos: de las operaciones rápidas (envíos, descargas) a los runs largos con imágenes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    """Valor de una muestra sin perder precisión: los enteros tal cual y el resto con todas sus cifras."""
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(ABC):
+    __slots__ = ("name", "help", "labelnames")
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        """Líneas de muestra de la métrica, sin las de HELP y TYPE."""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    """Contador monótono por combinación de etiquetas: `inc(bot, ...)`."""
+    __slots__ = ("_values",)
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    """
+    Histograma de cubetas fijas. `observe(valor, bot, ...)` es una búsqueda
+    binaria y un incremento: se puede llamar en el camino de cada mensaje.
+    """
+    __slots__ = ("buckets", "_series")
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {etiquetas: [cuentas por cubeta (+Inf al final), suma, total]}
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = 'le="%g"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Gauge(_Metric):
+    """
+    Valor instantáneo que se lee al servir /metrics: `set_function` recibe una
+    función que devuelve el valor (sin etiquetas) o un dict {etiquetas: valor}.
+    Así el camino caliente no paga nada por mantenerlo.
+    """
+    __slots__ = ("_collect",)
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._collect: Optional[Callable] = None
+
+    def set_function(self, collect: Callable):
+        self._collect = collect
+
+    def samples(self) -> Iterable[str]:
+        if self._collect is None:
+            return
+        values = self._collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Todas las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATE_DELAY = REGISTRY.register(Histogram(
+    "telegram_update_delay_seconds", "Desde que Telegram recibe la actualización hasta que empieza su handler",
+    ("bot",), buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300),
+))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "turn_queue_wait_seconds", "Espera de un turno en la cola de su chat y por el lease del chat", ("bot",),
+))
+OPENAI_REQUEST = REGISTRY.register(Histogram(
+    "openai_request_seconds", "Latencia de las llamadas a la API de Assistants fuera del run", ("bot", "call"),
+))
+FIRST_DELTA = REGISTRY.register(Histogram(
+    "openai_first_delta_seconds", "Desde que se lanza el run hasta el primer delta de texto", ("bot",),
+))
+RUN_DURATION = REGISTRY.register(Histogram(
+    "openai_run_seconds", "Duración completa de un run en streaming", ("bot", "status"),
+))
+PHOTO_DOWNLOAD = REGISTRY.register(Histogram(
+    "telegram_photo_download_seconds", "Descarga y preparación de una foto recibida", ("bot",),
+))
+PHOTO_UPLOAD = REGISTRY.register(Histogram(
+    "openai_photo_upload_seconds", "Subida de una foto a OpenAI Files (solo las que no estaban en caché)", ("bot",),
+))
+IMAGE_UPLOADS = REGISTRY.register(Counter(
+    "openai_images_total", "Imágenes añadidas a un thread, según si se subieron o venían de la caché", ("bot", "source"),
+))
+TELEGRAM_SEND = REGISTRY.register(Histogram(
+    "telegram_send_seconds", "Envío o edición de un mensaje, incluida la espera en el planificador de salida",
+    ("bot", "method"),
+))
+SEND_RESULTS = REGISTRY.register(Counter(
+    "telegram_send_total", "Formato elegido y resultado de los envíos (html, plain_fallback, html_rejected, "
+    "network_retries, failed)", ("bot", "result"),
+))
+ANSWER_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "answer_cache_lookups_total", "Consultas a la caché de respuestas (hit, miss o bypass si depende del contexto)",
+    ("assistant", "result"),
+))
+ANSWER_CACHE_SAVED = REGISTRY.register(Counter(
+    "answer_cache_saved_seconds_total", "Tiempo estimado de run ahorrado por las respuestas servidas desde la caché",
+    ("assistant",),
+))
+MESSAGES_COALESCED = REGISTRY.register(Counter(
+    "messages_coalesced_total", "Mensajes sumados al turno pendiente de su chat en lugar de lanzar otro run", ("bot",),
+))
+RUNS_SUPERSEDED = REGISTRY.register(Counter(
+    "runs_superseded_total", "Runs cancelados porque llegó un mensaje nuevo del chat (política cancel)", ("bot",),
+))
+IDLE_EVICTIONS = REGISTRY.register(Counter(
+    "idle_evictions_total", "Chats inactivos sacados de memoria (chat) y threads de OpenAI borrados (thread)",
+    ("kind",),
+))
+RUNS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "runs_in_flight", "Turnos ejecutándose ahora mismo en este proceso, por bot que recibió el mensaje", ("bot",),
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "turns_pending", "Turnos encolados o en curso en este proceso, por bot que recibió el mensaje", ("bot",),
+))
+BOT_IN_FLIGHT = REGISTRY.register(Gauge("bot_turns_in_flight", "Turnos en curso por bot", ("bot",)))
+CHATS_IN_MEMORY = REGISTRY.register(Gauge(
+    "chats_in_memory", "Chats con estado en memoria (los inactivos salen tras IDLE_CHAT_TTL)",
+))
+CHAT_HISTORY_CHATS = REGISTRY.register(Gauge("chat_history_chats", "Chats con historial en memoria"))
+CHAT_HISTORY_RECORDS = REGISTRY.register(Gauge("chat_history_records", "Mensajes guardados en el historial en memoria"))
+CHAT_HISTORY_BYTES = REGISTRY.register(Gauge(
+    "chat_history_bytes", "Memoria estimada del historial de los chats (acotada por HISTORY_MAX_BYTES)",
+))
+ANSWER_CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "answer_cache_entries", "Respuestas guardadas en la caché de cada asistente", ("assistant",),
+))
+
+
+def observe_update_delay(bot_name: str, message) -> None:
+    """Edad de un mensaje al empezar su handler (la fecha de Telegram tiene resolución de 1 s)."""
+    if message is not None and message.date is not None:
+        UPDATE_DELAY.observe(max(0.0, time.time() - message.date.timestamp()), bot_name)
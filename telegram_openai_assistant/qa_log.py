@@ -0,0 +1,140 @@
+# qa_log.py
+# Registro append-only (JSONL) de pares pregunta/respuesta
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+def append_records(path, records: List[Dict]):
+    """Añade registros al final del JSONL con una sola escritura; nunca reescribe el archivo."""
+    if not records:
+        return
+    data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    # O_APPEND: cada lote va al final aunque escriban varios procesos
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def iter_records(path) -> Iterator[Dict]:
+    """Recorre el JSONL registro a registro sin cargarlo entero en memoria."""
+    path = Path(path)
+    if not path.exists():
+        return
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Una línea truncada por un corte a mitad de escritura no invalida el resto
+                logger.warning("Línea corrupta ignorada en %s", path)
+
+
+def migrate_json_array(json_path, jsonl_path) -> int:
+    """
+    Migra una vez el antiguo archivo JSON (un array con todos los registros) a JSONL.
+    El original se renombra a `.migrated` para que no se vuelva a importar.
+    Devuelve cuántos registros se migraron.
+
+    Antes de leerlo se reserva con un rename atómico: si varios procesos (p. ej.
+    los de la flota, que en modo webhook tienen todos los bots) arrancan a la
+    vez, solo uno lo migra y el resto no encuentra nada que hacer.
+    """
+    json_path = Path(json_path)
+    claimed = json_path.with_name(json_path.name + ".migrating")
+    try:
+        json_path.rename(claimed)
+    except FileNotFoundError:
+        # No existe o ya lo ha reservado otro proceso
+        return 0
+    try:
+        with open(claimed, encoding="utf-8") as file:
+            records = json.load(file)
+    except json.JSONDecodeError as e:
+        logger.error("No se pudo migrar %s, el archivo está corrupto: %s", json_path, e)
+        claimed.rename(json_path)
+        return 0
+    append_records(jsonl_path, records)
+    claimed.rename(json_path.with_name(json_path.name + ".migrated"))
+    logger.debug("Migrados %s registros de %s a %s", len(records), json_path, jsonl_path)
+    return len(records)
+
+
+class QALog:
+    """
+    Escritor asíncrono del log de preguntas y respuestas de un bot.
+
+    `log` solo añade el registro a un buffer en memoria; una tarea en segundo
+    plano escribe el lote al final del JSONL cuando se llena (`batch_size`) o
+    cuando pasa `flush_interval` segundos, así que el coste por respuesta no
+    depende del tamaño del histórico.
+    """
+
+    def __init__(self, path, batch_size: int = 100, flush_interval: float = 1.0, legacy_json_path=None):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.legacy_json_path = legacy_json_path
+        self._buffer: List[Dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Migra el JSON antiguo si existe y arranca la tarea de escritura."""
+        if self.path.parent:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.legacy_json_path:
+            await asyncio.to_thread(migrate_json_array, self.legacy_json_path, self.path)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    def log(self, record: Dict):
+        """Encola un registro para escribirlo en el próximo lote."""
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Escribe ya todo lo que haya en el buffer."""
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(append_records, self.path, batch)
+        except OSError as e:
+            logger.error("No se pudo escribir el log de Q&A en %s: %s", self.path, e)
+            self._buffer[:0] = batch
+
+    async def _writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        """Detiene la tarea de escritura y vuelca lo pendiente."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter_records(self.path)
@@ -0,0 +1,245 @@
+# renderer.py
+# Conversión en una sola pasada del Markdown del asistente al HTML de Telegram
+import re
+from typing import List, Optional
+
+# Bloques: se decide mirando solo el principio de cada línea
+_FENCE_RE = re.compile(r'^\s*```\s*([\w+-]*)\s*$')
+_HEADING_RE = re.compile(r'^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$')
+_BULLET_RE = re.compile(r'^(\s*)[-*+•]\s+(.*)$')
+_NUMBERED_RE = re.compile(r'^(\s*)(\d+)[.)]\s+(.*)$')
+_QUOTE_RE = re.compile(r'^\s*>\s?(.*)$')
+_RULE_RE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+# "1. Título: contenido" -> el título va en negrita si no trae ya formato
+_ITEM_TITLE_RE = re.compile(r'^([^:*_`\[\n]{1,80}):(\s|$)')
+
+# Elementos en línea: un único patrón con todas las alternativas
+_INLINE_RE = re.compile(
+    r'(?P<code>`+)'
+    r'|(?P<link>\[(?P<label>[^\]\n]+)\]\((?P<url>https?://[^\s)]+|tg://[^\s)]+|mailto:[^\s)]+)\))'
+    r'|(?P<marker>\*\*|__|~~|\*|_)'
+    r'|(?P<escape>[&<>])'
+)
+
+# HTML ya renderizado: etiquetas, entidades y caracteres especiales sueltos
+_HTML_TOKEN_RE = re.compile(
+    r'<(?P<close>/?)(?P<tag>[a-zA-Z][\w-]*)(?P<attrs>(?:\s+[\w-]+(?:\s*=\s*"[^"<]*")?)*)\s*>'
+    r'|&(?P<entity>#\d+|#x[0-9a-fA-F]+|[a-zA-Z]+);'
+    r'|(?P<stray>[<>&])'
+)
+_HTML_ATTR_RE = re.compile(r'([\w-]+)(?:\s*=\s*"([^"]*)")?')
+
+# Subconjunto de HTML de Telegram: etiqueta -> atributos admitidos
+TELEGRAM_TAGS = {
+    'b': (), 'strong': (), 'i': (), 'em': (), 'u': (), 'ins': (), 's': (), 'strike': (), 'del': (),
+    'tg-spoiler': (), 'span': ('class',), 'a': ('href',), 'tg-emoji': ('emoji-id',),
+    'code': ('class',), 'pre': (), 'blockquote': ('expandable',),
+}
+TELEGRAM_ENTITIES = {'lt', 'gt', 'amp', 'quot'}
+
+_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}
+_TAGS = {'**': 'b', '__': 'b', '*': 'i', '_': 'i', '~~': 's'}
+
+
+def escape_html(text: str) -> str:
+    """Escapa los caracteres especiales del HTML de Telegram."""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum()
+
+
+def render_inline(text: str) -> str:
+    """
+    Convierte el formato en línea de una línea de texto (negrita, cursiva,
+    tachado, código y enlaces) recorriéndola una sola vez.
+
+    Los marcadores que no se cierran en la misma línea se dejan como texto, y
+    los cierres fuera de orden cierran y reabren las etiquetas intermedias, de
+    modo que el resultado siempre está bien anidado.
+    """
+    out: List[str] = []
+    # Pila de (marcador, índice en `out` de la etiqueta de apertura)
+    stack: List[list] = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        match = _INLINE_RE.search(text, pos)
+        if match is None:
+            out.append(text[pos:])
+            break
+        start = match.start()
+        if start > pos:
+            out.append(text[pos:start])
+        kind = match.lastgroup
+        token = match.group()
+        pos = match.end()
+
+        if kind == 'escape':
+            out.append(_ESCAPES[token])
+        elif kind == 'code':
+            end = text.find(token, pos)
+            if end == -1:
+                out.append(token)
+            else:
+                out.append('<code>' + escape_html(text[pos:end]) + '</code>')
+                pos = end + len(token)
+        elif kind == 'link':
+            url = match.group('url').replace('&', '&amp;').replace('"', '&quot;')
+            out.append(f'<a href="{url}">' + render_inline(match.group('label')) + '</a>')
+        else:
+            before = text[start - 1] if start > 0 else ' '
+            after = text[pos] if pos < length else ' '
+            open_index = next((i for i in range(len(stack) - 1, -1, -1) if stack[i][0] == token), None)
+            if token in ('_', '__'):
+                # snake_case, nombres_de_archivo...: el guion bajo dentro de palabras no es formato
+                can_open = not after.isspace() and not _is_word(before)
+                can_close = open_index is not None and not before.isspace() and not _is_word(after)
+            else:
+                can_open = not after.isspace()
+                can_close = open_index is not None and not before.isspace()
+            if can_close:
+                # Cierra las etiquetas abiertas después de esta y las vuelve a abrir dentro
+                reopened = stack[open_index + 1:]
+                del stack[open_index + 1:]
+                for marker, _ in reversed(reopened):
+                    out.append(f'</{_TAGS[marker]}>')
+                stack.pop()
+                out.append(f'</{_TAGS[token]}>')
+                for entry in reopened:
+                    out.append(f'<{_TAGS[entry[0]]}>')
+                    entry[1] = len(out) - 1
+                    stack.append(entry)
+            elif can_open:
+                out.append(f'<{_TAGS[token]}>')
+                stack.append([token, len(out) - 1])
+            else:
+                out.append(token)
+
+    # Marcadores sin cerrar: su etiqueta de apertura vuelve a ser el texto original.
+    # Nunca se emitió un cierre para ellos, así que el resultado sigue equilibrado.
+    for marker, index in stack:
+        out[index] = marker
+    return ''.join(out)
+
+
+def render_telegram_html(text: str) -> str:
+    """
+    Convierte el Markdown del asistente en HTML válido para Telegram.
+
+    Recorre el texto una sola vez, línea a línea: los bloques (código entre
+    ```, títulos, listas, citas y separadores) se reconocen por el principio de
+    la línea y el resto pasa por `render_inline`. El resultado usa solo las
+    etiquetas que admite Telegram y siempre está equilibrado.
+    """
+    lines = text.split('\n')
+    out: List[str] = []
+    code_lines: Optional[List[str]] = None
+    code_language = ''
+    in_quote = False
+
+    for line in lines:
+        if code_lines is not None:
+            if _FENCE_RE.match(line):
+                attr = f' class="language-{code_language}"' if code_language else ''
+                out.append(f'<pre><code{attr}>' + escape_html('\n'.join(code_lines)) + '</code></pre>')
+                code_lines = None
+            else:
+                code_lines.append(line)
+            continue
+
+        fence = _FENCE_RE.match(line)
+        if fence:
+            code_lines = []
+            code_language = fence.group(1)
+            continue
+
+        quote = _QUOTE_RE.match(line)
+        if quote:
+            content = render_inline(quote.group(1))
+            if in_quote:
+                out[-1] = out[-1][:-len('</blockquote>')] + '\n' + content + '</blockquote>'
+            else:
+                out.append('<blockquote>' + content + '</blockquote>')
+                in_quote = True
+            continue
+        in_quote = False
+
+        heading = _HEADING_RE.match(line)
+        if heading:
+            out.append('<b>' + render_inline(heading.group(1)) + '</b>')
+            continue
+
+        if _RULE_RE.match(line):
+            out.append('──────────')
+            continue
+
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            out.append(bullet.group(1) + '• ' + render_inline(bullet.group(2)))
+            continue
+
+        numbered = _NUMBERED_RE.match(line)
+        if numbered:
+            out.append(numbered.group(1) + numbered.group(2) + '. ' + _render_numbered_item(numbered.group(3)))
+            continue
+
+        out.append(render_inline(line))
+
+    if code_lines is not None:
+        # Bloque de código sin cerrar (p. ej. a mitad de streaming): se cierra igualmente
+        out.append('<pre>' + escape_html('\n'.join(code_lines)) + '</pre>')
+
+    return '\n'.join(out).strip()
+
+
+def validate_telegram_html(html: str) -> Optional[str]:
+    """
+    Comprueba localmente que `html` se puede enviar con parse_mode=HTML.
+
+    Revisa lo mismo que el parser de Telegram: solo etiquetas y atributos del
+    subconjunto admitido, etiquetas bien anidadas y cerradas, entidades
+    conocidas y ningún `<`, `>` o `&` sin escapar. Devuelve None si es válido o
+    una descripción del primer problema encontrado.
+    """
+    stack: List[str] = []
+    for match in _HTML_TOKEN_RE.finditer(html):
+        if match.group('stray'):
+            return f"carácter '{match.group('stray')}' sin escapar en la posición {match.start()}"
+        entity = match.group('entity')
+        if entity is not None:
+            if not entity.startswith('#') and entity not in TELEGRAM_ENTITIES:
+                return f"entidad desconocida &{entity};"
+            continue
+        tag = match.group('tag').lower()
+        if tag not in TELEGRAM_TAGS:
+            return f"etiqueta no admitida <{tag}>"
+        if match.group('close'):
+            if match.group('attrs'):
+                return f"la etiqueta de cierre </{tag}> lleva atributos"
+            if not stack or stack[-1] != tag:
+                return f"cierre </{tag}> sin su apertura correspondiente"
+            stack.pop()
+            continue
+        for name, value in _HTML_ATTR_RE.findall(match.group('attrs')):
+            if name.lower() not in TELEGRAM_TAGS[tag]:
+                return f"atributo {name} no admitido en <{tag}>"
+            if tag == 'span' and value != 'tg-spoiler':
+                return "<span> solo admite class=\"tg-spoiler\""
+            if tag == 'code' and not value.startswith('language-'):
+                return "<code> solo admite class=\"language-...\""
+        if tag == 'a' and 'href' not in match.group('attrs'):
+            return "<a> sin href"
+        stack.append(tag)
+    if stack:
+        return f"etiqueta <{stack[-1]}> sin cerrar"
+    return None
+
+
+def _render_numbered_item(content: str) -> str:
+    """Elemento de lista numerada; "Título: texto" pone el título en negrita."""
+    title = _ITEM_TITLE_RE.match(content)
+    if title:
+        return '<b>' + escape_html(title.group(1).strip()) + '</b>:' + render_inline(content[title.end(1) + 1:])
+    return render_inline(content)
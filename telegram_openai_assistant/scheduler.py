@@ -0,0 +1,119 @@
+# scheduler.py
+# Colas de trabajo ordenadas por chat con un límite global de runs en curso
+import asyncio
+from collections import Counter, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+Job = Callable[[], Awaitable]
+
+
+class ChatScheduler:
+    """
+    Serializa el trabajo de cada chat y limita cuántos runs corren a la vez.
+
+    Cada `group_id` tiene su propia cola FIFO atendida por una única tarea, de modo
+    que nunca hay dos runs a la vez sobre el mismo thread de OpenAI. Un semáforo
+    global acota los runs en curso entre todos los chats. Cuando la cola de un chat
+    (o el total pendiente) está llena, `submit` rechaza el trabajo en el acto para
+    que el llamante pueda avisar al usuario.
+
+    Cada trabajo puede llevar una etiqueta (p. ej. el bot que recibió el mensaje):
+    `in_flight_by` y `pending_by` desglosan por ella los totales.
+    """
+
+    def __init__(self, max_in_flight: int = 8, max_queue_per_chat: int = 3, max_pending_total: int = 200):
+        self.max_in_flight = max_in_flight
+        self.max_queue_per_chat = max_queue_per_chat
+        self.max_pending_total = max_pending_total
+        self.in_flight = 0
+        self.pending_total = 0
+        self.in_flight_by: Counter = Counter()
+        self.pending_by: Counter = Counter()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._queues: Dict[int, Deque[Tuple[Job, asyncio.Future, str]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def queue_depth(self, group_id: int) -> int:
+        """Trabajos del chat que aún no han terminado (el que corre incluido)."""
+        queue = self._queues.get(group_id)
+        return len(queue) if queue else 0
+
+    def is_busy(self, group_id: int) -> bool:
+        """Indica si el chat tiene algún trabajo en cola o en ejecución."""
+        return self.queue_depth(group_id) > 0
+
+    def submit(self, group_id: int, job: Job, label: str = "") -> Optional[asyncio.Future]:
+        """
+        Encola `job` detrás del trabajo pendiente del chat; `label` lo cuenta en los desgloses.
+
+        Devuelve un future que se resuelve con el resultado del trabajo, o None si
+        la cola del chat o el límite global de pendientes están llenos.
+        """
+        if self.queue_depth(group_id) >= self.max_queue_per_chat:
+            logger.warning("Cola llena para group_id: %s (%s pendientes)", group_id, self.max_queue_per_chat)
+            return None
+        if self.pending_total >= self.max_pending_total:
+            logger.warning("Límite global de trabajos pendientes alcanzado (%s)", self.max_pending_total)
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(group_id, deque()).append((job, future, label))
+        self.pending_total += 1
+        self.pending_by[label] += 1
+        if group_id not in self._workers:
+            self._workers[group_id] = asyncio.create_task(self._drain(group_id))
+        return future
+
+    async def _drain(self, group_id: int):
+        """Ejecuta en orden los trabajos de un chat hasta vaciar su cola."""
+        queue = self._queues[group_id]
+        try:
+            while queue:
+                # El trabajo sigue en la cola mientras corre para que cuente en la profundidad
+                job, future, label = queue[0]
+                try:
+                    async with self._semaphore:
+                        self.in_flight += 1
+                        self.in_flight_by[label] += 1
+                        try:
+                            result = await job()
+                        finally:
+                            self.in_flight -= 1
+                            self.in_flight_by[label] -= 1
+                    if not future.done():
+                        future.set_result(result)
+                except asyncio.CancelledError:
+                    if not future.done():
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    logger.error("Error en trabajo encolado para group_id: %s: %s", group_id, e)
+                    if not future.done():
+                        future.set_exception(e)
+                finally:
+                    queue.popleft()
+                    self.pending_total -= 1
+                    self.pending_by[label] -= 1
+        finally:
+            # Sin await entre la comprobación de la cola y esta limpieza: submit no puede colarse
+            self._workers.pop(group_id, None)
+            if not queue:
+                self._queues.pop(group_id, None)
+
+    async def shutdown(self):
+        """Cancela los trabajos pendientes y espera a que terminen las tareas."""
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for queue in self._queues.values():
+            for _, future, _ in queue:
+                if not future.done():
+                    future.cancel()
+        self._queues.clear()
+        self.pending_total = 0
+        self.pending_by.clear()
@@ -0,0 +1,324 @@
+# send_scheduler.py
+# Cola de salida hacia Telegram que respeta los límites de envío de la Bot API
+import asyncio
+import datetime
+import itertools
+import time
+from typing import Dict, List, Optional
+
+from telegram.error import RetryAfter
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+# Prioridades: menor número = se envía antes
+PRIORITY_HIGH = 0     # avisos inmediatos al usuario (cola llena, errores)
+PRIORITY_NORMAL = 1   # respuestas y ediciones finales
+PRIORITY_LOW = 2      # ediciones intermedias del streaming
+
+TELEGRAM_MAX_LENGTH = 4096
+
+
+class TokenBucket:
+    """Cubo de tokens: `rate` tokens por segundo con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Bloquea el cubo `seconds` segundos (p. ej. tras un RetryAfter) y lo vacía."""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+
+class _Outgoing:
+    __slots__ = ("kind", "chat_id", "kwargs", "priority", "seq", "futures", "mergeable", "tag")
+
+    def __init__(self, kind, chat_id, kwargs, priority, seq, future, mergeable, tag=None):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.futures = [future]
+        self.mergeable = mergeable
+        self.tag = tag
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class OutboundScheduler:
+    """
+    Planificador de envíos salientes de un bot.
+
+    Todos los `send_message` y `edit_message_text` pasan por una cola con
+    prioridad y solo salen cuando hay token en los tres cubos que aplican: el
+    global del bot (~30 msg/s), el del chat (~1 msg/s) y, para grupos, el de
+    grupo (~20 msg/min). Si Telegram responde con `RetryAfter`, se pausan los
+    cubos del chat y del grupo el tiempo indicado y se reintenta el envío.
+    Dentro de un chat solo hay un envío en curso a la vez, así que el orden se
+    mantiene.
+
+    Mientras esperan, los mensajes del mismo chat y mismo `parse_mode` se
+    fusionan en uno solo (hasta 4096 caracteres) y las ediciones pendientes de
+    un mismo mensaje se reducen a la última.
+
+    Los envíos pueden llevar una `tag` (p. ej. el run que los generó): `drop`
+    descarta los que siguen en cola con esa etiqueta y solo se fusionan envíos
+    con la misma.
+    """
+
+    def __init__(
+        self,
+        bot,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 1.0,
+        group_rate_per_minute: float = 20.0,
+        group_burst: float = 1.0,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60.0
+        self.group_burst = group_burst
+        # Sin ráfaga global: los envíos se espacian 1/global_rate segundos
+        self._global = TokenBucket(global_rate, 1.0)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._group_buckets: Dict[int, TokenBucket] = {}
+        self._pending: List[_Outgoing] = []
+        self._in_flight_chats = set()
+        self._dispatches = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"sent": 0, "edited": 0, "merged": 0, "edits_coalesced": 0, "retry_after": 0, "dropped": 0}
+
+    # --- API pública -----------------------------------------------------
+
+    async def send_message(self, chat_id: int, text: str, parse_mode=None, priority: int = PRIORITY_NORMAL,
+                           mergeable: bool = True, tag=None, **kwargs):
+        """
+        Encola un send_message y devuelve el `Message` enviado (puede ser uno
+        fusionado), o None si se descartó con `drop`.
+        """
+        kwargs.update(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        # Solo se fusionan mensajes simples, sin teclados ni respuestas a otro mensaje
+        mergeable = mergeable and len(kwargs) == 3
+        return await self._enqueue("send", chat_id, kwargs, priority, mergeable, tag)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, parse_mode=None,
+                                priority: int = PRIORITY_NORMAL, tag=None, **kwargs):
+        """Encola un edit_message_text; si ya había otro pendiente para el mismo mensaje, lo sustituye."""
+        kwargs.update(chat_id=chat_id, message_id=message_id, text=text, parse_mode=parse_mode)
+        for item in self._pending:
+            if item.kind == "edit" and item.chat_id == chat_id and item.kwargs["message_id"] == message_id:
+                item.kwargs = kwargs
+                item.priority = min(item.priority, priority)
+                future = asyncio.get_running_loop().create_future()
+                item.futures.append(future)
+                self.stats["edits_coalesced"] += 1
+                return await future
+        return await self._enqueue("edit", chat_id, kwargs, priority, False, tag)
+
+    def drop(self, chat_id: int, tag) -> int:
+        """
+        Descarta los envíos y ediciones del chat con esa etiqueta que aún no han
+        salido (quien los espera recibe None). El que ya está en curso sí llega.
+        """
+        dropped = [item for item in self._pending if item.chat_id == chat_id and item.tag is tag]
+        for item in dropped:
+            self._pending.remove(item)
+            for future in item.futures:
+                if not future.done():
+                    future.set_result(None)
+        self.stats["dropped"] += len(dropped)
+        return len(dropped)
+
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Envía lo que quede en cola y detiene el planificador."""
+        if self._task is None:
+            return
+        while (self._pending or self._dispatches) and not self._task.done():
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # --- Internos -----------------------------------------------------------
+
+    async def _enqueue(self, kind, chat_id, kwargs, priority, mergeable, tag=None):
+        if self._task is None:
+            # Sin planificador en marcha (p. ej. al apagar): envío directo
+            return await self._call(kind, kwargs)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Outgoing(kind, chat_id, kwargs, priority, next(self._seq), future, mergeable, tag))
+        self._wakeup.set()
+        return await future
+
+    def _buckets_for(self, chat_id: int) -> List[TokenBucket]:
+        buckets = [self._global]
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        buckets.append(bucket)
+        if chat_id < 0:
+            # Los ids negativos son grupos, supergrupos y canales
+            group = self._group_buckets.get(chat_id)
+            if group is None:
+                group = self._group_buckets[chat_id] = TokenBucket(self.group_rate, self.group_burst)
+            buckets.append(group)
+        return buckets
+
+    def _pick(self):
+        """Devuelve (elemento listo de mayor prioridad, espera mínima si no hay ninguno)."""
+        now = time.monotonic()
+        shortest = None
+        blocked_chats = set()
+        for item in sorted(self._pending, key=lambda i: (i.priority, i.seq)):
+            # Un envío en curso por chat, para que los mensajes lleguen en orden
+            if item.chat_id in blocked_chats or item.chat_id in self._in_flight_chats:
+                continue
+            wait = max(bucket.wait_time(now) for bucket in self._buckets_for(item.chat_id))
+            if wait == 0:
+                return item, 0.0
+            # Respeta el orden dentro de un chat: lo siguiente del chat espera a este
+            blocked_chats.add(item.chat_id)
+            shortest = wait if shortest is None else min(shortest, wait)
+        return None, shortest
+
+    def _merge_into(self, item: _Outgoing):
+        """Fusiona en `item` los demás envíos pendientes del mismo chat que quepan."""
+        if not item.mergeable:
+            return
+        texts = [item.kwargs["text"]]
+        length = len(texts[0])
+        for other in sorted(self._pending, key=lambda i: i.seq):
+            if other is item or other.chat_id != item.chat_id:
+                continue
+            if other.kind != "send" or not other.mergeable:
+                # No adelantar a un envío que debe salir antes que el resto
+                if other.seq > item.seq:
+                    break
+                continue
+            if other.kwargs["parse_mode"] != item.kwargs["parse_mode"] or other.tag is not item.tag:
+                break
+            extra = len(other.kwargs["text"]) + 2
+            if length + extra > TELEGRAM_MAX_LENGTH:
+                break
+            texts.append(other.kwargs["text"])
+            length += extra
+            item.futures.extend(other.futures)
+            self._pending.remove(other)
+            self.stats["merged"] += 1
+        item.kwargs["text"] = "\n\n".join(texts)
+
+    async def _call(self, kind, kwargs):
+        if kind == "send":
+            return await self.bot.send_message(**kwargs)
+        return await self.bot.edit_message_text(**kwargs)
+
+    async def _run(self):
+        while True:
+            item, wait = self._pick()
+            if item is None:
+                if not self._pending:
+                    self._prune_buckets()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._pending.remove(item)
+            if item.kind == "send":
+                self._merge_into(item)
+            now = time.monotonic()
+            buckets = self._buckets_for(item.chat_id)
+            for bucket in buckets:
+                bucket.take(now)
+
+            # Cada envío corre en su propia tarea para no frenar a los demás chats
+            self._in_flight_chats.add(item.chat_id)
+            task = asyncio.create_task(self._dispatch(item, buckets))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    def _prune_buckets(self):
+        """Olvida los cubos de chats inactivos (llenos de nuevo) para no acumular memoria."""
+        now = time.monotonic()
+        for buckets in (self._chat_buckets, self._group_buckets):
+            for chat_id in [chat_id for chat_id, bucket in buckets.items()
+                            if bucket.wait_time(now) == 0 and bucket.tokens >= bucket.capacity]:
+                del buckets[chat_id]
+
+    async def _dispatch(self, item: _Outgoing, buckets: List[TokenBucket]):
+        try:
+            await self._send_item(item, buckets)
+        finally:
+            self._in_flight_chats.discard(item.chat_id)
+            self._wakeup.set()
+
+    async def _send_item(self, item: _Outgoing, buckets: List[TokenBucket]):
+        try:
+            result = await self._call(item.kind, item.kwargs)
+        except RetryAfter as e:
+            seconds = _retry_after_seconds(e)
+            self.stats["retry_after"] += 1
+            logger.warning("Telegram pide esperar %ss antes de enviar al chat %s", seconds, item.chat_id)
+            # Se pausa el chat (y su grupo); el cubo global sigue sirviendo a los demás chats
+            for bucket in buckets[1:]:
+                bucket.pause(seconds)
+            # Vuelve a la cola con su prioridad y orden originales
+            self._pending.append(item)
+            self._wakeup.set()
+            return
+        except Exception as e:
+            for future in item.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats["sent" if item.kind == "send" else "edited"] += 1
+        for future in item.futures:
+            if not future.done():
+                future.set_result(result)
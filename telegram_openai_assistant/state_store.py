@@ -0,0 +1,405 @@
+# state_store.py
+# Estado compartido entre nodos: threads por chat, datos del usuario y leases de chat
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .log import get_logger
+from .thread_registry import ThreadRegistry
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Solo hace falta con STATE_BACKEND=redis
+    aioredis = None
+
+logger = get_logger(__name__)
+
+BACKENDS = ("sqlite", "redis")
+
+
+def default_node_id() -> str:
+    """Identificador de este proceso entre todos los nodos que comparten el estado."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class StateStore(ABC):
+    """
+    Interfaz del estado de las conversaciones que no puede vivir en un solo proceso.
+
+    - Thread de OpenAI de cada chat (`get_or_create` es la única consulta de un turno).
+    - Datos del usuario de cada chat (p. ej. su nombre para personalizar respuestas).
+    - Lease por chat: solo el nodo que lo tiene procesa turnos de ese chat. Caduca
+      a los `ttl` segundos si no se renueva, así que si un nodo muere sus chats
+      pasan a otro en cuanto vence.
+    - Último uso de cada thread, para encontrar los que llevan tiempo sin usarse.
+    """
+
+    @abstractmethod
+    async def get_thread(self, group_id: int) -> Optional[str]:
+        """Thread de OpenAI del chat, o None si no tiene."""
+
+    @abstractmethod
+    async def set_thread(self, group_id: int, thread_id: str):
+        """Guarda (o reemplaza) el thread del chat."""
+
+    @abstractmethod
+    async def delete_thread(self, group_id: int) -> bool:
+        """Olvida el thread del chat. Devuelve True si existía."""
+
+    @abstractmethod
+    async def get_or_create(self, group_id: int, create: Callable[[], Awaitable]) -> Optional[str]:
+        """Thread del chat (marcando su uso) o uno nuevo creado con `create` si no tenía."""
+
+    @abstractmethod
+    async def last_used(self, group_id: int) -> Optional[float]:
+        """Hora (epoch) del último turno con el thread del chat, o None si no tiene."""
+
+    @abstractmethod
+    async def stale_threads(self, before: float, limit: int = 100) -> List[Tuple[int, str]]:
+        """Chats (group_id, thread_id) sin usar su thread desde `before`, los más antiguos primero."""
+
+    def evict(self, group_id: int):
+        """Saca el chat de las cachés en memoria del backend, si las tiene."""
+
+    @abstractmethod
+    async def get_user(self, group_id: int) -> Dict[str, str]:
+        """Datos guardados del usuario del chat."""
+
+    @abstractmethod
+    async def update_user(self, group_id: int, **fields: str):
+        """Añade o reemplaza campos de los datos del usuario del chat."""
+
+    @abstractmethod
+    async def acquire_lease(self, group_id: int, owner: str, ttl: float) -> bool:
+        """Toma (o renueva, si ya es suyo) el lease del chat. False si lo tiene otro nodo."""
+
+    @abstractmethod
+    async def renew_lease(self, group_id: int, owner: str, ttl: float) -> bool:
+        """Alarga el lease si sigue siendo de `owner`. False si se perdió."""
+
+    @abstractmethod
+    async def release_lease(self, group_id: int, owner: str):
+        """Suelta el lease si es de `owner`."""
+
+    async def close(self):
+        pass
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Estado en SQLite (WAL), válido para uno o varios procesos en la misma máquina.
+
+    Los threads van por el `ThreadRegistry` de siempre (con su caché LRU); los
+    usuarios y los leases son dos tablas más en la misma base de datos. Los
+    leases usan la hora del sistema porque la comparten todos los procesos.
+
+    Las consultas son bloqueantes, así que se hacen en un hilo propio del store
+    y no en el event loop que comparten todos los bots: uno solo, para que la
+    conexión y la caché no se usen desde dos hilos a la vez. Con varios procesos
+    una escritura espera como mucho `busy_timeout_ms` a que otro suelte la base
+    de datos antes de fallar (un lease ocupado se reintenta en el siguiente sondeo).
+    """
+
+    def __init__(self, db_path: str, cache_size: int = 1024, busy_timeout_ms: int = 200):
+        self.threads = ThreadRegistry(db_path, cache_size=cache_size, busy_timeout_ms=busy_timeout_ms)
+        self._db = self.threads._db
+        self._db.execute("CREATE TABLE IF NOT EXISTS users (group_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " group_id INTEGER PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-sqlite")
+
+    async def _run(self, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _execute(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        return await self._run(self._db.execute, sql, params)
+
+    async def get_thread(self, group_id: int) -> Optional[str]:
+        return await self._run(self.threads.get, group_id)
+
+    async def set_thread(self, group_id: int, thread_id: str):
+        await self._run(self.threads.set, group_id, thread_id)
+
+    async def delete_thread(self, group_id: int) -> bool:
+        return await self._run(self.threads.delete, group_id)
+
+    async def get_or_create(self, group_id: int, create: Callable[[], Awaitable]) -> Optional[str]:
+        thread_id = await self._run(self.threads.use, group_id)
+        if thread_id:
+            return thread_id
+
+        logger.debug("No se encontró un thread_id para group_id: %s, creando uno nuevo.", group_id)
+        thread = await create()
+        if not (thread and getattr(thread, 'id', None)):
+            logger.error("No se pudo crear un thread para group_id: %s", group_id)
+            return None
+        await self._run(self.threads.set, group_id, thread.id)
+        logger.debug("Nuevo thread_id creado: %s para group_id: %s", thread.id, group_id)
+        return thread.id
+
+    async def last_used(self, group_id: int) -> Optional[float]:
+        return await self._run(self.threads.last_used, group_id)
+
+    async def stale_threads(self, before: float, limit: int = 100) -> List[Tuple[int, str]]:
+        return await self._run(self.threads.stale, before, limit)
+
+    def evict(self, group_id: int):
+        # Solo toca la caché: se hace en el hilo del store para no cruzarse con una consulta
+        self._executor.submit(self.threads.evict, group_id)
+
+    async def get_user(self, group_id: int) -> Dict[str, str]:
+        row = (await self._execute("SELECT data FROM users WHERE group_id = ?", (group_id,))).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def update_user(self, group_id: int, **fields: str):
+        def update():
+            row = self._db.execute("SELECT data FROM users WHERE group_id = ?", (group_id,)).fetchone()
+            data = json.loads(row[0]) if row else {}
+            data.update(fields)
+            self._db.execute(
+                "INSERT INTO users (group_id, data) VALUES (?, ?)"
+                " ON CONFLICT(group_id) DO UPDATE SET data = excluded.data",
+                (group_id, json.dumps(data, ensure_ascii=False)),
+            )
+
+        await self._run(update)
+
+    async def acquire_lease(self, group_id: int, owner: str, ttl: float) -> bool:
+        now = time.time()
+        # Se inserta, o se sobrescribe si ha caducado o ya era nuestro; si no, no cambia nada
+        cursor = await self._execute(
+            "INSERT INTO leases (group_id, owner, expires_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(group_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+            " WHERE leases.expires_at <= ? OR leases.owner = excluded.owner",
+            (group_id, owner, now + ttl, now),
+        )
+        return cursor.rowcount > 0
+
+    async def renew_lease(self, group_id: int, owner: str, ttl: float) -> bool:
+        cursor = await self._execute(
+            "UPDATE leases SET expires_at = ? WHERE group_id = ? AND owner = ?",
+            (time.time() + ttl, group_id, owner),
+        )
+        return cursor.rowcount > 0
+
+    async def release_lease(self, group_id: int, owner: str):
+        await self._execute("DELETE FROM leases WHERE group_id = ? AND owner = ?", (group_id, owner))
+
+    async def close(self):
+        await self._run(self.threads.close)
+        self._executor.shutdown(wait=False)
+
+
+# Comprobar el dueño y modificar la clave tiene que ser atómico: scripts Lua
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _text(value) -> Optional[str]:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RedisStateStore(StateStore):
+    """
+    Estado en Redis (o cualquier servidor compatible), para varios nodos.
+
+    `client` es un cliente asíncrono con la interfaz de `redis.asyncio.Redis`;
+    se puede inyectar cualquier otro que la imite (p. ej. el de los benchmarks).
+    Claves: `<prefix>thread:<chat>` (texto), `<prefix>user:<chat>` (hash),
+    `<prefix>lease:<chat>` (dueño, con caducidad en milisegundos) y
+    `<prefix>threads_used` (conjunto ordenado de chats por último uso del thread).
+    """
+
+    def __init__(self, client, prefix: str = "tgbot:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, kind: str, group_id: int) -> str:
+        return f"{self.prefix}{kind}:{group_id}"
+
+    async def get_thread(self, group_id: int) -> Optional[str]:
+        return _text(await self.client.get(self._key("thread", group_id)))
+
+    async def _touch(self, group_id: int):
+        await self.client.zadd(f"{self.prefix}threads_used", {str(group_id): time.time()})
+
+    async def set_thread(self, group_id: int, thread_id: str):
+        await self.client.set(self._key("thread", group_id), thread_id)
+        await self._touch(group_id)
+
+    async def delete_thread(self, group_id: int) -> bool:
+        await self.client.zrem(f"{self.prefix}threads_used", str(group_id))
+        return bool(await self.client.delete(self._key("thread", group_id)))
+
+    async def last_used(self, group_id: int) -> Optional[float]:
+        return await self.client.zscore(f"{self.prefix}threads_used", str(group_id))
+
+    async def stale_threads(self, before: float, limit: int = 100) -> List[Tuple[int, str]]:
+        members = await self.client.zrangebyscore(f"{self.prefix}threads_used", "-inf", before, start=0, num=limit)
+        stale = []
+        for member in members:
+            group_id = int(_text(member))
+            thread_id = await self.get_thread(group_id)
+            if thread_id:
+                stale.append((group_id, thread_id))
+        return stale
+
+    async def get_or_create(self, group_id: int, create: Callable[[], Awaitable]) -> Optional[str]:
+        thread_id = await self.get_thread(group_id)
+        if thread_id:
+            await self._touch(group_id)
+            return thread_id
+
+        logger.debug("No se encontró un thread_id para group_id: %s, creando uno nuevo.", group_id)
+        thread = await create()
+        if not (thread and getattr(thread, 'id', None)):
+            logger.error("No se pudo crear un thread para group_id: %s", group_id)
+            return None
+        # Si otro nodo se adelantó, se usa su thread para no partir la conversación
+        if not await self.client.set(self._key("thread", group_id), thread.id, nx=True):
+            return await self.get_thread(group_id)
+        await self._touch(group_id)
+        logger.debug("Nuevo thread_id creado: %s para group_id: %s", thread.id, group_id)
+        return thread.id
+
+    async def get_user(self, group_id: int) -> Dict[str, str]:
+        data = await self.client.hgetall(self._key("user", group_id))
+        return {_text(key): _text(value) for key, value in data.items()}
+
+    async def update_user(self, group_id: int, **fields: str):
+        await self.client.hset(self._key("user", group_id), mapping=fields)
+
+    async def acquire_lease(self, group_id: int, owner: str, ttl: float) -> bool:
+        key = self._key("lease", group_id)
+        if await self.client.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        return await self.renew_lease(group_id, owner, ttl)
+
+    async def renew_lease(self, group_id: int, owner: str, ttl: float) -> bool:
+        return bool(await self.client.eval(RENEW_SCRIPT, 1, self._key("lease", group_id), owner, int(ttl * 1000)))
+
+    async def release_lease(self, group_id: int, owner: str):
+        await self.client.eval(RELEASE_SCRIPT, 1, self._key("lease", group_id), owner)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_state_store(backend: str, db_path: str, cache_size: int = 1024,
+                       redis_url: Optional[str] = None, prefix: str = "tgbot:", client=None,
+                       busy_timeout_ms: int = 200) -> StateStore:
+    """Crea el backend configurado; con `client` se usa ese cliente en lugar de conectar a `redis_url`."""
+    if backend == "sqlite":
+        return SQLiteStateStore(db_path, cache_size=cache_size, busy_timeout_ms=busy_timeout_ms)
+    if backend == "redis":
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("STATE_BACKEND=redis necesita el paquete redis: pip install redis")
+            client = aioredis.from_url(redis_url, decode_responses=True)
+        return RedisStateStore(client, prefix=prefix)
+    raise ValueError(f"Backend de estado desconocido: {backend!r} (opciones: {', '.join(BACKENDS)})")
+
+
+class ChatLeases:
+    """
+    Garantiza que un chat lo procesa un único nodo a la vez.
+
+    `run(group_id, body)` espera hasta `wait_timeout` segundos a que el lease
+    quede libre (el otro nodo termina su turno o muere y el lease caduca),
+    ejecuta `body()` en su propia tarea renovando el lease cada `ttl / 3` y lo
+    suelta al salir. Si una renovación dice que el lease ya no es nuestro (p. ej.
+    el nodo estuvo parado más de `ttl` y otro se quedó con el chat), la tarea
+    del turno se cancela para que no siga escribiendo en el chat ni en su
+    thread. El lease es del nodo, no del turno: dentro de un nodo los turnos de
+    un chat ya van en fila gracias al `ChatScheduler`.
+    """
+
+    def __init__(self, store: StateStore, owner: str, ttl: float = 30.0,
+                 wait_timeout: float = 120.0, poll_interval: float = 0.5):
+        self.store = store
+        self.owner = owner
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.stats = {"acquired": 0, "waited": 0, "timeouts": 0, "lost": 0}
+
+    async def _try_acquire(self, group_id: int) -> bool:
+        try:
+            return await self.store.acquire_lease(group_id, self.owner, self.ttl)
+        except Exception as e:
+            # P. ej. la base de datos sigue bloqueada por otro proceso: se reintenta en el siguiente sondeo
+            logger.debug("No se pudo tomar el lease del chat %s: %s", group_id, e)
+            return False
+
+    async def _acquire(self, group_id: int) -> bool:
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while not await self._try_acquire(group_id):
+            if time.monotonic() >= deadline:
+                self.stats["timeouts"] += 1
+                return False
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+        self.stats["acquired"] += 1
+        self.stats["waited"] += waited
+        return True
+
+    async def _renew(self, group_id: int):
+        """Renueva el lease hasta que se cancela; termina si el lease se ha perdido."""
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                renewed = await self.store.renew_lease(group_id, self.owner, self.ttl)
+            except Exception as e:
+                logger.warning("No se pudo renovar el lease del chat %s: %s", group_id, e)
+                continue
+            if not renewed:
+                self.stats["lost"] += 1
+                logger.warning("Se perdió el lease del chat %s; se interrumpe el turno", group_id)
+                return
+
+    async def run(self, group_id: int, body: Callable[[], Awaitable]) -> bool:
+        """
+        Ejecuta `body()` con el lease del chat. Devuelve False si no se consiguió
+        a tiempo o si se perdió a mitad (y `body` se canceló); los errores de
+        `body` se propagan.
+        """
+        if not await self._acquire(group_id):
+            return False
+        renewer = asyncio.create_task(self._renew(group_id))
+        work = asyncio.ensure_future(body())
+        try:
+            await asyncio.wait((work, renewer), return_when=asyncio.FIRST_COMPLETED)
+            if work.done():
+                work.result()
+                return True
+            return False
+        finally:
+            for task in (work, renewer):
+                task.cancel()
+            await asyncio.gather(work, renewer, return_exceptions=True)
+            try:
+                await self.store.release_lease(group_id, self.owner)
+            except Exception as e:
+                # Si no se puede soltar, caduca solo a los `ttl` segundos
+                logger.warning("No se pudo soltar el lease del chat %s: %s", group_id, e)
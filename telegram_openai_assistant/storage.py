@@ -1,26 +1,26 @@
 # storage.py
 # Handles storing and retrieving questions/answers
 
-import json
 from pathlib import Path
 
-# Define the path to the Q&A file
-qa_file = Path("questions_answers.json")
+from .qa_log import append_records, iter_records, migrate_json_array
 
-# Ensure the Q&A file exists
-if not qa_file.is_file():
-    with open(qa_file, "w") as file:
-        json.dump([], file)
+# Define the path to the Q&A log (one JSON record per line)
+qa_file = Path("questions_answers.jsonl")
+legacy_qa_file = Path("questions_answers.json")
+
+# Import the old JSON array once, if there is one
+migrate_json_array(legacy_qa_file, qa_file)
 
 def save_qa(telegram_id, username, question, answer):
     """Save question and answer pairs to a file along with user information."""
-    with open(qa_file, "r+") as file:
-        data = json.load(file)
-        data.append({
-            "telegram_id": telegram_id,
-            "username": username,
-            "question": question,
-            "answer": answer
-        })
-        file.seek(0)
-        json.dump(data, file, indent=4)
+    append_records(qa_file, [{
+        "telegram_id": telegram_id,
+        "username": username,
+        "question": question,
+        "answer": answer
+    }])
+
+def load_qa():
+    """Iterate over the stored question and answer pairs."""
+    return iter_records(qa_file)
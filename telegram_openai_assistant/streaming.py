@@ -0,0 +1,147 @@
+# streaming.py
+# Respuesta en streaming editando un mismo mensaje de Telegram
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+# Telegram corta los mensajes a 4096 caracteres; se deja margen para el marcado HTML
+TELEGRAM_MAX_LENGTH = 4096
+DEFAULT_ROLLOVER_LENGTH = 3800
+
+
+def split_for_rollover(text: str, limit: int):
+    """
+    Parte `text` en (cabeza, resto) con la cabeza de como mucho `limit` caracteres,
+    cortando preferiblemente en un párrafo, una línea o un espacio.
+    """
+    if len(text) <= limit:
+        return text, ""
+    for separator in ("\n\n", "\n", " "):
+        cut = text.rfind(separator, 0, limit)
+        if cut > limit // 2:
+            return text[:cut].rstrip(), text[cut:].lstrip()
+    return text[:limit], text[limit:]
+
+
+class ProgressiveMessage:
+    """
+    Va mostrando una respuesta en streaming sobre un único mensaje.
+
+    Envía enseguida un mensaje provisional y lo actualiza con `edit_message_text`
+    como mucho una vez cada `edit_interval` segundos y solo si hay al menos
+    `min_chars` caracteres nuevos (el primer texto se muestra sin esperar).
+    Cuando el texto se acerca al límite de Telegram, cierra el mensaje actual y
+    continúa en uno nuevo.
+
+    `send(text)` debe devolver el message_id del mensaje enviado y
+    `edit(message_id, text, final)` reemplazar su texto; ambos reciben el texto
+    crudo del asistente y se encargan del formato. Las ediciones intermedias
+    (`final=False`) no frenan el streaming: como mucho hay una en vuelo y, si
+    sigue pendiente, la siguiente se omite. Si no se puede enviar el mensaje de
+    continuación (p. ej. se descartó porque la respuesta quedó obsoleta), el
+    progresivo se cierra: ya no edita ningún mensaje, para no sobrescribir el
+    anterior con la continuación. Si lo que no llegó a enviarse fue el mensaje
+    provisional, el texto se envía en un mensaje nuevo que pasa a ser el que se edita.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[Optional[int]]],
+        edit: Callable[[int, str], Awaitable],
+        placeholder: str = "✍️",
+        empty_text: str = "⚠️ No he podido generar una respuesta. Inténtalo de nuevo, por favor.",
+        edit_interval: float = 1.0,
+        min_chars: int = 60,
+        rollover_length: int = DEFAULT_ROLLOVER_LENGTH,
+    ):
+        self._send = send
+        self._edit = edit
+        self.placeholder = placeholder
+        self.empty_text = empty_text
+        self.edit_interval = edit_interval
+        self.min_chars = min_chars
+        self.rollover_length = rollover_length
+        self.message_ids = []
+        self.edits = 0
+        self.closed = False
+        self._text = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self._placeholder_task: Optional[asyncio.Task] = None
+        self._edit_task: Optional[asyncio.Task] = None
+
+    def begin(self):
+        """Envía el mensaje provisional en segundo plano, sin esperar a OpenAI."""
+        if self._placeholder_task is None:
+            self._placeholder_task = asyncio.create_task(self._send(self.placeholder))
+
+    async def _current_message_id(self) -> Optional[int]:
+        if not self.message_ids:
+            self.begin()
+            message_id = await self._placeholder_task
+            if message_id is None:
+                return None
+            self.message_ids.append(message_id)
+        return self.message_ids[-1]
+
+    async def _show(self, text: str, final: bool = False):
+        if self.closed or text == self._shown:
+            return
+        if self._edit_task is not None and not self._edit_task.done():
+            if not final:
+                return
+            await self._edit_task
+        message_id = await self._current_message_id()
+        if message_id is None:
+            # No hay mensaje que editar: el texto (o la nota final) va en uno nuevo
+            message_id = await self._send(text)
+            if message_id is not None:
+                self.message_ids.append(message_id)
+                self._shown = text
+                self._last_edit = time.monotonic()
+            return
+        self._shown = text
+        self._last_edit = time.monotonic()
+        self.edits += 1
+        if final:
+            await self._edit(message_id, text, True)
+        else:
+            self._edit_task = asyncio.create_task(self._edit(message_id, text, False))
+
+    async def _rollover(self):
+        while len(self._text) > self.rollover_length:
+            head, rest = split_for_rollover(self._text, self.rollover_length)
+            await self._show(head, final=True)
+            self._text = rest
+            self._shown = ""
+            message_id = await self._send(rest[:self.rollover_length] or self.placeholder)
+            if message_id is None:
+                # El último mensaje ya tiene su texto definitivo: no se vuelve a editar
+                self.closed = True
+                return
+            self.message_ids.append(message_id)
+            self._shown = rest[:self.rollover_length]
+            self._last_edit = time.monotonic()
+
+    async def append(self, delta: str):
+        """Añade un fragmento de la respuesta y actualiza el mensaje si toca."""
+        self._text += delta
+        if self.closed:
+            return
+        if len(self._text) > self.rollover_length:
+            await self._rollover()
+            return
+        first = not self._shown
+        elapsed = time.monotonic() - self._last_edit
+        new_chars = len(self._text) - len(self._shown)
+        if self._text.strip() and (first or (elapsed >= self.edit_interval and new_chars >= self.min_chars)):
+            await self._show(self._text)
+
+    async def finish(self) -> str:
+        """Muestra el texto final completo y devuelve el texto del último mensaje."""
+        if self._text.strip():
+            await self._show(self._text, final=True)
+        elif self._placeholder_task is not None:
+            # No llegó ningún texto: no dejar el mensaje provisional colgado
+            await self._show(self.empty_text, final=True)
+        return self._text
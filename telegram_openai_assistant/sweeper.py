@@ -0,0 +1,124 @@
+# sweeper.py
+# Limpieza periódica de los chats inactivos: memoria del proceso y threads de OpenAI antiguos
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class IdleSweeper:
+    """
+    Mantiene en memoria solo los chats con actividad reciente.
+
+    Cada turno llama a `touch(group_id)`. Cada `interval` segundos, los chats
+    sin actividad desde hace `idle_ttl` segundos (si es > 0) se pasan a `evict(group_id)`,
+    que saca su estado de memoria (lo persistente se queda en el `StateStore`
+    y se vuelve a leer con el siguiente mensaje) y devuelve False si el chat
+    está ocupado y hay que dejarlo para la siguiente pasada.
+
+    Con `thread_ttl` > 0 se piden además a `stale_threads(antes_de, límite)`
+    los threads sin usar desde hace `thread_ttl` segundos y se borran con
+    `delete_thread(group_id, thread_id)`, como mucho `batch` por pasada.
+    """
+
+    def __init__(self, evict: Callable[[int], Awaitable[bool]], idle_ttl: float = 3600.0, interval: float = 300.0,
+                 stale_threads: Optional[Callable[[float, int], Awaitable[List[Tuple[int, str]]]]] = None,
+                 delete_thread: Optional[Callable[[int, str], Awaitable[bool]]] = None,
+                 thread_ttl: float = 0.0, batch: int = 100):
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.thread_ttl = thread_ttl
+        self.batch = batch
+        self._evict = evict
+        self._stale_threads = stale_threads
+        self._delete_thread = delete_thread
+        # Del chat con actividad más antigua al más reciente
+        self._last_active: "OrderedDict[int, float]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"evicted": 0, "busy": 0, "threads_deleted": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._last_active)
+
+    def touch(self, group_id: int):
+        """Marca actividad en el chat."""
+        if self.idle_ttl <= 0:
+            return
+        self._last_active[group_id] = time.time()
+        self._last_active.move_to_end(group_id)
+
+    def track(self, group_ids: Iterable[int]):
+        """Empieza a contar la inactividad de chats que ya estaban en memoria (p. ej. cargados al arrancar)."""
+        if self.idle_ttl <= 0:
+            return
+        now = time.time()
+        for group_id in group_ids:
+            if group_id not in self._last_active:
+                self._last_active[group_id] = now
+                self._last_active.move_to_end(group_id, last=False)
+
+    async def sweep(self) -> int:
+        """Saca de memoria los chats inactivos y borra los threads caducados; devuelve los chats sacados."""
+        cutoff = time.time() - self.idle_ttl
+        evicted, busy = 0, []
+        while self.idle_ttl > 0 and self._last_active:
+            group_id, last_active = next(iter(self._last_active.items()))
+            if last_active > cutoff:
+                break
+            del self._last_active[group_id]
+            try:
+                if await self._evict(group_id):
+                    evicted += 1
+                else:
+                    busy.append(group_id)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("No se pudo sacar de memoria el chat %s: %s", group_id, e)
+        # Los ocupados se revisan en la siguiente pasada (salvo que escriban antes)
+        for group_id in busy:
+            if group_id not in self._last_active:
+                self._last_active[group_id] = cutoff
+                self._last_active.move_to_end(group_id, last=False)
+        self.stats["evicted"] += evicted
+        self.stats["busy"] += len(busy)
+
+        if self.thread_ttl > 0 and self._stale_threads is not None and self._delete_thread is not None:
+            deleted = 0
+            for group_id, thread_id in await self._stale_threads(time.time() - self.thread_ttl, self.batch):
+                try:
+                    deleted += bool(await self._delete_thread(group_id, thread_id))
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.warning("No se pudo borrar el thread %s del chat %s: %s", thread_id, group_id, e)
+            self.stats["threads_deleted"] += deleted
+            if deleted:
+                logger.info("Threads inactivos borrados: %s", deleted)
+        if evicted:
+            logger.debug("Chats inactivos sacados de memoria: %s (%s en memoria)", evicted, len(self._last_active))
+        return evicted
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error("Error en la limpieza de chats inactivos: %s", e)
+
+    async def close(self):
+        """Detiene la limpieza periódica."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,137 @@
+# thread_registry.py
+# Registro único de threads de OpenAI por chat, compartido por todos los bots
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class ThreadRegistry:
+    """
+    Asocia cada `group_id` con su thread de OpenAI.
+
+    Los datos viven en SQLite para sobrevivir a los reinicios, con una caché LRU
+    en memoria delante para que un turno normal no toque el disco más que para
+    actualizar la marca de último uso. Si otro proceso escribe en la misma base
+    de datos (p. ej. otro proceso de la flota borra un thread con /end), SQLite
+    cambia su `data_version` y la caché se vacía antes de la siguiente consulta.
+    """
+
+    def __init__(self, db_path: str, cache_size: int = 1024, busy_timeout_ms: int = 5000):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, str]" = OrderedDict()
+        self._data_version: Optional[int] = None
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # Espera máxima a que otro proceso suelte la base de datos antes de fallar con "database is locked"
+        self._db.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            " group_id INTEGER PRIMARY KEY,"
+            " thread_id TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+
+    def __contains__(self, group_id: int) -> bool:
+        return self.get(group_id) is not None
+
+    def _remember(self, group_id: int, thread_id: str):
+        self._cache[group_id] = thread_id
+        self._cache.move_to_end(group_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _sync(self):
+        """Vacía la caché si otra conexión ha escrito en la base de datos desde la última consulta."""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._cache.clear()
+            self._data_version = version
+
+    def get(self, group_id: int) -> Optional[str]:
+        """Devuelve el thread_id del chat, primero desde la caché y si no desde SQLite."""
+        self._sync()
+        thread_id = self._cache.get(group_id)
+        if thread_id is not None:
+            self._cache.move_to_end(group_id)
+            return thread_id
+        row = self._db.execute("SELECT thread_id FROM threads WHERE group_id = ?", (group_id,)).fetchone()
+        if row is None:
+            return None
+        self._remember(group_id, row[0])
+        return row[0]
+
+    def set(self, group_id: int, thread_id: str):
+        """Guarda (o reemplaza) el thread del chat."""
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO threads (group_id, thread_id, created_at, last_used) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(group_id) DO UPDATE SET thread_id = excluded.thread_id,"
+            " created_at = excluded.created_at, last_used = excluded.last_used",
+            (group_id, thread_id, now, now),
+        )
+        self._remember(group_id, thread_id)
+
+    def touch(self, group_id: int):
+        """Actualiza la marca de último uso del chat."""
+        self._db.execute("UPDATE threads SET last_used = ? WHERE group_id = ?", (time.time(), group_id))
+
+    def use(self, group_id: int) -> Optional[str]:
+        """Devuelve el thread del chat y, si tiene, actualiza su marca de último uso."""
+        thread_id = self.get(group_id)
+        if thread_id:
+            self.touch(group_id)
+        return thread_id
+
+    def last_used(self, group_id: int) -> Optional[float]:
+        """Marca de tiempo (epoch) del último turno del chat, o None si no tiene thread."""
+        row = self._db.execute("SELECT last_used FROM threads WHERE group_id = ?", (group_id,)).fetchone()
+        return row[0] if row else None
+
+    def stale(self, before: float, limit: int = 100) -> List[Tuple[int, str]]:
+        """Chats (group_id, thread_id) cuyo último turno es anterior a `before`, los más antiguos primero."""
+        return self._db.execute(
+            "SELECT group_id, thread_id FROM threads WHERE last_used < ? ORDER BY last_used LIMIT ?",
+            (before, limit),
+        ).fetchall()
+
+    def evict(self, group_id: int):
+        """Saca el chat de la caché en memoria; sigue en SQLite."""
+        self._cache.pop(group_id, None)
+
+    def delete(self, group_id: int) -> bool:
+        """Olvida el thread del chat. Devuelve True si existía."""
+        self._cache.pop(group_id, None)
+        cursor = self._db.execute("DELETE FROM threads WHERE group_id = ?", (group_id,))
+        return cursor.rowcount > 0
+
+    async def get_or_create(self, group_id: int, create: Callable[[], Awaitable]) -> Optional[str]:
+        """
+        Devuelve el thread del chat o lo crea con `create` (p. ej. `client.beta.threads.create`).
+        Es la única consulta que necesita un turno; solo llama a OpenAI si el chat es nuevo.
+        """
+        thread_id = self.use(group_id)
+        if thread_id:
+            return thread_id
+
+        logger.debug("No se encontró un thread_id para group_id: %s, creando uno nuevo.", group_id)
+        thread = await create()
+        if not (thread and getattr(thread, 'id', None)):
+            logger.error("No se pudo crear un thread para group_id: %s", group_id)
+            return None
+        self.set(group_id, thread.id)
+        logger.debug("Nuevo thread_id creado: %s para group_id: %s", thread.id, group_id)
+        return thread.id
+
+    def close(self):
+        self._db.close()
@@ -1,40 +1,32 @@
 # utils.py
-import json
 from pathlib import Path
 import datetime
 
-# Paths to the files
-message_count_file = Path("message_count.json")
-qa_file = Path("questions_answers.json")
+from .config import message_count_path, qa_log_dir
+from .message_counter import MessageCounter
+from .qa_log import append_records, migrate_json_array
 
-def get_message_count():
-    """Retrieve the current message count."""
-    if not message_count_file.exists():
-        return {"date": str(datetime.date.today()), "count": 0}
-    with open(message_count_file) as file:
-        return json.load(file)
+# Q&A logs already migrated from the legacy JSON array by this process
+_migrated_qa_files = set()
 
-def update_message_count(new_count):
-    """Update the message count in the file."""
-    with open(message_count_file, 'w') as file:
-        json.dump({"date": str(datetime.date.today()), "count": new_count}, file)
+def get_message_count():
+    """Retrieve today's message count across all bots and chats, as last saved by the running bots."""
+    counter = MessageCounter(message_count_path)
+    return {"date": str(datetime.date.today()), "count": counter.daily_total()}
 
 def save_qa(telegram_id, username, question, answer, bot_name):
     """Save question and answer pairs to a file with user information for each bot."""
-    # Specify the file for each bot's Q&A data
-    qa_file = Path(f"{bot_name}_questions_answers.json")
-    
-    if not qa_file.exists():
-        with open(qa_file, 'w') as file:
-            json.dump([], file)
-    
-    with open(qa_file, 'r+') as file:
-        data = json.load(file)
-        data.append({
-            "telegram_id": telegram_id,
-            "username": username,
-            "question": question,
-            "answer": answer
-        })
-        file.seek(0)
-        json.dump(data, file, indent=4)
+    # Same append-only log as the running bot (Bot.qa_log), one JSON record per line
+    qa_file = Path(qa_log_dir) / f"{bot_name}_questions_answers.jsonl"
+
+    if qa_file not in _migrated_qa_files:
+        qa_file.parent.mkdir(parents=True, exist_ok=True)
+        migrate_json_array(Path(f"{bot_name}_questions_answers.json"), qa_file)
+        _migrated_qa_files.add(qa_file)
+
+    append_records(qa_file, [{
+        "telegram_id": telegram_id,
+        "username": username,
+        "question": question,
+        "answer": answer
+    }])
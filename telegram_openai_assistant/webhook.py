@@ -0,0 +1,145 @@
+# webhook.py
+# Servidor ASGI único: webhooks de todos los bots y comprobaciones de salud
+import asyncio
+import hashlib
+import hmac
+import json
+from typing import Awaitable, Callable, Dict, Optional
+
+from .log import get_logger
+from .metrics import REGISTRY
+
+try:
+    import uvicorn
+except ImportError:  # Solo hace falta para servir HTTP (webhooks y health checks)
+    uvicorn = None
+
+logger = get_logger(__name__)
+
+WEBHOOK_PREFIX = "/telegram/"
+MAX_BODY_SIZE = 1 << 20  # Las actualizaciones de Telegram no se acercan ni de lejos a 1 MB
+
+
+def webhook_path(token: str) -> str:
+    """Ruta del webhook de un bot: un hash del token, para no exponerlo en URLs ni logs."""
+    return WEBHOOK_PREFIX + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+class WebhookServer:
+    """
+    Aplicación ASGI que atiende en un solo puerto a todos los bots.
+
+    - `POST /telegram/<hash del token>`: recibe una actualización de Telegram,
+      comprueba la cabecera `X-Telegram-Bot-Api-Secret-Token` y se la pasa al
+      destino de esa ruta (p. ej. `Bot.deliver_update`, que la mete en la
+      `update_queue` de su `Application`).
+    - `GET /healthz`: el proceso está vivo.
+    - `GET /readyz`: `is_ready()` es cierto (503 si no).
+    - `GET /metrics`: métricas de este proceso en formato de texto de Prometheus.
+    - `GET /`: compatibilidad con el antiguo keep_alive.
+
+    `routes` asocia cada ruta con una corrutina `deliver(update_json)`.
+    """
+
+    def __init__(self, routes: Dict[str, Callable[[dict], Awaitable]], is_ready: Callable[[], bool],
+                 host: str = "0.0.0.0", port: int = 10000, secret_token: Optional[str] = None):
+        self.routes = routes
+        self.is_ready = is_ready
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token
+        self.stats = {"updates": 0, "rejected": 0}
+        self._server = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.is_ready()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            # El arranque y la parada los gestiona start_bots, no el servidor
+            while (await receive())["type"] != "lifespan.shutdown":
+                pass
+            return
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"]
+        if method == "GET" and path == "/healthz":
+            await self._respond(send, 200, "ok")
+        elif method == "GET" and path == "/readyz":
+            await self._respond(send, 200 if self.ready else 503, "ready" if self.ready else "starting")
+        elif method == "GET" and path == "/metrics":
+            await self._respond(send, 200, REGISTRY.render(), content_type=b"text/plain; version=0.0.4; charset=utf-8")
+        elif method == "GET" and path == "/":
+            await self._respond(send, 200, "Bot is still running!")
+        elif path.startswith(WEBHOOK_PREFIX):
+            if method != "POST":
+                await self._respond(send, 405, "method not allowed")
+                return
+            await self._handle_update(scope, receive, send)
+        else:
+            await self._respond(send, 404, "not found")
+
+    async def _handle_update(self, scope, receive, send):
+        deliver = self.routes.get(scope["path"])
+        if deliver is None:
+            await self._respond(send, 404, "not found")
+            return
+        if self.secret_token is not None:
+            headers = dict(scope["headers"])
+            received = headers.get(b"x-telegram-bot-api-secret-token", b"")
+            if not hmac.compare_digest(received, self.secret_token.encode()):
+                self.stats["rejected"] += 1
+                await self._respond(send, 403, "forbidden")
+                return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > MAX_BODY_SIZE:
+                await self._respond(send, 413, "payload too large")
+                return
+            if not message.get("more_body"):
+                break
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            logger.warning("Actualización no válida en %s: %s", scope['path'], e)
+            await self._respond(send, 400, "bad request")
+            return
+
+        # Se responde enseguida: la actualización se procesa en segundo plano
+        await deliver(data)
+        self.stats["updates"] += 1
+        await self._respond(send, 200, "ok")
+
+    @staticmethod
+    async def _respond(send, status: int, text: str, content_type: bytes = b"text/plain; charset=utf-8"):
+        body = text.encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def start(self):
+        """Arranca el servidor HTTP en segundo plano."""
+        if uvicorn is None:
+            raise RuntimeError("El servidor HTTP necesita uvicorn: pip install uvicorn")
+        config = uvicorn.Config(self, host=self.host, port=self.port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._task = asyncio.create_task(self._server.serve())
+        logger.info("Servidor HTTP escuchando en %s:%s", self.host, self.port)
+
+    async def stop(self):
+        """Deja de aceptar peticiones y espera a que el servidor termine."""
+        if self._server is None:
+            return
+        self._server.should_exit = True
+        await self._task
+        self._server = None
+        self._task = None